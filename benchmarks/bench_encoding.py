@@ -0,0 +1,75 @@
+"""
+Benchmarks the collage encoding profiles, reporting encode time and output size for each.
+
+Usage:
+    python -m benchmarks.bench_encoding [--quick] [--seed 7]
+
+Collages are built from the real perk images when PERKS_IMG_DIR holds them, otherwise from
+generated icons. The run.py suite only records the times, sizes are printed here.
+"""
+# Generic imports
+import argparse
+import glob
+import io
+import random
+import tempfile
+import time
+
+# Custom imports
+from benchmarks.common import DEFAULT_SEED, mMakeCatalog, mMakePerkImages, mMeasure
+from entities.utils.files import mGetConfigProperty, mGetFile
+from entities.utils.images import ENCODING_PROFILES, mCreateCollage, mEncodeImage, mGetEncodingProfile
+
+COLLAGES = 8
+
+
+def mMakeCollages(aImages: list[str], aSeed: int) -> list:
+    _random = random.Random(aSeed)
+    return [mCreateCollage(_random.sample(aImages, 4), 800, 160, aTitle=f'Build for user bench{_index}') for _index in range(COLLAGES)]
+
+
+def mMeasureProfiles(aCollages: list, aNumber: int) -> dict[str, dict[str, float]]:
+    """
+    Encode every collage with every profile. Times are per collage, sizes are the mean bytes.
+    """
+    _results = {}
+    for _name in ENCODING_PROFILES:
+        _profile = mGetEncodingProfile(_name)
+        _sizes = []
+        for _collage in aCollages:
+            _buffer = io.BytesIO()
+            mEncodeImage(_collage, _buffer, _profile)
+            _sizes.append(_buffer.tell())
+        _time = mMeasure(lambda: [mEncodeImage(_collage, io.BytesIO(), _profile) for _collage in aCollages], aNumber) / len(aCollages)
+        _results[_name] = {"time": _time, "bytes": sum(_sizes) / len(_sizes)}
+    return _results
+
+
+def mWithCollages(aSeed: int, aFunction):
+    # Prefer the real perk images, the generated ones are a stand-in
+    _real = sorted(glob.glob(f'{mGetFile(mGetConfigProperty("PERKS_IMG_DIR"))}/*.png'))
+    if len(_real) >= 4:
+        return aFunction(mMakeCollages(_real, aSeed))
+    with tempfile.TemporaryDirectory() as _imgDir:
+        return aFunction(mMakeCollages(mMakePerkImages(_imgDir, mMakeCatalog(40, aSeed=aSeed)), aSeed))
+
+
+def mRun(aSeed: int = DEFAULT_SEED, aQuick: bool = False) -> dict[str, float]:
+    _results = mWithCollages(aSeed, lambda aCollages: mMeasureProfiles(aCollages, 1 if aQuick else 3))
+    return {f'encoding.{_name}': _result["time"] for _name, _result in _results.items()}
+
+
+if __name__ == '__main__':
+    _parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _parser.add_argument('--quick', action='store_true', help='Fewer iterations, for a fast sanity check.')
+    _parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    _args = _parser.parse_args()
+
+    _start = time.perf_counter()
+    _results = mWithCollages(_args.seed, lambda aCollages: mMeasureProfiles(aCollages, 1 if _args.quick else 3))
+    _baseline = _results["png"]
+    print(f'{"profile":<16} {"encode ms":>10} {"KB":>10} {"vs png time":>12} {"vs png size":>12}')
+    for _name, _result in _results.items():
+        print(f'{_name:<16} {_result["time"] * 1e3:>10.1f} {_result["bytes"] / 1024:>10.1f} '
+              f'{_result["time"] / _baseline["time"]:>11.2f}x {_result["bytes"] / _baseline["bytes"]:>11.2f}x')
+    print(f'done in {time.perf_counter() - _start:.1f}s')
@@ -0,0 +1,26 @@
+"""
+Benchmarks the fuzzy matching helpers in entities/utils/rare.py with typed-like inputs.
+"""
+# Custom imports
+from benchmarks.common import DEFAULT_SEED, mMakeCatalog, mMakeTypos, mMeasure
+from entities.utils import rare
+
+
+def mRun(aSeed: int = DEFAULT_SEED, aQuick: bool = False) -> dict[str, float]:
+    _names = [_perk['name'] for _perk in mMakeCatalog(aSeed=aSeed)]
+    _inputs = mMakeTypos(_names, 50, aSeed=aSeed)
+    _builds = [_inputs[_index:_index + 4] for _index in range(0, len(_inputs), 4)]
+    _number = 1 if aQuick else 5
+
+    def _mEach(aFunction):
+        return lambda: [aFunction(_input, _names) for _input in _inputs]
+
+    # Times are per input string, or per four-perk build for the batch resolver
+    _perInput = len(_inputs)
+    return {
+        "fuzzy.list_most_similar_partial": mMeasure(_mEach(rare.mListMostSimilarPartial), _number) / _perInput,
+        "fuzzy.find_most_similar_partial": mMeasure(_mEach(rare.mFindMostSimilarPartial), _number) / _perInput,
+        "fuzzy.find_most_similar_jelly": mMeasure(_mEach(rare.mFindMostSimilarJelly), _number) / _perInput,
+        "fuzzy.find_most_similar_leven": mMeasure(_mEach(rare.mFindMostSimilarLeven), _number) / _perInput,
+        "fuzzy.resolve_batch_of_4": mMeasure(lambda: [rare.mResolveMostSimilarBatch(_build, _names) for _build in _builds], _number) / len(_builds)
+    }
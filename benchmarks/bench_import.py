@@ -0,0 +1,68 @@
+"""
+Benchmarks the bulk match importer against registering the same matches one by one, on an
+embedded SQLite database with the bot's schema.
+
+Usage:
+    python -m benchmarks.bench_import [--quick] [--seed 7] [--rows 50000]
+
+The run.py suite records seconds per row, rows per second are printed here.
+"""
+# Generic imports
+import argparse
+import csv
+import os
+import random
+import tempfile
+
+# Custom imports
+from benchmarks.common import DEFAULT_SEED, EmbeddedSQLRetriever, mMakeCatalog, mMakeDatabase, mMeasure
+from entities.utils.importer import MATCH_PERK_COLUMNS, mGetCatalog, mImportCsv
+
+ROW_BY_ROW_LIMIT = 2000
+
+
+def mWriteMatchesCsv(aPath: str, aNames: list[str], aRows: int, aSeed: int) -> None:
+    _random = random.Random(aSeed)
+    with open(aPath, 'w', newline='', encoding='utf-8') as _file:
+        _writer = csv.writer(_file, lineterminator='\n')
+        _writer.writerow(['id', 'user', 'match_date', 'outcome', *MATCH_PERK_COLUMNS])
+        for _index in range(aRows):
+            _writer.writerow([_index + 1, _random.randrange(200), '2024-09-01 20:00:00', _random.choice(['ESCAPE', 'DEATH']), *_random.sample(aNames, 4)])
+
+
+def mMeasureImport(aRows: int, aSeed: int, aRepeat: int) -> dict[str, float]:
+    """
+    Seconds per row for the bulk import and for the per-row statements it replaces.
+    """
+    _catalog = mMakeCatalog(aSeed=aSeed)
+    _names = [_perk['name'] for _perk in _catalog]
+    _sql = EmbeddedSQLRetriever(mMakeDatabase(_catalog, aMatches=0, aSeed=aSeed))
+    _perkCatalog = mGetCatalog(_sql)
+    _random = random.Random(aSeed)
+    _rowByRow = min(aRows, ROW_BY_ROW_LIMIT)
+    _matches = [{"userId": _random.randrange(200), "matchResult": 'ESCAPE', "matchDate": '2024-09-01 20:00:00', "perkNames": _random.sample(_names, 4)} for _ in range(_rowByRow)]
+    with tempfile.TemporaryDirectory() as _dir:
+        _path = os.path.join(_dir, 'matches.csv')
+        mWriteMatchesCsv(_path, _names, aRows, aSeed)
+        _bulk = mMeasure(lambda: mImportCsv(_path, _sql, _perkCatalog), 1, aRepeat) / aRows
+    _single = mMeasure(lambda: [_sql.mRegisterMatchResult(_match) for _match in _matches], 1, aRepeat) / _rowByRow
+    _sql.conn.close()
+    return {"bulk": _bulk, "row_by_row": _single}
+
+
+def mRun(aSeed: int = DEFAULT_SEED, aQuick: bool = False) -> dict[str, float]:
+    _results = mMeasureImport(5000 if aQuick else 50000, aSeed, 2 if aQuick else 3)
+    return {f'import.matches_{_name}_per_row': _time for _name, _time in _results.items()}
+
+
+if __name__ == '__main__':
+    _parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _parser.add_argument('--quick', action='store_true', help='Fewer iterations, for a fast sanity check.')
+    _parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    _parser.add_argument('--rows', type=int, default=50000, help='Rows in the imported file.')
+    _args = _parser.parse_args()
+
+    _results = mMeasureImport(_args.rows, _args.seed, 2 if _args.quick else 3)
+    for _name, _time in _results.items():
+        print(f'{_name:<12} {1 / _time:>12,.0f} rows/s')
+    print(f'speedup      {_results["row_by_row"] / _results["bulk"]:>12.1f}x')
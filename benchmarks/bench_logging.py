@@ -0,0 +1,119 @@
+"""
+Measures the logging overhead of a /dbdrandom call with the legacy synchronous file handlers
+and with the queue-based pipeline in log/logger.py.
+
+Usage:
+    python -m benchmarks.bench_logging [--rolls 2000] [--blacklist 0.5] [--seed 7]
+
+As part of the suite (benchmarks/run.py), mRun reports per-call times rather than overheads.
+"""
+# Generic imports
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+# Custom imports
+from benchmarks.common import DEFAULT_SEED, mMakeCatalog
+from log import logger
+from log.logger import mLogInfo
+from entities.workers.dbd.perks import PerkTracker
+
+_ULTRABOT_LOGGER = logging.getLogger('UltraBot')
+
+
+def mRunRandomBuilds(aRolls: int, aBlacklistRatio: float, aSeed: int) -> float:
+    """
+    Run the rolls and the log lines a /dbdrandom emits around them. Returns seconds per call.
+    """
+    random.seed(aSeed)
+    _perks = mMakeCatalog(aSeed=aSeed)
+    _tracker = PerkTracker('1', 'bench', _perks)
+    _blacklisted = random.sample(_perks, int(len(_perks) * aBlacklistRatio))
+    _tracker.mSetBlackList({_perk['name'] for _perk in _blacklisted})
+    _start = time.perf_counter()
+    for _ in range(aRolls):
+        mLogInfo('Found worker for user 1')
+        mLogInfo('Random build requested for user 1')
+        _tracker.mGetRoll()
+        mLogInfo('Collage of size 815x175 created with title Build for user bench')
+        mLogInfo('Image saved to assets/dbd/imgs/generated/bench_randombuild_001.png')
+        mLogInfo('Random build provided for user 1')
+    return (time.perf_counter() - _start) / aRolls
+
+
+def mUseHandlers(aHandlers: list[logging.Handler]) -> list[logging.Handler]:
+    _previous = list(_ULTRABOT_LOGGER.handlers)
+    for _handler in _previous:
+        _ULTRABOT_LOGGER.removeHandler(_handler)
+    for _handler in aHandlers:
+        _ULTRABOT_LOGGER.addHandler(_handler)
+    return _previous
+
+
+def mLegacyHandlers(aLogDir: str) -> list[logging.Handler]:
+    # Same setup log/logger.py used before: one synchronous FileHandler per file
+    _handlers = []
+    for _name, _level in [('info', logging.INFO), ('error', logging.ERROR), ('trace', logging.DEBUG), ('discord', logging.DEBUG)]:
+        _handler = logging.FileHandler(os.path.join(aLogDir, f'{_name}.log'), encoding='utf-8', mode='w')
+        _handler.setLevel(_level)
+        _handler.setFormatter(logger.formatter)
+        _handlers.append(_handler)
+    return _handlers
+
+
+def mBenchmark(aRolls: int, aBlacklistRatio: float, aSeed: int) -> dict:
+    _results = {}
+    with tempfile.TemporaryDirectory() as _tmpDir:
+        # Roll cost without any log output
+        _previous = mUseHandlers([logging.NullHandler()])
+        _results['no_handlers'] = mRunRandomBuilds(aRolls, aBlacklistRatio, aSeed)
+
+        # Legacy synchronous handlers
+        _legacy = mLegacyHandlers(_tmpDir)
+        mUseHandlers(_legacy)
+        _results['sync_file_handlers'] = mRunRandomBuilds(aRolls, aBlacklistRatio, aSeed)
+        for _handler in _legacy:
+            _handler.close()
+
+        # Queue-based pipeline, including the time the listener needs to drain the queue
+        mUseHandlers(_previous)
+        logger.mConfigureLogging(_tmpDir)
+        _start = time.perf_counter()
+        _results['queue_pipeline'] = mRunRandomBuilds(aRolls, aBlacklistRatio, aSeed)
+        logger.mStopListener()
+        _results['queue_pipeline_drained'] = (time.perf_counter() - _start) / aRolls
+
+    # Express results as overhead over the roll itself
+    _base = _results['no_handlers']
+    return {
+        "rolls": aRolls,
+        "blacklist_ratio": aBlacklistRatio,
+        "roll_us": round(_base * 1e6, 2),
+        "overhead_us": {_name: round((_value - _base) * 1e6, 2) for _name, _value in _results.items() if _name != 'no_handlers'}
+    }
+
+
+def mRun(aSeed: int = DEFAULT_SEED, aQuick: bool = False) -> dict[str, float]:
+    _rolls = 200 if aQuick else 1000
+    _results = {}
+    with tempfile.TemporaryDirectory() as _tmpDir:
+        _previous = mUseHandlers([logging.NullHandler()])
+        _results['logging.dbdrandom_no_handlers'] = mRunRandomBuilds(_rolls, 0.5, aSeed)
+        mUseHandlers(_previous)
+        logger.mConfigureLogging(_tmpDir)
+        _results['logging.dbdrandom_queue_pipeline'] = mRunRandomBuilds(_rolls, 0.5, aSeed)
+        logger.mStopListener()
+    return _results
+
+
+if __name__ == '__main__':
+    _parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _parser.add_argument('--rolls', type=int, default=2000)
+    _parser.add_argument('--blacklist', type=float, default=0.5)
+    _parser.add_argument('--seed', type=int, default=7)
+    _args = _parser.parse_args()
+    print(json.dumps(mBenchmark(_args.rolls, _args.blacklist, _args.seed), indent=4))
@@ -0,0 +1,30 @@
+"""
+Benchmarks collage creation and saving, with a generated-images directory already holding files.
+"""
+# Generic imports
+import os
+import random
+import tempfile
+
+# Custom imports
+from benchmarks.common import DEFAULT_SEED, mMakeCatalog, mMakePerkImages, mMeasure
+from entities.utils.images import mCreateCollage, mSaveImage
+
+EXISTING_FILES = 500
+
+
+def mRun(aSeed: int = DEFAULT_SEED, aQuick: bool = False) -> dict[str, float]:
+    _random = random.Random(aSeed)
+    _number = 5 if aQuick else 20
+    with tempfile.TemporaryDirectory() as _imgDir, tempfile.TemporaryDirectory() as _outDir:
+        _images = mMakePerkImages(_imgDir, mMakeCatalog(40, aSeed=aSeed))
+        _builds = [_random.sample(_images, 4) for _ in range(16)]
+        # Other users' renders in the same directory
+        for _index in range(EXISTING_FILES):
+            open(os.path.join(_outDir, f'user{_index}_randombuild_000.png'), 'w').close()
+        _collage = mCreateCollage(_builds[0], 800, 160, aTitle='Build for user bench')
+        _outPath = os.path.join(_outDir, 'bench_randombuild.png')
+        return {
+            "render.create_collage": mMeasure(lambda: mCreateCollage(_random.choice(_builds), 800, 160, aTitle='Build for user bench'), _number),
+            "render.save_image": mMeasure(lambda: mSaveImage(_collage, _outPath), _number)
+        }
@@ -0,0 +1,23 @@
+"""
+Benchmarks PerkTracker.mGetRoll at different blacklist densities.
+"""
+# Generic imports
+import random
+
+# Custom imports
+from benchmarks.common import DEFAULT_SEED, mMakeCatalog, mMeasure
+from entities.workers.dbd.perks import PerkTracker
+
+BLACKLIST_DENSITIES = (0.0, 0.5, 0.9, 0.95)
+
+
+def mRun(aSeed: int = DEFAULT_SEED, aQuick: bool = False) -> dict[str, float]:
+    _catalog = mMakeCatalog(aSeed=aSeed)
+    _results = {}
+    for _density in BLACKLIST_DENSITIES:
+        random.seed(aSeed)
+        _tracker = PerkTracker('1', 'bench', _catalog)
+        _blacklisted = random.sample(_catalog, int(len(_catalog) * _density))
+        _tracker.mSetBlackList({_perk['name'] for _perk in _blacklisted})
+        _results[f'roll.blacklist_{int(_density * 100)}'] = mMeasure(_tracker.mGetRoll, 50 if aQuick else 300)
+    return _results
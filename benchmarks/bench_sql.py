@@ -0,0 +1,27 @@
+"""
+Benchmarks SQLRetriever queries against an embedded SQLite database with the bot's schema.
+"""
+# Generic imports
+import random
+
+# Custom imports
+from benchmarks.common import DEFAULT_SEED, mMakeCatalog, mMakeDatabase, mMeasure
+from entities.utils.sql import SQLRetriever
+
+
+def mRun(aSeed: int = DEFAULT_SEED, aQuick: bool = False) -> dict[str, float]:
+    _random = random.Random(aSeed)
+    _catalog = mMakeCatalog(aSeed=aSeed)
+    _names = [_perk['name'] for _perk in _catalog]
+    _sql = SQLRetriever(mMakeDatabase(_catalog, aMatches=2000 if aQuick else 20000, aSeed=aSeed))
+    _number = 5 if aQuick else 30
+    _match = {"userId": 1, "matchResult": 'ESCAPE', "matchDate": '2024-09-01 20:00:00', "perkNames": _random.sample(_names, 4)}
+    _blacklist = set(_random.sample(_names, 30))
+    return {
+        "sql.all_perks_basic_info": mMeasure(_sql.mGetAllPerksBasicInfo, _number),
+        "sql.get_blacklist": mMeasure(lambda: _sql.mGetBlackList('1'), _number),
+        "sql.update_blacklist_30": mMeasure(lambda: _sql.mUpdateBlackList('1', _blacklist), _number),
+        "sql.register_match_result": mMeasure(lambda: _sql.mRegisterMatchResult(_match), _number),
+        "sql.perk_usage_all": mMeasure(lambda: _sql.mGetPerkUsage('most', None, 10), _number),
+        "sql.perk_usage_user": mMeasure(lambda: _sql.mGetPerkUsage('most', 1, 10), _number)
+    }
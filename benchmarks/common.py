@@ -0,0 +1,157 @@
+"""
+Shared fixtures for the benchmark suites: seeded synthetic data, an embedded database with
+the bot's schema and a timing helper.
+"""
+# Generic imports
+import csv
+import os
+import random
+import sqlite3
+import time
+
+# Specific imports
+from PIL import Image, ImageDraw
+
+# Custom imports
+from entities.utils.files import mGetDBDDataDir
+from entities.utils.sql import SQLRetriever
+from entities.utils.rare import mSuperCleanString
+
+DEFAULT_SEED = 7
+CATALOG_SIZE = 150
+
+SCHEMA = """
+CREATE TABLE characters (id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE perks (name TEXT PRIMARY KEY, main_effect TEXT, is_exhaustion INTEGER, owner_id INTEGER);
+CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE blacklists (user_id INTEGER, perk_name TEXT);
+CREATE TABLE matches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, user INTEGER, outcome TEXT, match_date TEXT,
+    perk_1_name TEXT, perk_2_name TEXT, perk_3_name TEXT, perk_4_name TEXT
+);
+CREATE INDEX blacklists_user ON blacklists (user_id);
+CREATE INDEX matches_user ON matches (user);
+"""
+
+_WORDS = ['survivor', 'generator', 'hook', 'killer', 'aura', 'seconds', 'meters', 'speed', 'exhausted', 'healing',
+          'action', 'repair', 'totem', 'chest', 'injured', 'scream', 'window', 'pallet', 'skill', 'check']
+
+
+def mGetPerkTitles() -> list[str]:
+    # Real perk names from the usage template
+    _path = os.path.join(mGetDBDDataDir(), 'templates', 'dbdperkusage_template.csv')
+    with open(_path, 'r', encoding='utf-8') as _file:
+        return [_row['title'] for _row in csv.DictReader(_file)]
+
+
+def mMakeCatalog(aSize: int = CATALOG_SIZE, aSeed: int = DEFAULT_SEED) -> list[dict]:
+    """
+    Build a perk catalog shaped like SQLRetriever.mGetAllPerksBasicInfo's result, using the real
+    perk names first and padding with synthetic ones.
+    """
+    _random = random.Random(aSeed)
+    _titles = mGetPerkTitles()[:aSize]
+    _titles += [f'Synthetic Perk {_index}' for _index in range(len(_titles), aSize)]
+    return [{
+        "name": _title,
+        "main_effect": ' '.join(_random.choice(_WORDS) for _ in range(_random.randint(30, 80))) + '.',
+        "exhaustion": _random.random() < 0.1,
+        "character": f'Survivor {_index % 45}'
+    } for _index, _title in enumerate(_titles)]
+
+
+def mMakeTypos(aTitles: list[str], aCount: int, aSeed: int = DEFAULT_SEED) -> list[str]:
+    # Partial, lowercased and misspelled inputs like users type them
+    _random = random.Random(aSeed)
+    _inputs = []
+    for _ in range(aCount):
+        _title = _random.choice(aTitles).lower()
+        _cut = _title[:_random.randint(3, max(3, len(_title)))]
+        if len(_cut) > 4 and _random.random() < 0.5:
+            _index = _random.randrange(len(_cut))
+            _cut = _cut[:_index] + _cut[_index + 1:]
+        _inputs.append(_cut)
+    return _inputs
+
+
+def mMakePerkImages(aDir: str, aCatalog: list[dict], aSize: int = 256, aSeed: int = DEFAULT_SEED, aUsePerkNames: bool = False) -> list[str]:
+    # Transparent icons with a few filled shapes, close to the real perk icons. With aUsePerkNames
+    # files are named like PerkTracker.mGetImage expects them
+    _random = random.Random(aSeed)
+    _paths = []
+    for _index, _perk in enumerate(aCatalog):
+        _fileName = f'{mSuperCleanString(_perk["name"])}.png' if aUsePerkNames else f'perk_{_index}.png'
+        _path = os.path.join(aDir, _fileName)
+        _image = Image.new('RGBA', (aSize, aSize), (0, 0, 0, 0))
+        _draw = ImageDraw.Draw(_image)
+        _draw.regular_polygon((aSize // 2, aSize // 2, aSize // 2 - 4), 4, rotation=45, fill=(60, 30, 90, 255), outline='white')
+        for _ in range(6):
+            _x, _y = _random.randrange(aSize // 2), _random.randrange(aSize // 2)
+            _color = tuple(_random.randrange(256) for _ in range(3)) + (255,)
+            _draw.ellipse((_x, _y, _x + _random.randint(20, aSize // 2), _y + _random.randint(20, aSize // 2)), fill=_color)
+        _image.save(_path)
+        _paths.append(_path)
+    return _paths
+
+
+def mMakeDatabase(aCatalog: list[dict], aUsers: int = 200, aMatches: int = 20000, aSeed: int = DEFAULT_SEED) -> sqlite3.Connection:
+    """
+    Create an in-memory SQLite database with the bot's tables filled with seeded data.
+    """
+    _random = random.Random(aSeed)
+    _conn = sqlite3.connect(':memory:')
+    _conn.executescript(SCHEMA)
+    _characters = sorted({_perk['character'] for _perk in aCatalog})
+    _conn.executemany('INSERT INTO characters VALUES (?, ?)', list(enumerate(_characters)))
+    _conn.executemany('INSERT INTO perks VALUES (?, ?, ?, ?)', [
+        (_perk['name'], _perk['main_effect'], int(_perk['exhaustion']), _characters.index(_perk['character'])) for _perk in aCatalog
+    ])
+    _conn.executemany('INSERT INTO users VALUES (?, ?)', [(_user, f'user{_user}') for _user in range(aUsers)])
+    _names = [_perk['name'] for _perk in aCatalog]
+    _conn.executemany('INSERT INTO blacklists VALUES (?, ?)', [
+        (_user, _name) for _user in range(aUsers) for _name in _random.sample(_names, _random.randint(0, 40))
+    ])
+    _conn.executemany('INSERT INTO matches (user, outcome, match_date, perk_1_name, perk_2_name, perk_3_name, perk_4_name) VALUES (?, ?, ?, ?, ?, ?, ?)', [
+        (_random.randrange(aUsers), _random.choice(['ESCAPE', 'DEATH']), '2024-09-01 20:00:00', *_random.sample(_names, 4)) for _ in range(aMatches)
+    ])
+    _conn.commit()
+    return _conn
+
+
+class EmbeddedSQLRetriever(SQLRetriever):
+    """
+    SQLRetriever on a shared embedded database, rewriting the MySQL-only syntax its queries use.
+    """
+    connection: sqlite3.Connection = None
+
+    def __init__(self, aConnection: sqlite3.Connection = None) -> None:
+        super().__init__(aConnection or self.connection)
+
+    @staticmethod
+    def mToSQLite(aQuery: str) -> str:
+        # MySQL escapes quotes with a backslash and upserts with ON DUPLICATE KEY
+        _query = aQuery.replace("\\'", "''")
+        return _query.replace('ON DUPLICATE KEY UPDATE name = VALUES(name)', 'ON CONFLICT(id) DO UPDATE SET name = excluded.name')
+
+    def mRetrieve(self, aQuery: str) -> tuple:
+        return super().mRetrieve(self.mToSQLite(aQuery))
+
+    def mExecute(self, aQuery: str) -> None:
+        super().mExecute(self.mToSQLite(aQuery))
+
+    def __del__(self):
+        # The connection is shared, it's closed with the database
+        pass
+
+
+def mMeasure(aFunction, aNumber: int = 100, aRepeat: int = 5) -> float:
+    """
+    Return the best per-call time in seconds over aRepeat runs of aNumber calls.
+    """
+    _best = float('inf')
+    for _ in range(aRepeat):
+        _start = time.perf_counter()
+        for _ in range(aNumber):
+            aFunction()
+        _best = min(_best, (time.perf_counter() - _start) / aNumber)
+    return _best
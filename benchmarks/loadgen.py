@@ -0,0 +1,339 @@
+"""
+Synthetic load generator. Drives the Dbd and Music cog callbacks with stub Interactions, so no
+Discord connection is needed, and reports throughput, latency percentiles, event-loop lag and
+the memory held by DbdHandler.
+
+Every simulated user starts with /dbdrandom and then issues a weighted mix of commands,
+autocomplete keystrokes and result buttons, with exponential think times in between. Each
+stubbed Discord call waits --api-latency-ms. By default the workers use an embedded SQLite
+database with the bot's schema and all files are written to a temporary directory; pass
+--mysql to use the database configured in .env instead. /play is called by users that are not
+in a voice channel, so only the command path runs, not the playback.
+
+Usage:
+    python -m benchmarks.loadgen [--users 2000] [--actions 10] [--ramp 10] [--think-ms 500]
+                                 [--api-latency-ms 50] [--seed 7] [--mysql] [--output load.json]
+"""
+# Generic imports
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Specific imports
+from collections import defaultdict
+from types import FunctionType, ModuleType
+
+# Custom imports
+from benchmarks.common import DEFAULT_SEED, EmbeddedSQLRetriever, mMakeCatalog, mMakeDatabase, mMakePerkImages
+from cogs.dbd import Dbd
+from cogs.musicplayer import Music
+from entities.handlers.dbd import DbdHandler
+from entities.utils.metrics import mGetProcessStats
+from entities.utils.sql import SQLRetriever
+from entities.workers.dbd import worker
+from log import logger
+
+# Relative weights of the actions a user takes after the first /dbdrandom
+ACTION_MIX = {
+    "dbdrandom": 30,
+    "dbdretry": 20,
+    "dbdban": 10,
+    "autocomplete": 25,
+    "button": 10,
+    "play": 5
+}
+
+_messageIds = itertools.count(10 ** 15)
+
+
+class StubMessage:
+    def __init__(self, aChannel: 'StubChannel', aContent: str, aView) -> None:
+        self.id = next(_messageIds)
+        self.channel = aChannel
+        self.content = aContent
+        self.view = aView
+
+    async def delete(self) -> None:
+        await asyncio.sleep(self.channel.latency)
+        self.channel.messages.pop(self.id, None)
+
+
+class StubChannel:
+    def __init__(self, aLatency: float) -> None:
+        self.latency = aLatency
+        self.messages: dict[int, StubMessage] = {}
+
+    async def fetch_message(self, aMessageId: int) -> StubMessage:
+        await asyncio.sleep(self.latency)
+        if aMessageId not in self.messages:
+            raise LookupError(f'Unknown message {aMessageId}')
+        return self.messages[aMessageId]
+
+
+class StubResponse:
+    def __init__(self, aInteraction: 'StubInteraction') -> None:
+        self.__interaction = aInteraction
+        self.message: StubMessage | None = None
+
+    async def send_message(self, content: str = None, *, file=None, view=None, embed=None, ephemeral: bool = False) -> None:
+        await asyncio.sleep(self.__interaction.channel.latency)
+        # Uploads are not sent anywhere, only the file handle has to be released
+        if file is not None:
+            file.close()
+        self.message = StubMessage(self.__interaction.channel, content, view)
+        if not ephemeral:
+            self.__interaction.channel.messages[self.message.id] = self.message
+
+
+class StubUser:
+    def __init__(self, aId: int, aGuild: 'StubGuild') -> None:
+        self.id = aId
+        self.name = f'loaduser{aId}'
+        self.guild = aGuild
+        self.voice = None
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class StubGuild:
+    def __init__(self, aId: int) -> None:
+        self.id = aId
+
+
+class StubInteraction:
+    def __init__(self, aUser: StubUser, aChannel: StubChannel, aCommand: str) -> None:
+        self.user = aUser
+        self.guild = aUser.guild
+        self.channel = aChannel
+        self.command = aCommand
+        self.response = StubResponse(self)
+
+    async def original_response(self) -> StubMessage:
+        await asyncio.sleep(self.channel.latency)
+        return self.response.message
+
+
+class StubBot:
+    latency = 0.05
+    guilds = []
+
+
+class LoadStats:
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.loopLag: list[float] = []
+
+    async def mRecord(self, aName: str, aCall) -> None:
+        _start = time.perf_counter()
+        try:
+            await aCall
+        except Exception as e:
+            self.errors[aName][type(e).__name__] += 1
+        finally:
+            self.latencies[aName].append(time.perf_counter() - _start)
+
+
+class LoadSession:
+    """
+    One simulated user with its own interactions and the last result view it got.
+    """
+
+    def __init__(self, aUser: StubUser, aChannel: StubChannel, aDbd: Dbd, aMusic: Music, aCatalog: list[str], aRandom: random.Random, aStats: LoadStats) -> None:
+        self.user = aUser
+        self.channel = aChannel
+        self.dbd = aDbd
+        self.music = aMusic
+        self.catalog = aCatalog
+        self.random = aRandom
+        self.stats = aStats
+        self.lastMessage: StubMessage | None = None
+
+    def mInteraction(self, aCommand: str) -> StubInteraction:
+        return StubInteraction(self.user, self.channel, aCommand)
+
+    async def mCommand(self, aCog, aCommand, *args) -> None:
+        _ctx = self.mInteraction(aCommand.name)
+        await self.stats.mRecord(aCommand.name, aCommand.callback(aCog, _ctx, *args))
+        if _ctx.response.message is not None and _ctx.response.message.view is not None:
+            self.lastMessage = _ctx.response.message
+
+    async def mAutoComplete(self) -> None:
+        # Type a perk name one keystroke at a time
+        _callback = self.random.choice([
+            self.dbd.mRemovePerkAutoComplete, self.dbd.mAddPerkAutoComplete,
+            self.dbd.mHelpAutoComplete, self.dbd.mShowImageAutoComplete
+        ])
+        _target = self.random.choice(self.catalog).lower()
+        for _length in range(1, min(len(_target), self.random.randint(3, 10)) + 1):
+            await self.stats.mRecord(f'autocomplete.{_callback.__name__}', _callback(self.mInteraction('autocomplete'), _target[:_length]))
+
+    async def mPressButton(self) -> None:
+        if self.lastMessage is None:
+            return
+        _button = self.random.choice(self.lastMessage.view.children)
+        await self.stats.mRecord(f'button.{_button.custom_id}', _button.callback(self.mInteraction('button')))
+
+    async def mRun(self, aActions: int, aThinkSeconds: float) -> None:
+        await self.mCommand(self.dbd, self.dbd.mGetRandomBuild)
+        _names, _weights = list(ACTION_MIX), list(ACTION_MIX.values())
+        for _ in range(aActions - 1):
+            if aThinkSeconds:
+                await asyncio.sleep(self.random.expovariate(1 / aThinkSeconds))
+            match self.random.choices(_names, _weights)[0]:
+                case 'dbdrandom':
+                    await self.mCommand(self.dbd, self.dbd.mGetRandomBuild)
+                case 'dbdretry':
+                    await self.mCommand(self.dbd, self.dbd.mRetryBuild, str(self.random.randint(1, 4)))
+                case 'dbdban':
+                    await self.mCommand(self.dbd, self.dbd.mRemovePerkAndRerun, str(self.random.randint(1, 4)))
+                case 'autocomplete':
+                    await self.mAutoComplete()
+                case 'button':
+                    await self.mPressButton()
+                case 'play':
+                    await self.mCommand(self.music, self.music.mPlay, f'https://www.youtube.com/watch?v=load{self.random.randrange(1000)}', False)
+
+
+def mDeepSizeOf(aObject) -> int:
+    """
+    Approximate bytes reachable from an object, without counting modules, classes and functions.
+    """
+    _seen = set()
+    _pending = [aObject]
+    _size = 0
+    while _pending:
+        _obj = _pending.pop()
+        if id(_obj) in _seen or isinstance(_obj, (type, ModuleType, FunctionType)):
+            continue
+        _seen.add(id(_obj))
+        _size += sys.getsizeof(_obj)
+        _pending.extend(gc.get_referents(_obj))
+    return _size
+
+
+def mPercentiles(aValues: list[float]) -> dict:
+    _sorted = sorted(aValues)
+    _pick = lambda _q: _sorted[min(len(_sorted) - 1, int(_q * len(_sorted)))] * 1000
+    return {"count": len(_sorted), "p50_ms": _pick(0.5), "p95_ms": _pick(0.95), "p99_ms": _pick(0.99), "max_ms": _sorted[-1] * 1000}
+
+
+async def mMonitorLoopLag(aStats: LoadStats, aStop: asyncio.Event, aInterval: float = 0.05) -> None:
+    # How late the loop wakes a sleeping task is the time other tasks kept it blocked
+    while not aStop.is_set():
+        _start = time.perf_counter()
+        await asyncio.sleep(aInterval)
+        aStats.loopLag.append(time.perf_counter() - _start - aInterval)
+
+
+async def mGenerateLoad(aArgs: argparse.Namespace, aCatalog: list[str]) -> dict:
+    _random = random.Random(aArgs.seed)
+    _stats = LoadStats()
+    _dbd = Dbd(StubBot())
+    _music = Music(StubBot())
+    _handlerStart = mDeepSizeOf(DbdHandler.instance)
+    _processStart = mGetProcessStats()
+
+    # Users are spread over a few guilds and channels, and arrive during the ramp
+    _guilds = [StubGuild(_index) for _index in range(max(1, aArgs.users // 100))]
+    _channels = [StubChannel(aArgs.api_latency_ms / 1000) for _ in _guilds]
+
+    async def _mStartUser(aIndex: int) -> None:
+        await asyncio.sleep(aArgs.ramp * aIndex / aArgs.users)
+        _user = StubUser(aIndex, _guilds[aIndex % len(_guilds)])
+        _session = LoadSession(_user, _channels[aIndex % len(_channels)], _dbd, _music, aCatalog, random.Random(_random.random()), _stats)
+        await _session.mRun(aArgs.actions, aArgs.think_ms / 1000)
+
+    _stop = asyncio.Event()
+    _monitor = asyncio.create_task(mMonitorLoopLag(_stats, _stop))
+    _start = time.perf_counter()
+    await asyncio.gather(*(_mStartUser(_index) for _index in range(aArgs.users)))
+    _elapsed = time.perf_counter() - _start
+    _stop.set()
+    await _monitor
+
+    # Report
+    _handlerEnd = mDeepSizeOf(DbdHandler.instance)
+    _processEnd = mGetProcessStats()
+    _total = sum(len(_values) for _values in _stats.latencies.values())
+    return {
+        "config": {_key: _value for _key, _value in vars(aArgs).items() if _key != 'output'},
+        "elapsed_s": _elapsed,
+        "requests": _total,
+        "throughput_rps": _total / _elapsed,
+        "latency": {_name: mPercentiles(_values) for _name, _values in sorted(_stats.latencies.items())},
+        "errors": {_name: dict(_counts) for _name, _counts in _stats.errors.items()},
+        "loop_lag": mPercentiles(_stats.loopLag) if _stats.loopLag else {},
+        "handler_memory": {
+            "start_bytes": _handlerStart,
+            "end_bytes": _handlerEnd,
+            "bytes_per_user": (_handlerEnd - _handlerStart) / aArgs.users
+        },
+        "process": {
+            "cpu_seconds": _processEnd["cpu_seconds"] - _processStart["cpu_seconds"],
+            "max_rss_bytes": _processEnd.get("max_rss_bytes")
+        }
+    }
+
+
+def mPrintReport(aReport: dict) -> None:
+    print(f'{aReport["requests"]} requests in {aReport["elapsed_s"]:.1f}s, {aReport["throughput_rps"]:.1f} req/s')
+    print(f'{"name":<42} {"count":>7} {"errors":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    for _name, _entry in aReport["latency"].items():
+        _errors = sum(aReport["errors"].get(_name, {}).values())
+        print(f'{_name:<42} {_entry["count"]:>7} {_errors:>6} {_entry["p50_ms"]:>8.1f} {_entry["p95_ms"]:>8.1f} {_entry["p99_ms"]:>8.1f} {_entry["max_ms"]:>8.1f}')
+    _lag = aReport["loop_lag"]
+    if _lag:
+        print(f'event loop lag: p50 {_lag["p50_ms"]:.1f} ms, p99 {_lag["p99_ms"]:.1f} ms, max {_lag["max_ms"]:.1f} ms')
+    _memory = aReport["handler_memory"]
+    print(f'DbdHandler memory: {_memory["start_bytes"] / 1e6:.1f} MB -> {_memory["end_bytes"] / 1e6:.1f} MB, {_memory["bytes_per_user"] / 1e3:.1f} KB per user')
+    for _name, _counts in aReport["errors"].items():
+        print(f'errors in {_name}: {_counts}')
+
+
+if __name__ == '__main__':
+    _parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _parser.add_argument('--users', type=int, default=2000)
+    _parser.add_argument('--actions', type=int, default=10, help='Actions per user, including the first /dbdrandom.')
+    _parser.add_argument('--ramp', type=float, default=10.0, help='Seconds over which users arrive.')
+    _parser.add_argument('--think-ms', type=float, default=500.0, help='Mean pause between the actions of a user.')
+    _parser.add_argument('--api-latency-ms', type=float, default=50.0, help='Delay of each stubbed Discord call.')
+    _parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    _parser.add_argument('--mysql', action='store_true', help='Use the database configured in .env.')
+    _parser.add_argument('--output', help='Write the report JSON to this path.')
+    _args = _parser.parse_args()
+
+    # With MySQL the perk names come from the real catalog
+    _catalog = SQLRetriever().mGetAllPerksBasicInfo() if _args.mysql else mMakeCatalog(aSeed=_args.seed)
+    with tempfile.TemporaryDirectory() as _workDir:
+        # Config paths are relative to the working directory, so generated files land here
+        _repoDir = os.getcwd()
+        os.chdir(_workDir)
+        logger.mConfigureLogging(_workDir)
+        _perksDir = os.path.join('assets', 'dbd', 'imgs', 'perks')
+        os.makedirs(_perksDir)
+        os.makedirs(os.path.join('assets', 'dbd', 'imgs', 'generated'))
+        mMakePerkImages(_perksDir, _catalog, aSeed=_args.seed, aUsePerkNames=True)
+        if not _args.mysql:
+            # Workers create their retriever through the worker module's name
+            EmbeddedSQLRetriever.connection = mMakeDatabase(_catalog, aUsers=_args.users, aSeed=_args.seed)
+            worker.SQLRetriever = EmbeddedSQLRetriever
+        try:
+            _report = asyncio.run(mGenerateLoad(_args, [_perk['name'] for _perk in _catalog]))
+        finally:
+            worker.SQLRetriever = SQLRetriever
+            logger.mStopListener()
+            os.chdir(_repoDir)
+
+    mPrintReport(_report)
+    if _args.output:
+        with open(_args.output, 'w') as _file:
+            json.dump(_report, _file, indent=4)
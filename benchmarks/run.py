@@ -0,0 +1,100 @@
+"""
+Runs the benchmark suites with a fixed seed and compares the results against a baseline.
+
+Usage:
+    python -m benchmarks.run [--quick] [--seed 7] [--only roll,sql] [--output results.json]
+                             [--baseline baseline.json] [--save-baseline baseline.json] [--threshold 0.2]
+
+Baselines depend on the machine, so save one locally before changing the code and compare
+against it afterwards. The exit code is 1 when a benchmark got slower than the threshold allows.
+"""
+# Generic imports
+import argparse
+import importlib
+import json
+import platform
+import sys
+import tempfile
+import time
+
+# Custom imports
+from benchmarks.common import DEFAULT_SEED
+from log import logger
+
+SUITES = ['roll', 'fuzzy', 'sql', 'import', 'render', 'encoding', 'logging']
+DEFAULT_THRESHOLD = 0.2
+
+
+def mRunSuites(aSuites: list[str], aSeed: int, aQuick: bool) -> dict[str, float]:
+    _results = {}
+    for _suite in aSuites:
+        _module = importlib.import_module(f'benchmarks.bench_{_suite}')
+        _start = time.perf_counter()
+        _results.update(_module.mRun(aSeed, aQuick))
+        print(f'{_suite}: done in {time.perf_counter() - _start:.1f}s', file=sys.stderr)
+    return _results
+
+
+def mCompare(aResults: dict[str, float], aBaseline: dict[str, float], aThreshold: float) -> list[str]:
+    """
+    Print each benchmark next to its baseline and return the names of the ones that regressed.
+    """
+    _regressions = []
+    for _name, _value in sorted(aResults.items()):
+        _base = aBaseline.get(_name)
+        if not _base:
+            print(f'{_name:<44} {_value * 1e6:>12.1f} us   (no baseline)')
+            continue
+        _change = _value / _base - 1
+        _flag = ''
+        if _change > aThreshold:
+            _flag = '  REGRESSION'
+            _regressions.append(_name)
+        print(f'{_name:<44} {_value * 1e6:>12.1f} us   {_change:+7.1%}{_flag}')
+    return _regressions
+
+
+if __name__ == '__main__':
+    _parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _parser.add_argument('--quick', action='store_true', help='Fewer iterations, for a fast sanity check.')
+    _parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    _parser.add_argument('--only', default=','.join(SUITES), help='Comma-separated suites to run.')
+    _parser.add_argument('--output', help='Write the results JSON to this path.')
+    _parser.add_argument('--baseline', help='Compare against this results JSON.')
+    _parser.add_argument('--save-baseline', help='Write the results JSON as the new baseline.')
+    _parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Allowed slowdown ratio, 0.2 means 20%%.')
+    _args = _parser.parse_args()
+
+    # Keep benchmark log output away from log/
+    with tempfile.TemporaryDirectory() as _logDir:
+        logger.mConfigureLogging(_logDir)
+        _results = mRunSuites([_suite.strip() for _suite in _args.only.split(',') if _suite.strip()], _args.seed, _args.quick)
+        logger.mStopListener()
+
+    _report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": _args.seed,
+            "quick": _args.quick,
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S')
+        },
+        "results": _results
+    }
+    for _path in filter(None, [_args.output, _args.save_baseline]):
+        with open(_path, 'w') as _file:
+            json.dump(_report, _file, indent=4)
+
+    _regressions = []
+    if _args.baseline:
+        with open(_args.baseline, 'r') as _file:
+            _baseline = json.load(_file)
+        if _baseline["meta"].get("quick") != _args.quick:
+            print('Warning: baseline and current run use different --quick settings', file=sys.stderr)
+        _regressions = mCompare(_results, _baseline["results"], _args.threshold)
+    else:
+        mCompare(_results, {}, _args.threshold)
+
+    if _regressions:
+        print(f'{len(_regressions)} benchmark(s) regressed more than {_args.threshold:.0%}: {", ".join(_regressions)}', file=sys.stderr)
+        sys.exit(1)
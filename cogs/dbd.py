@@ -1,14 +1,44 @@
+# Generic imports
+import asyncio
+import functools
+import os
+
 # Specific imports
-from discord import app_commands, Interaction, Color, Embed, Message
+from discord import app_commands, Interaction, Color, Embed, File, Message
 from discord.ext import commands
 
 # Custom imports
 from entities.handlers import dbd
 from entities.handlers.buttons import ResultsButtons
-from entities.utils.rare import mCheckIntOrStr, mFindMostSimilarPartial, mListMostSimilarPartial, mBuildEnlistedMessage, mFindMostSimilarJelly
+from entities.utils.rare import mCheckIntOrStr, mFindMostSimilarPartial, mListMostSimilarPartial, mBuildEnlistedMessage, mFindMostSimilarJelly, mResolveMostSimilarBatch
+from entities.utils.metrics import mTimed
+from entities.utils.tracing import mSpan
 from log.logger import mLogInfo, mLogError
 
+def mCachedAutoComplete(aCallback):
+    """
+    Caches the choices of an autocomplete callback per user, command and current input.
+
+    Discord sends an autocomplete request on every keystroke, so retyped inputs are served
+    from the handler's cache until they expire or the user's blacklist changes.
+    """
+    @functools.wraps(aCallback)
+    async def _mWrapper(self, aCtx: Interaction, aCurrInput: str):
+        _cache = self.autoCompleteCache
+        _key = (aCtx.user.id, aCallback.__name__, aCurrInput)
+        _choices = _cache.mGet(_key)
+        if _choices is None:
+            _choices = await aCallback(self, aCtx, aCurrInput)
+            _cache.mSet(_key, _choices)
+        return list(_choices)
+    return _mWrapper
+
 class Dbd(commands.Cog, name='dbd'):
+
+    OWNER_ID = 612432506813284373
+    # Upload limit when the guild's is unknown
+    DEFAULT_FILESIZE_LIMIT = 10 * 1024 * 1024
+
     def __init__(self, aBot: commands.Bot) -> None:
         # Initialize cog
         super().__init__()
@@ -16,11 +46,16 @@ class Dbd(commands.Cog, name='dbd'):
         self.__handler = dbd.DbdHandler()
         mLogInfo('Dbd cog initialized')
 
+    @property
+    def autoCompleteCache(self):
+        return self.__handler.mGetAutoCompleteCache()
+
     @commands.Cog.listener()
     async def on_ready(self):
         mLogInfo('Dbd cog is ready')
 
     @app_commands.command()
+    @mTimed('command', 'ping')
     async def ping(self, aCtx: Interaction):
         yo = round(self.__bot.latency * 1000)
         embed = Embed(title="Pong! :ping_pong:", color=Color.random())
@@ -28,6 +63,7 @@ class Dbd(commands.Cog, name='dbd'):
         await aCtx.response.send_message(embed=embed)
 
     @app_commands.command(name='dbdrandom', description='Returns a random Dead by Daylight survivor perk build.')
+    @mTimed('command', 'dbdrandom')
     async def mGetRandomBuild(self, aCtx: Interaction):
         """
         This method returns a random Dead by Daylight survivor perk build.
@@ -41,13 +77,15 @@ class Dbd(commands.Cog, name='dbd'):
         _perks, _collage = self.__handler.mGetRandomBuild(aCtx)
         # Send message
         _formattedPerks = "  |  ".join(_perks)
-        await aCtx.response.send_message(f'{_formattedPerks}', file=_collage, view=ResultsButtons(self.__handler, aCtx, _perks))
-        _msg: Message = await aCtx.original_response()
+        with mSpan('send_message', layer='discord'):
+            await aCtx.response.send_message(f'{_formattedPerks}', file=_collage, view=ResultsButtons(self.__handler, aCtx, _perks))
+            _msg: Message = await aCtx.original_response()
         # Store message
         self.__handler.mSetLastBuildId(aCtx, _msg.id)
 
     @app_commands.command(name='dbdretry', description='Reruns previous roulette only at a specified index.')
     @app_commands.describe(index='The index of the roulette where the perk to rerun is.')
+    @mTimed('command', 'dbdretry')
     async def mRetryBuild(self, aCtx: Interaction, index: str):
         """
         This method reruns the previous roulette at the specified index.
@@ -63,13 +101,16 @@ class Dbd(commands.Cog, name='dbd'):
             _perks, _collage = self.__handler.mReplacePerk(aCtx, int(index) - 1)
             _msg = "  |  ".join(_perks)
             # Send message
-            await aCtx.response.send_message(_msg, file=_collage, view=ResultsButtons(self.__handler, aCtx, _perks))
-            _msg: Message = await aCtx.original_response()
+            with mSpan('send_message', layer='discord'):
+                await aCtx.response.send_message(_msg, file=_collage, view=ResultsButtons(self.__handler, aCtx, _perks))
+                _msg: Message = await aCtx.original_response()
             # Erase last build message
             try:
                 _lastBuildId = self.__handler.mGetLastBuildId(aCtx)
-                _lastBuildMsg = await aCtx.channel.fetch_message(_lastBuildId)
-                await _lastBuildMsg.delete()
+                with mSpan('fetch_message', layer='discord'):
+                    _lastBuildMsg = await aCtx.channel.fetch_message(_lastBuildId)
+                with mSpan('delete', layer='discord'):
+                    await _lastBuildMsg.delete()
             except Exception as e:
                 mLogError(f"Could not delete previous build message due to error: {str(e)}")
             # Store new build
@@ -79,6 +120,7 @@ class Dbd(commands.Cog, name='dbd'):
             await aCtx.response.send_message(f'No perks to retry at index {index}')
 
     @mRetryBuild.autocomplete("index")
+    @mTimed('autocomplete')
     async def mRetryBuildAutoComplete(self, aCtx: Interaction, aCurrInput: str) -> list[app_commands.Choice[int]]:
         # Show indices if no input
         if aCurrInput == "":
@@ -87,6 +129,7 @@ class Dbd(commands.Cog, name='dbd'):
 
     @app_commands.command(name='dbdban', description='Reruns roulette and removes the perk from your current and future builds.')
     @app_commands.describe(index='The index of the roulette where the perk to remove is.')
+    @mTimed('command', 'dbdban')
     async def mRemovePerkAndRerun(self, aCtx: Interaction, index: str):
         """
         This method removes the perk from the user's future builds.
@@ -105,13 +148,16 @@ class Dbd(commands.Cog, name='dbd'):
             _perks, _collage = self.__handler.mReplacePerk(aCtx, int(index) - 1)
             _msg = "  |  ".join(_perks)
             # Send message
-            await aCtx.response.send_message(_msg, file=_collage, view=ResultsButtons(self.__handler, aCtx, _perks))
-            _response = aCtx.original_response()
+            with mSpan('send_message', layer='discord'):
+                await aCtx.response.send_message(_msg, file=_collage, view=ResultsButtons(self.__handler, aCtx, _perks))
+                _response: Message = await aCtx.original_response()
             # Erase last build message
             try:
                 _lastBuildId = self.__handler.mGetLastBuildId(aCtx)
-                _lastBuildMsg = await aCtx.channel.fetch_message(_lastBuildId)
-                await _lastBuildMsg.delete()
+                with mSpan('fetch_message', layer='discord'):
+                    _lastBuildMsg = await aCtx.channel.fetch_message(_lastBuildId)
+                with mSpan('delete', layer='discord'):
+                    await _lastBuildMsg.delete()
             except Exception as e:
                 mLogError(f"Could not delete previous build message due to error: {str(e)}")
             # Store new build
@@ -121,6 +167,7 @@ class Dbd(commands.Cog, name='dbd'):
             await aCtx.response.send_message(f'No perks to blacklist at index {index}')
 
     @mRemovePerkAndRerun.autocomplete("index")
+    @mTimed('autocomplete')
     async def mRemovePerkAndRerunAutoComplete(self, aCtx: Interaction, aCurrInput: str) -> list[app_commands.Choice[int]]:
         # Show indices if no input
         if aCurrInput == "":
@@ -129,6 +176,7 @@ class Dbd(commands.Cog, name='dbd'):
 
     @app_commands.command(name='dbdbye', description='Removes the perk from your future builds.')
     @app_commands.describe(index='The perk name or the index of the roulette where the perk to remove is.')
+    @mTimed('command', 'dbdbye')
     async def mRemovePerk(self, aCtx: Interaction, index: str):
         """
         This method removes the perk from the user's future builds.
@@ -153,6 +201,8 @@ class Dbd(commands.Cog, name='dbd'):
         await aCtx.response.send_message(f'Perk ***{_perkName}*** removed from future builds')
 
     @mRemovePerk.autocomplete("index")
+    @mTimed('autocomplete')
+    @mCachedAutoComplete
     async def mRemovePerkAutoComplete(self, aCtx: Interaction, aCurrInput: str) -> list[app_commands.Choice[int|str]]:
         # Show indices if no input
         if aCurrInput == "":
@@ -166,6 +216,7 @@ class Dbd(commands.Cog, name='dbd'):
 
     @app_commands.command(name='dbdadd', description='Adds back a perk back to your future builds.')
     @app_commands.describe(perk='The name of the perk to add back to your future builds.')
+    @mTimed('command', 'dbdadd')
     async def mRemoveFromBlackList(self, aCtx: Interaction, perk: str):
         """
         This method adds back the perk to the user's future builds.
@@ -186,6 +237,8 @@ class Dbd(commands.Cog, name='dbd'):
         await aCtx.response.send_message(f'Perk ***{_perkName}*** added back to future builds')
 
     @mRemoveFromBlackList.autocomplete("perk")
+    @mTimed('autocomplete')
+    @mCachedAutoComplete
     async def mAddPerkAutoComplete(self, aCtx: Interaction, aCurrInput: str) -> list[app_commands.Choice[int|str]]:
         # Show first 20 perks if no input
         if aCurrInput == "":
@@ -202,6 +255,7 @@ class Dbd(commands.Cog, name='dbd'):
         return _choices
 
     @app_commands.command(name='dbdbanlist', description='Shows your blacklisted Dead by Daylight perks.')
+    @mTimed('command', 'dbdbanlist')
     async def mGetBlackList(self, aCtx: Interaction):
         """
         This method shows the user's blacklisted perks.
@@ -219,6 +273,7 @@ class Dbd(commands.Cog, name='dbd'):
 
     @app_commands.command(name='dbdhelp', description='Shows the available info for the Dead by Daylight perks.')
     @app_commands.describe(index='The perk name or the index of the roulette where the perk is.')
+    @mTimed('command', 'dbdhelp')
     async def mShowHelp(self, aCtx: Interaction, index: str):
         """
         This method helps in showing the info about the perks.
@@ -247,6 +302,8 @@ class Dbd(commands.Cog, name='dbd'):
             await aCtx.response.send_message('Error showing help. Please try again later.')
 
     @mShowHelp.autocomplete("index")
+    @mTimed('autocomplete')
+    @mCachedAutoComplete
     async def mHelpAutoComplete(self, aCtx: Interaction, aCurrInput: str) -> list[app_commands.Choice[int|str]]:
         # Show indices if no input
         if aCurrInput == "":
@@ -260,6 +317,7 @@ class Dbd(commands.Cog, name='dbd'):
 
     @app_commands.command(name='dbdimg', description='Shows the image of a given Dead by Daylight perk.')
     @app_commands.describe(name='The name of the perk you want to see.')
+    @mTimed('command', 'dbdimg')
     async def mShowImage(self, aCtx: Interaction, name: str):
         """
         This method shows the image of a given perk.
@@ -285,6 +343,8 @@ class Dbd(commands.Cog, name='dbd'):
         await aCtx.response.send_message(f"--- *** {_name} *** ---", file=_image)
 
     @mShowImage.autocomplete("name")
+    @mTimed('autocomplete')
+    @mCachedAutoComplete
     async def mShowImageAutoComplete(self, aCtx: Interaction, aCurrInput: str) -> list[app_commands.Choice[int|str]]:
         # Show first 20 perks if no input
         if aCurrInput == "":
@@ -298,6 +358,7 @@ class Dbd(commands.Cog, name='dbd'):
 
     @app_commands.command(name='dbdset', description='Sets a custom build.')
     @app_commands.describe(perks='The names of the perks you want to see (split by commas).')
+    @mTimed('command', 'dbdset')
     async def mSetCustomBuild(self, aCtx: Interaction, *, perks: str):
         """
         This method sets a custom build for the user.
@@ -311,27 +372,34 @@ class Dbd(commands.Cog, name='dbd'):
 
         # Get correct name for each perk
         _allPerks = self.__handler.mGetAllPerkNames(aCtx)
-        _userPerks = perks.split(',')
-        _perkIds = []
-        
+        _userPerks = [_perkName.strip() for _perkName in perks.split(',')]
+
         if len(_userPerks) != 4:
             mLogError('Invalid number of perks')
             await aCtx.response.send_message('Invalid number of perks. Please provide 4 perks.')
-        
-        for _perkName in _userPerks:
-            mLogInfo(f'Processing specified perk: {_perkName}')
-            _perkName = mFindMostSimilarPartial(_perkName, _allPerks)
-            # Get perk id
-            _perkIds.append(_perkName)
+            return
+
+        # Resolve all perks at once so no perk is picked twice
+        mLogInfo(f'Processing specified perks: {_userPerks}')
+        _matches = mResolveMostSimilarBatch(_userPerks, _allPerks)
+        _perkIds = [_match.match for _match in _matches]
 
         # Set custom build
         _names, _collage = self.__handler.mSetCustomBuild(aCtx, _perkIds)
         _nameStr = "  |  ".join(_names)
 
+        # Point out the perks that were guessed with low confidence
+        _notes = ""
+        for _match in _matches:
+            if _match.ambiguous:
+                mLogInfo(f'Ambiguous perk {_match.token} resolved to {_match.match} ({_match.confidence:.0%})')
+                _notes += f"\n*Not sure about '{_match.token}', used **{_match.match}** ({_match.confidence:.0%} match).*"
+
         # Send message
-        await aCtx.response.send_message(f'--- ***Custom build set*** ---\n{_nameStr}', file=_collage, view=ResultsButtons(self.__handler, aCtx, _perkIds))
+        await aCtx.response.send_message(f'--- ***Custom build set*** ---\n{_nameStr}{_notes}', file=_collage, view=ResultsButtons(self.__handler, aCtx, _perkIds))
 
     @app_commands.command(name='dbdmyusage', description='Resets your custom build.')
+    @mTimed('command', 'dbdmyusage')
     async def mShowUserUsageGraph(self, aCtx: Interaction):
         """
         This method shows the user's perk/results graph.
@@ -347,6 +415,7 @@ class Dbd(commands.Cog, name='dbd'):
         await aCtx.response.send_message(file=_graph)
 
     @app_commands.command(name='dbdusage', description='Shows the perk/results graph of all players.')
+    @mTimed('command', 'dbdusage')
     async def mShowUsageGraph(self, aCtx: Interaction):
         """
         This method shows the user's perk/results graph.
@@ -361,7 +430,45 @@ class Dbd(commands.Cog, name='dbd'):
         # Send message
         await aCtx.response.send_message(file=_graph)
 
+    @app_commands.command(name='dbdexport', description='Exports your match history as a compressed CSV file.')
+    @app_commands.describe(everyone='(owner only) Export the matches of every player.')
+    @mTimed('command', 'dbdexport')
+    async def mExportMatches(self, aCtx: Interaction, everyone: bool = False):
+        """
+        This method exports the match history and uploads it if it fits in a message.
+
+        Args:
+            aCtx (Interaction): The context of the command.
+            everyone (bool): Whether to export every player's matches instead of the user's.
+        """
+        # Log command call
+        mLogInfo(f'Command {aCtx.command} called by {aCtx.user}')
+        if everyone and aCtx.user.id != self.OWNER_ID:
+            await aCtx.response.send_message('You are not authorized to export every match.', ephemeral=True)
+            return
+        # The export can take a while, keep the event loop free meanwhile
+        await aCtx.response.defer(ephemeral=True, thinking=True)
+        _limit = aCtx.guild.filesize_limit if aCtx.guild else self.DEFAULT_FILESIZE_LIMIT
+        try:
+            # Files that fit are copied for the upload, so another export can't change them meanwhile
+            _result = await asyncio.to_thread(self.__handler.mExportMatches, None if everyone else aCtx.user.id, _limit)
+        except Exception:
+            await aCtx.followup.send('The export failed, try again later.', ephemeral=True)
+            return
+        if _result is None:
+            await aCtx.followup.send('This export is already running, try again in a moment.', ephemeral=True)
+            return
+        _msg = f'{_result["rows"]} matches exported ({_result["exported"]} new).'
+        if "snapshot" not in _result:
+            await aCtx.followup.send(f'{_msg} The file is too large to upload, it was saved as {os.path.basename(_result["path"])}.', ephemeral=True)
+            return
+        try:
+            await aCtx.followup.send(_msg, file=File(_result["snapshot"], filename=os.path.basename(_result["path"])), ephemeral=True)
+        finally:
+            os.remove(_result["snapshot"])
+
     @app_commands.command(name='dbdkill', description='Turns off the bot.')
+    @mTimed('command', 'dbdkill')
     async def mKill(self, aCtx: Interaction):
         """
         This method kills the bot.
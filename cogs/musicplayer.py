@@ -1,25 +1,36 @@
 # Specific imports
 from discord import app_commands
-from discord import  FFmpegPCMAudio, Guild, Interaction
+from discord import Guild, Interaction
 from discord.ext import commands
 
 # Custom imports
-from entities.workers.music.music import Player, Song
+from entities.utils.audiocache import mGetAudioCache
+from entities.utils.metrics import mTimed
+from entities.workers.music.music import Player, PlayerRegistry, PlayStatus, Song
 from log.logger import mLogInfo, mLogError
 
 class Music(commands.Cog, name='music'):
-    def __init__(self, aBot: commands.Bot) -> None:
+    def __init__(self, aBot: commands.Bot, aPlayers: PlayerRegistry = None) -> None:
         # Initialize cog
         super().__init__()
         self.__bot: commands.Bot = aBot
+        # One player and voice connection per guild
+        self.__players: PlayerRegistry = aPlayers if aPlayers is not None else PlayerRegistry(aAudioCache=mGetAudioCache())
         mLogInfo('Music cog initialized')
 
+    @property
+    def players(self) -> PlayerRegistry:
+        return self.__players
+
     def mGetGuild(self, aCtx: Interaction) -> Guild:
         for _guild in self.__bot.guilds:
             if aCtx.guild.id == _guild.id:
                 return _guild
         return aCtx.user.guild
 
+    async def cog_unload(self) -> None:
+        await self.__players.mDisconnectAll()
+
     @commands.Cog.listener()
     async def on_ready(self):
         mLogInfo('Music cog is ready')
@@ -27,17 +38,106 @@ class Music(commands.Cog, name='music'):
     @app_commands.command(name='play', description='Play a song')
     @app_commands.describe(url='The URL of the song to play')
     @app_commands.describe(force_next='(optional) Force the song to play next.')
+    @mTimed('command', 'play')
     async def mPlay(self, aCtx: Interaction, url: str, force_next: bool = False):
         mLogInfo(f'Play command received with url: {url}')
-        # Get song data
+        if not await Player.mCanPlay(aCtx):
+            return
+        _player = self.__players.mGetPlayer(self.mGetGuild(aCtx))
+        # Resolving the song can take a while
+        await aCtx.response.defer(thinking=True)
         _song = Song(url)
-        # Spawn player and intialize a playlist
-        _player = Player()
-        _playlist = _player.mGetPlaylist(self.mGetGuild(aCtx))
-        # Add the song to the playlist
-        if force_next:
-            _playlist.mForceNext(_song)
+        try:
+            _status = await _player.mPlay(aCtx, _song, force_next)
+        except Exception as e:
+            mLogError(f'Could not play {url}: {e}')
+            _status = PlayStatus.FAILED
+        if _status is PlayStatus.FAILED:
+            await aCtx.followup.send('Could not play that song.', ephemeral=True)
+        elif _status is PlayStatus.STARTED:
+            await aCtx.followup.send(embed=_song.mGetOutput(_player.playlist.next, _player.playlist.previous))
         else:
-            _playlist.mQueueSong(_song)
-        # Play the song
-        await _player.mPlay(aCtx, _song)
+            await aCtx.followup.send(f'Queued {url} ({len(_player.playlist) - 1} songs up next).')
+
+    @app_commands.command(name='skip', description='Skip the current song')
+    @mTimed('command', 'skip')
+    async def mSkip(self, aCtx: Interaction):
+        _player = self.__players.mFindPlayer(self.mGetGuild(aCtx))
+        if not _player or not _player.mSkip():
+            await aCtx.response.send_message('Nothing is playing.', ephemeral=True)
+            return
+        await aCtx.response.send_message('Skipped.')
+
+    @app_commands.command(name='queue', description='Show the upcoming songs')
+    @mTimed('command', 'queue')
+    async def mShowQueue(self, aCtx: Interaction):
+        _player = self.__players.mFindPlayer(self.mGetGuild(aCtx))
+        if not _player or not _player.playlist.current:
+            await aCtx.response.send_message('The queue is empty.', ephemeral=True)
+            return
+        _playlist = _player.playlist
+        _lines = [f'Now playing: {_playlist.current.title or _playlist.current.url}']
+        for _position in range(min(len(_playlist) - 1, 10)):
+            _song = _playlist[_position]
+            _lines.append(f'{_position + 1}. {_song.title or _song.url}')
+        if len(_playlist) > 11:
+            _lines.append(f'...and {len(_playlist) - 11} more')
+        if _playlist.loop:
+            _lines.append('Looping the queue.')
+        await aCtx.response.send_message('\n'.join(_lines))
+
+    @app_commands.command(name='remove', description='Remove a song from the queue')
+    @app_commands.describe(position='The position of the song in /queue')
+    @mTimed('command', 'remove')
+    async def mRemove(self, aCtx: Interaction, position: int):
+        _player = self.__players.mFindPlayer(self.mGetGuild(aCtx))
+        try:
+            _song = _player.mRemove(position - 1)
+        except (AttributeError, IndexError):
+            await aCtx.response.send_message(f'There is no song #{position} in the queue.', ephemeral=True)
+            return
+        await aCtx.response.send_message(f'Removed {_song.title or _song.url}.')
+
+    @app_commands.command(name='move', description='Move a song to another position in the queue')
+    @app_commands.describe(position='The position of the song in /queue')
+    @app_commands.describe(new_position='Where to move it')
+    @mTimed('command', 'move')
+    async def mMove(self, aCtx: Interaction, position: int, new_position: int):
+        _player = self.__players.mFindPlayer(self.mGetGuild(aCtx))
+        try:
+            _song = _player.playlist.mMove(position - 1, new_position - 1)
+        except (AttributeError, IndexError):
+            await aCtx.response.send_message(f'There is no song #{position} in the queue.', ephemeral=True)
+            return
+        await aCtx.response.send_message(f'Moved {_song.title or _song.url} to #{min(max(new_position, 1), len(_player.playlist) - 1)}.')
+
+    @app_commands.command(name='shuffle', description='Shuffle the queue')
+    @mTimed('command', 'shuffle')
+    async def mShuffle(self, aCtx: Interaction):
+        _player = self.__players.mFindPlayer(self.mGetGuild(aCtx))
+        if not _player:
+            await aCtx.response.send_message('The queue is empty.', ephemeral=True)
+            return
+        _player.playlist.mShuffle()
+        await aCtx.response.send_message('Shuffled the queue.')
+
+    @app_commands.command(name='loop', description='Loop the queue')
+    @app_commands.describe(enabled='Whether finished songs go back to the end of the queue')
+    @mTimed('command', 'loop')
+    async def mLoop(self, aCtx: Interaction, enabled: bool):
+        _player = self.__players.mFindPlayer(self.mGetGuild(aCtx))
+        if not _player:
+            await aCtx.response.send_message('Nothing is playing.', ephemeral=True)
+            return
+        _player.playlist.mSetLoop(enabled)
+        await aCtx.response.send_message(f'Looping is {"on" if enabled else "off"}.')
+
+    @app_commands.command(name='stop', description='Stop the music and leave the voice channel')
+    @mTimed('command', 'stop')
+    async def mStop(self, aCtx: Interaction):
+        _player = self.__players.mFindPlayer(self.mGetGuild(aCtx))
+        if not _player:
+            await aCtx.response.send_message('Nothing is playing.', ephemeral=True)
+            return
+        await _player.mDisconnect()
+        await aCtx.response.send_message('Stopped.')
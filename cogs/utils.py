@@ -1,17 +1,100 @@
+# Generic imports
+import io
+import json
 
 # Specific imports
+from discord import app_commands, File, Interaction
 from discord.ext import commands
 
 # Custom imports
-from log.logger import mLogInfo, mLogError
+from entities.utils.metrics import registry
+from entities.utils.tracing import mGetSlowestTrace, mGetTraces, mToChromeTrace
+from log.logger import mLogInfo, mLogError, mSetModuleDebug, mGetDebugModules
 
 class Utils(commands.Cog, name='utility'):
+
+    OWNER_ID = 612432506813284373
+
     def __init__(self, aBot: commands.Bot) -> None:
         # Initialize cog
         super().__init__()
         self.__bot: commands.Bot = aBot
-        mLogInfo('Dbd cog initialized')
+        mLogInfo('Utils cog initialized')
 
     @commands.Cog.listener()
     async def on_ready(self):
-        mLogInfo('Dbd cog is ready')
\ No newline at end of file
+        mLogInfo('Utils cog is ready')
+
+    @app_commands.command(name='logdebug', description='Switches full log verbosity for a module.')
+    @app_commands.describe(module='The module name, e.g. entities.workers.dbd.perks.', enabled='Whether to log everything from the module.')
+    async def mSetLogDebug(self, aCtx: Interaction, module: str, enabled: bool = True):
+        """
+        This method switches debug logging on or off for a module at runtime.
+
+        Args:
+            aCtx (Interaction): The context of the command.
+            module (str): The module to switch.
+            enabled (bool): Whether to enable full verbosity.
+        """
+        if aCtx.user.id != self.OWNER_ID:
+            mLogError(f'User {aCtx.user} tried to change log verbosity')
+            await aCtx.response.send_message('You are not authorized to change logging.', ephemeral=True)
+            return
+        mSetModuleDebug(module, enabled)
+        mLogInfo(f'Debug logging {"enabled" if enabled else "disabled"} for {module}')
+        _modules = ", ".join(mGetDebugModules()) or "none"
+        await aCtx.response.send_message(f'Debug logging for ***{module}*** is now {"on" if enabled else "off"}.\nModules in debug: {_modules}', ephemeral=True)
+
+    @app_commands.command(name='stats', description='Shows latency and resource metrics of the bot.')
+    @app_commands.describe(layer='(optional) Only show one layer, e.g. command, handler, sql, render or file.')
+    async def mShowStats(self, aCtx: Interaction, layer: str = None):
+        """
+        This method shows the recorded metrics to the owner of the bot.
+
+        Args:
+            aCtx (Interaction): The context of the command.
+            layer (str): The layer to show.
+        """
+        if aCtx.user.id != self.OWNER_ID:
+            await aCtx.response.send_message('You are not authorized to see the stats.', ephemeral=True)
+            return
+        # Slowest entries first
+        _summary = [_entry for _entry in registry.mGetSummary() if not layer or _entry['layer'] == layer]
+        _summary.sort(key=lambda _entry: _entry['avg'] * _entry['count'], reverse=True)
+        _lines = [f'{"name":<42} {"calls":>6} {"errs":>4} {"run":>3} {"avg ms":>8} {"p95 ms":>8}']
+        for _entry in _summary[:20]:
+            _name = f'{_entry["layer"]}:{_entry["name"]}'[-42:]
+            _lines.append(f'{_name:<42} {_entry["count"]:>6} {_entry["errors"]:>4} {_entry["inFlight"]:>3} {_entry["avg"] * 1000:>8.1f} {_entry["p95"] * 1000:>8.0f}')
+        # Gauges such as process resources and cache hit rates
+        for _collector, _values in registry.mGetCollected().items():
+            _values = ", ".join(f'{_key}={_value:.3g}' if isinstance(_value, float) else f'{_key}={_value}' for _key, _value in _values.items())
+            _lines.append(f'{_collector}: {_values}')
+        _msg = "\n".join(_lines)
+        await aCtx.response.send_message(f'```\n{_msg[:1900]}\n```', ephemeral=True)
+
+    @app_commands.command(name='trace', description='Exports recorded traces as Chrome trace-event JSON.')
+    @app_commands.describe(command='(optional) Only export the slowest trace of this command, e.g. dbdban.')
+    async def mExportTrace(self, aCtx: Interaction, command: str = None):
+        """
+        This method sends the recorded traces as a file that can be opened in chrome://tracing or Perfetto.
+
+        Args:
+            aCtx (Interaction): The context of the command.
+            command (str): The command whose slowest trace is exported. All traces are exported if not given.
+        """
+        if aCtx.user.id != self.OWNER_ID:
+            await aCtx.response.send_message('You are not authorized to export traces.', ephemeral=True)
+            return
+        # Get traces to export
+        if command:
+            _trace = mGetSlowestTrace(command)
+            _traces = [_trace] if _trace else []
+        else:
+            _traces = mGetTraces()
+        if not _traces:
+            await aCtx.response.send_message('No traces recorded yet.', ephemeral=True)
+            return
+        # Send as a JSON file
+        _data = json.dumps(mToChromeTrace(_traces)).encode('utf-8')
+        _file = File(io.BytesIO(_data), filename=f'trace_{command or "all"}.json')
+        await aCtx.response.send_message(f'{len(_traces)} trace(s) exported.', file=_file, ephemeral=True)
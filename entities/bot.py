@@ -7,7 +7,9 @@ from os import getenv
 # Custom imports
 from cogs.dbd import Dbd
 from cogs.musicplayer import Music
-from log.logger import mLogInfo, mLogError, mGetHandler
+from cogs.utils import Utils
+from entities.workers.utils.healthcheck import HealthWorker
+from log.logger import mLogInfo, mLogError, mAttachLogger
 
 # Add intents to the bot
 def mLoadIntents():
@@ -30,8 +32,20 @@ def mLoadIntents():
 
     return intents
 
+class UltraBot(commands.Bot):
+    """
+    The bot. Closing it also stops the health tasks and their threads.
+    """
+
+    async def close(self) -> None:
+        if healthWorker is not None:
+            await healthWorker.mStop()
+        await super().close()
+
 # Global bot instance
-bot = commands.Bot(command_prefix='$', intents=mLoadIntents())
+bot = UltraBot(command_prefix='$', intents=mLoadIntents())
+# Scheduler of the health tasks, started with the bot's event loop
+healthWorker: HealthWorker | None = None
 
 # Add a cog to the bot
 async def mAddCog(aCog: commands.Cog):
@@ -68,7 +82,12 @@ async def mSetup():
     mLogInfo('Adding cogs')
     await mAddCog(Dbd(bot))
     await mAddCog(Music(bot))
+    await mAddCog(Utils(bot))
     mLogInfo(f'Current cogs: {bot.cogs}')
+    # Run health tasks on the bot's loop
+    global healthWorker
+    healthWorker = HealthWorker()
+    healthWorker.mStart()
     # Sync commands
     bot.tree.copy_global_to(guild=_guildObj)
     await bot.tree.sync(guild=_guildObj)
@@ -83,4 +102,6 @@ def mRun(aToken: str):
     # Run the bot
     mLogInfo('Running bot')
     bot.setup_hook = mSetup
-    bot.run(aToken, log_handler=mGetHandler('trace'))
+    # Send discord.py's records through the bot's logging queue
+    mAttachLogger('discord')
+    bot.run(aToken, log_handler=None)
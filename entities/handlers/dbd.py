@@ -5,8 +5,12 @@ from typing import Any
 # Specific imports
 from discord import Interaction, File
 # Custom imports
+from entities.utils.cache import TTLCache
+from entities.utils.export import mExportMatches
+from entities.utils.files import mGetConfigProperty
+from entities.utils.metrics import mTimed, registry
 from entities.workers.dbd.worker import DbdWorker
-from log.logger import mLogError, mLogInfo
+from log.logger import mLogDebug, mLogError, mLogInfo
 
 class DbdHandler:
 
@@ -17,22 +21,31 @@ class DbdHandler:
 
     def __init__(self):
         self.__workers = {}
+        # Cache for autocomplete choices, keyed by (user id, command, input)
+        self.__autoCompleteCache = TTLCache(
+            float(mGetConfigProperty('AUTOCOMPLETE_CACHE_TTL_SECS') or 30),
+            int(mGetConfigProperty('AUTOCOMPLETE_CACHE_MAX_ENTRIES') or 2048),
+            aName='autocomplete'
+        )
+        registry.mRegisterCollector('autocomplete_cache', self.__autoCompleteCache.mGetStats)
+        registry.mRegisterCollector('dbd_handler', lambda: {"workers": len(self.__workers)})
         mLogInfo('Dbd handler initialized')
 
     # Creates a worker and optionally returns it
+    @mTimed('handler')
     def mCreateWorker(self, aCtx: Interaction) -> DbdWorker:
         # Check if worker already exists
         _userId = aCtx.user.id
         
         if _userId in self.__workers:
-            mLogInfo(f'Found worker for user {_userId}')
+            mLogDebug('Found worker for user %s', _userId)
             return self.__workers[_userId]
 
         # Create worker and return it
         _worker = DbdWorker(aCtx)
         self.__workers[_userId] = _worker
         mLogInfo(f'Created worker for user {_userId}')
-        mLogInfo(f'Current workers: {self.__workers}')
+        mLogDebug('Current workers: %s', self.__workers)
         return _worker
 
     # Gets user id
@@ -40,11 +53,16 @@ class DbdHandler:
     def mGetUserId(aCtx: Interaction) -> int:
         return aCtx.user.id
 
+    # Returns the autocomplete choices cache
+    def mGetAutoCompleteCache(self) -> TTLCache:
+        return self.__autoCompleteCache
+
     # Returns a worker
     def mGetWorker(self, aUserId: str) -> DbdWorker | None:
         return self.__workers.get(aUserId, None)
 
     # Stores last message sent by the bot
+    @mTimed('handler')
     def mSetLastBuildId(self, aCtx: Interaction, aMessageId: int) -> None:
         # Get worker
         _worker = self.mCreateWorker(aCtx)
@@ -57,6 +75,7 @@ class DbdHandler:
             raise e
 
     # Gets last message sent by the bot
+    @mTimed('handler')
     def mGetLastBuildId(self, aCtx: Interaction) -> int:
         # Get worker
         _worker = self.mCreateWorker(aCtx)
@@ -70,6 +89,7 @@ class DbdHandler:
             raise e
 
     # Waits for five seconds and returns string
+    @mTimed('handler')
     def mGetRandomBuild(self, aCtx: Interaction) -> tuple:
         # Get worker
         _worker = self.mCreateWorker(aCtx)
@@ -83,6 +103,7 @@ class DbdHandler:
             raise e
 
     # Adds perk to the user's blacklist
+    @mTimed('handler')
     def mAddPerkToBlacklist(self, aCtx: Interaction, aPerkId: str) -> str:
         # Get worker
         _worker = self.mCreateWorker(aCtx)
@@ -90,12 +111,14 @@ class DbdHandler:
         # Add perk to blacklist
         try:
             _msg = _worker.mAddToBlackList(aPerkId)
+            self.__autoCompleteCache.mInvalidateOwner(aCtx.user.id)
             return _msg
         except Exception  as e:
             mLogError(f'Error adding perk to blacklist: {e}')
             raise e
 
     # Removes perk from the user's blacklist
+    @mTimed('handler')
     def mRemovePerkFromBlacklist(self, aCtx: Interaction, aPerkId: str) -> str:
         # Get worker
         _worker = self.mCreateWorker(aCtx)
@@ -103,11 +126,13 @@ class DbdHandler:
         # Remove perk from blacklist
         try:
             _msg = _worker.mRemoveFromBlackList(aPerkId)
+            self.__autoCompleteCache.mInvalidateOwner(aCtx.user.id)
             return _msg
         except Exception as e:
             mLogError(f'Error removing perk from blacklist: {e}')
 
     # Replaces perk in the user's build
+    @mTimed('handler')
     def mReplacePerk(self, aCtx: Interaction, aPerkIndex: int) -> tuple[list[str], File]:
         # Get worker
         _worker = self.mCreateWorker(aCtx)
@@ -121,6 +146,7 @@ class DbdHandler:
             raise e
 
     # Gets all valid perks
+    @mTimed('handler')
     def mGetWhitelistedPerkNames(self, aCtx: Interaction) -> list:
         # Get worker
         _worker = self.mCreateWorker(aCtx)
@@ -134,6 +160,7 @@ class DbdHandler:
             raise e
 
     # Gets all blacklisted perks
+    @mTimed('handler')
     def mGetBlacklistedPerkNames(self, aCtx: Interaction) -> set:
         # Get worker
         _worker = self.mCreateWorker(aCtx)
@@ -147,6 +174,7 @@ class DbdHandler:
             raise
 
     # Gets all perks
+    @mTimed('handler')
     def mGetAllPerkNames(self, aCtx: Interaction) -> list:
         # Get worker
         _worker = self.mCreateWorker(aCtx)
@@ -160,6 +188,7 @@ class DbdHandler:
             raise e
 
     # Gets help for a perk
+    @mTimed('handler')
     def mGetHelp(self, aCtx: Interaction, aId: str) -> str:
         # Get worker
         _worker = self.mCreateWorker(aCtx)
@@ -172,6 +201,7 @@ class DbdHandler:
             mLogError(f'Error getting help by name: {e}')
             raise e
 
+    @mTimed('handler')
     def mGetPerkIdFromBuild(self, aCtx: Interaction, aPerkIndex: int) -> str:
         # Get worker
         _worker = self.mCreateWorker(aCtx)
@@ -184,6 +214,7 @@ class DbdHandler:
             mLogError(f'Error getting perk id from build: {e}')
             raise e
 
+    @mTimed('handler')
     def mGetPerkImage(self, aCtx: Interaction, aPerkId: str) -> File:
         # Get worker
         _worker = self.mCreateWorker(aCtx)
@@ -196,6 +227,7 @@ class DbdHandler:
             mLogError(f'Error getting perk image: {e}')
             raise e
 
+    @mTimed('handler')
     def mRegisterWin(self, aCtx: Interaction, aPerkIds: list[str]) -> None:
         # Get worker
         _worker = self.mCreateWorker(aCtx)
@@ -207,6 +239,7 @@ class DbdHandler:
             mLogError(f"Error registering win: {e}")
             raise e
 
+    @mTimed('handler')
     def mRegisterLoss(self, aCtx: Interaction, aPerkIds: list[str]) -> None:
         # Get worker
         _worker = self.mCreateWorker(aCtx)
@@ -218,6 +251,7 @@ class DbdHandler:
             mLogError(f"Error registering loss: {e}")
             raise e
 
+    @mTimed('handler')
     def mSetCustomBuild(self, aCtx: Interaction, aPerkIds: list[str]) -> tuple[Any, Any]:
         # Get worker
         _worker = self.mCreateWorker(aCtx)
@@ -230,6 +264,7 @@ class DbdHandler:
             mLogError(f'Error setting custom build: {e}')
             raise e
 
+    @mTimed('handler')
     def mGetUsageGraph(self, aCtx: Interaction, aUser: int = None) -> File:
         # Get worker
         _worker = self.mCreateWorker(aCtx)
@@ -243,6 +278,16 @@ class DbdHandler:
             mLogError(f'Error getting usage graph: {e}')
             raise e
 
+    @mTimed('handler')
+    def mExportMatches(self, aUser: int = None, aSnapshotMaxBytes: int = None) -> dict | None:
+        # Export on a separate connection, so the workers' connections stay free
+        try:
+            return mExportMatches(aUser=aUser, aSnapshotMaxBytes=aSnapshotMaxBytes)
+        except Exception as e:
+            mLogError(f'Error exporting matches: {e}')
+            raise e
+
+    @mTimed('handler')
     def mUpdateBlacklistToDB(self) -> None:
         for _worker in self.__workers.values():
             try:
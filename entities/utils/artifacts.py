@@ -0,0 +1,182 @@
+# Generic imports
+import os
+import threading
+import time
+
+# Specific imports
+from collections import OrderedDict
+
+# Custom imports
+from entities.utils.files import mGetConfigProperty, mGetDBDDataDir, mGetFile
+from entities.utils.metrics import registry
+from log.logger import mLogError, mLogInfo
+
+
+class ArtifactStore:
+    """
+    Index of the files generated in a directory, oldest first, so expired files and files over
+    the byte quota are removed without listing the directory. Files written by other means are
+    picked up by an occasional reconciliation with os.scandir.
+    """
+
+    def __init__(self, aDir: str, aMaxAgeMinutes: float, aMaxBytes: int, aReconcileMinutes: float = 60, aExcludeFiles: list[str] = None, aName: str = 'artifacts') -> None:
+        self.__dir = os.path.realpath(aDir)
+        self.__maxAge = aMaxAgeMinutes * 60
+        self.__maxBytes = aMaxBytes
+        self.__reconcileInterval = aReconcileMinutes * 60
+        self.__exclude = set(aExcludeFiles or [])
+        self.__name = aName
+        self.__lock = threading.Lock()
+        # Path -> (modified time, size), in creation order
+        self.__files: OrderedDict[str, tuple[float, int]] = OrderedDict()
+        self.__bytes = 0
+        self.__lastReconcile = 0.0
+        # Metrics
+        self.__expired = 0
+        self.__overQuota = 0
+        self.__reconciles = 0
+        self.mReconcile()
+
+    @property
+    def dir(self) -> str:
+        return self.__dir
+
+    def __len__(self) -> int:
+        return len(self.__files)
+
+    def mRegister(self, aPath: str) -> None:
+        """
+        Add a file that was just written, and make room for it if the quota is exceeded.
+        """
+        try:
+            _stat = os.stat(aPath)
+        except FileNotFoundError:
+            return
+        _path = os.path.realpath(aPath)
+        with self.__lock:
+            _previous = self.__files.pop(_path, None)
+            if _previous:
+                self.__bytes -= _previous[1]
+            self.__files[_path] = (_stat.st_mtime, _stat.st_size)
+            self.__bytes += _stat.st_size
+            self.__mEvictOverQuota(_path)
+
+    def mForget(self, aPath: str) -> None:
+        with self.__lock:
+            _entry = self.__files.pop(os.path.realpath(aPath), None)
+            if _entry:
+                self.__bytes -= _entry[1]
+
+    def mCleanup(self, aNow: float = None) -> int:
+        """
+        Remove expired files, reconciling with the directory first if it's due.
+
+        Returns:
+            int: The number of removed files.
+        """
+        _now = aNow or time.time()
+        if _now - self.__lastReconcile >= self.__reconcileInterval:
+            self.mReconcile()
+        _removed = 0
+        with self.__lock:
+            _before = _now - self.__maxAge
+            # Oldest first, so stop at the first file that is still fresh
+            while self.__files:
+                _path, (_mtime, _size) = next(iter(self.__files.items()))
+                if _mtime >= _before:
+                    break
+                self.__mRemove(_path)
+                self.__expired += 1
+                _removed += 1
+        if _removed:
+            mLogInfo(f'{_removed} expired files deleted from {self.__dir}')
+        return _removed
+
+    def mReconcile(self) -> None:
+        """
+        Rebuild the index from the directory, dropping files that no longer exist.
+        """
+        _files = []
+        try:
+            with os.scandir(self.__dir) as _entries:
+                for _entry in _entries:
+                    if _entry.name in self.__exclude or _entry.name.startswith('.') or not _entry.is_file(follow_symlinks=False):
+                        continue
+                    _stat = _entry.stat(follow_symlinks=False)
+                    _files.append((_stat.st_mtime, os.path.realpath(_entry.path), _stat.st_size))
+        except FileNotFoundError:
+            mLogError(f'Artifact directory {self.__dir} not found')
+        _files.sort()
+        with self.__lock:
+            self.__files = OrderedDict((_path, (_mtime, _size)) for _mtime, _path, _size in _files)
+            self.__bytes = sum(_size for _, _, _size in _files)
+            self.__lastReconcile = time.time()
+            self.__reconciles += 1
+            self.__mEvictOverQuota()
+
+    def mGetStats(self) -> dict:
+        return {
+            "files": len(self.__files),
+            "bytes": self.__bytes,
+            "maxBytes": self.__maxBytes,
+            "expired": self.__expired,
+            "overQuota": self.__overQuota,
+            "reconciles": self.__reconciles
+        }
+
+    def __mEvictOverQuota(self, aKeep: str = None) -> None:
+        # Called with the lock held
+        while self.__bytes > self.__maxBytes and self.__files:
+            _path = next(iter(self.__files))
+            if _path == aKeep:
+                break
+            self.__mRemove(_path)
+            self.__overQuota += 1
+
+    def __mRemove(self, aPath: str) -> None:
+        # Called with the lock held
+        _, _size = self.__files.pop(aPath)
+        self.__bytes -= _size
+        try:
+            os.remove(aPath)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            mLogError(f'Could not delete {aPath}: {e}')
+
+
+# Stores by directory, created on first use
+_stores: dict[str, ArtifactStore] = {}
+_storesLock = threading.Lock()
+
+
+def mGetArtifactStores() -> list[ArtifactStore]:
+    with _storesLock:
+        if not _stores:
+            _maxAge = float(mGetConfigProperty('MAX_GENERATED_IMG_AGE') or 60)
+            _maxBytes = int(float(mGetConfigProperty('GENERATED_MAX_MB') or 256) * 1024 * 1024)
+            _reconcile = float(mGetConfigProperty('ARTIFACT_RECONCILE_MINS') or 60)
+            _dirs = {
+                "dbd_images": mGetFile(mGetConfigProperty('GENERATED_IMG_DIR')),
+                "dbd_data": os.path.join(mGetDBDDataDir(), 'generated')
+            }
+            for _name, _dir in _dirs.items():
+                _store = ArtifactStore(_dir, _maxAge, _maxBytes, _reconcile, aExcludeFiles=['.gitignore'], aName=_name)
+                _stores[_store.dir] = _store
+                registry.mRegisterCollector(f'artifacts_{_name}', _store.mGetStats)
+        return list(_stores.values())
+
+
+def mTrackArtifact(aPath: str) -> None:
+    """
+    Register a generated file with the store of its directory, if there is one.
+    """
+    _dir = os.path.realpath(os.path.dirname(aPath))
+    for _store in mGetArtifactStores():
+        if _store.dir == _dir:
+            _store.mRegister(aPath)
+            return
+
+
+def mCleanupArtifacts() -> int:
+    return sum(_store.mCleanup() for _store in mGetArtifactStores())
@@ -0,0 +1,243 @@
+# Generic imports
+import hashlib
+import json
+import os
+import posixpath
+import shutil
+import tempfile
+import zipfile
+
+# Specific imports
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen
+
+# Custom imports
+from entities.utils.files import mDownloadFromGDrive, mGetConfigProperty, mGetFile, mParseJsonFile, mWriteJsonFile
+from entities.utils.metrics import mTimed
+from log.logger import mLogError, mLogInfo
+
+# Manifest kept next to the synced files
+MANIFEST_NAME = '.manifest.json'
+VERIFY_WORKERS = min(8, os.cpu_count() or 1)
+CHUNK_SIZE = 64 * 1024
+
+
+class AssetSource(ABC):
+    """
+    Where an asset archive and, optionally, its manifest come from. A manifest maps each
+    archive member to its sha256 and size: {"files": {"name.png": {"sha256": "...", "size": 123}}}.
+    Downloads from remote sources are only verified when the source provides the manifest.
+    """
+    remote = False
+
+    def mGetManifest(self) -> dict | None:
+        return None
+
+    @abstractmethod
+    def mGetArchive(self, aTmpDir: str) -> str:
+        # Return the path of a local copy of the zip archive
+        ...
+
+
+class LocalSource(AssetSource):
+    def __init__(self, aZipPath: str, aManifestPath: str = None) -> None:
+        self.zipPath = aZipPath
+        self.manifestPath = aManifestPath
+
+    def mGetManifest(self) -> dict | None:
+        return mParseJsonFile(self.manifestPath) if self.manifestPath else None
+
+    def mGetArchive(self, aTmpDir: str) -> str:
+        return self.zipPath
+
+
+class HttpSource(AssetSource):
+    remote = True
+
+    def __init__(self, aUrl: str, aManifestUrl: str = None) -> None:
+        self.url = aUrl
+        self.manifestUrl = aManifestUrl
+
+    def mGetManifest(self) -> dict | None:
+        if not self.manifestUrl:
+            return None
+        with urlopen(self.manifestUrl) as _response:
+            return json.load(_response)
+
+    def mGetArchive(self, aTmpDir: str) -> str:
+        _path = os.path.join(aTmpDir, 'assets.zip')
+        with urlopen(self.url) as _response, open(_path, 'wb') as _file:
+            shutil.copyfileobj(_response, _file, CHUNK_SIZE)
+        return _path
+
+
+class GDriveSource(HttpSource):
+    def mGetArchive(self, aTmpDir: str) -> str:
+        _path = os.path.join(aTmpDir, 'assets.zip')
+        mDownloadFromGDrive(self.url, _path)
+        return _path
+
+
+def mHashFile(aPath: str) -> tuple[str, int]:
+    _hash = hashlib.sha256()
+    _size = 0
+    with open(aPath, 'rb') as _file:
+        while _chunk := _file.read(CHUNK_SIZE):
+            _hash.update(_chunk)
+            _size += len(_chunk)
+    return _hash.hexdigest(), _size
+
+
+def mBuildManifest(aDir: str) -> dict:
+    _files = {}
+    for _root, _, _names in os.walk(aDir):
+        for _name in _names:
+            _path = os.path.join(_root, _name)
+            _relative = os.path.relpath(_path, aDir).replace(os.sep, '/')
+            if _relative == MANIFEST_NAME:
+                continue
+            _sha, _size = mHashFile(_path)
+            _files[_relative] = {"sha256": _sha, "size": _size}
+    return {"files": _files}
+
+
+@mTimed('file')
+def mVerifyAssets(aDir: str, aManifest: dict) -> list[str]:
+    """
+    Check the files of a manifest in parallel and return the names that are missing or differ.
+    """
+    def _mIsValid(aItem: tuple[str, dict]) -> bool:
+        _name, _expected = aItem
+        _path = os.path.join(aDir, _name)
+        # Sizes are compared first so most mismatches are found without hashing
+        try:
+            if os.path.getsize(_path) != _expected['size']:
+                return False
+        except OSError:
+            return False
+        return mHashFile(_path)[0] == _expected['sha256']
+
+    _items = list(aManifest['files'].items())
+    with ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix='asset-verify') as _executor:
+        _valid = list(_executor.map(_mIsValid, _items))
+    return [_name for (_name, _), _isValid in zip(_items, _valid) if not _isValid]
+
+
+def mGetMemberName(aInfo: zipfile.ZipInfo) -> str | None:
+    # Reject members that would be written outside the target directory
+    _name = posixpath.normpath(aInfo.filename.replace('\\', '/'))
+    if aInfo.is_dir() or _name.startswith(('/', '../')) or _name in ('.', '..', MANIFEST_NAME):
+        return None
+    return _name
+
+
+@mTimed('file')
+def mExtractMembers(aZipPath: str, aDir: str, aNames: set[str] | None, aManifest: dict | None) -> dict:
+    """
+    Stream archive members straight to their final paths, verifying each against the manifest
+    before it replaces the existing file.
+
+    Args:
+        aZipPath (str): The archive.
+        aDir (str): The target directory.
+        aNames (set[str] | None): The members to extract. All of them if None.
+        aManifest (dict | None): The expected hashes. Without it the manifest is built from the archive.
+
+    Returns:
+        dict: The manifest entries of the extracted members.
+    """
+    _extracted = {}
+    with zipfile.ZipFile(aZipPath, 'r') as _zip:
+        for _info in _zip.infolist():
+            _name = mGetMemberName(_info)
+            if _name is None or (aNames is not None and _name not in aNames):
+                continue
+            _path = os.path.join(aDir, *_name.split('/'))
+            os.makedirs(os.path.dirname(_path), exist_ok=True)
+            _hash = hashlib.sha256()
+            _fd, _tmpPath = tempfile.mkstemp(dir=os.path.dirname(_path), suffix='.part')
+            try:
+                with _zip.open(_info) as _member, os.fdopen(_fd, 'wb') as _file:
+                    while _chunk := _member.read(CHUNK_SIZE):
+                        _hash.update(_chunk)
+                        _file.write(_chunk)
+                _entry = {"sha256": _hash.hexdigest(), "size": _info.file_size}
+                _expected = aManifest['files'].get(_name) if aManifest else _entry
+                if _expected != _entry:
+                    mLogError(f'Asset {_name} does not match the manifest, skipping it')
+                    os.remove(_tmpPath)
+                    continue
+                os.replace(_tmpPath, _path)
+            except BaseException:
+                if os.path.exists(_tmpPath):
+                    os.remove(_tmpPath)
+                raise
+            _extracted[_name] = _entry
+    return _extracted
+
+
+@mTimed('file')
+def mSyncAssets(aDir: str, aSource: AssetSource, aPrune: bool = False, aRequireManifest: bool = False) -> dict:
+    """
+    Bring a directory in line with an asset source. Files are verified against the source's
+    manifest, or against the manifest of the last sync when the source has none, and the
+    archive is only fetched when something is missing or differs. Without a source manifest,
+    changed upstream files are only picked up after deleting the local manifest.
+
+    A manifest built from the downloaded archive only detects local changes, it can't tell
+    whether the download itself is what the source published. With aRequireManifest, a remote
+    source without a manifest raises ValueError, otherwise the sync goes on with a warning.
+
+    Returns:
+        dict: How many files were verified, fetched and pruned.
+    """
+    os.makedirs(aDir, exist_ok=True)
+    _localManifestPath = os.path.join(aDir, MANIFEST_NAME)
+    _manifest = aSource.mGetManifest()
+    if _manifest is None and aSource.remote:
+        if aRequireManifest:
+            raise ValueError(f'The asset source of {aDir} has no manifest, downloads cannot be verified')
+        mLogError(f'WARNING: the asset source of {aDir} has no manifest, downloaded files are not verified. Set a manifest URL to verify them')
+    if _manifest is None and os.path.exists(_localManifestPath):
+        _manifest = mParseJsonFile(_localManifestPath) or None
+
+    # Find what has to be fetched
+    _stale = None
+    if _manifest is not None:
+        _stale = set(mVerifyAssets(aDir, _manifest))
+        mLogInfo(f'{len(_manifest["files"]) - len(_stale)} assets verified in {aDir}, {len(_stale)} to fetch')
+    _stats = {"verified": len(_manifest["files"]) - len(_stale) if _manifest else 0, "fetched": 0, "pruned": 0}
+
+    # Fetch and extract only the stale members
+    if _stale is None or _stale:
+        with tempfile.TemporaryDirectory() as _tmpDir:
+            _extracted = mExtractMembers(aSource.mGetArchive(_tmpDir), aDir, _stale, _manifest)
+        _stats["fetched"] = len(_extracted)
+        if _manifest is None:
+            _manifest = {"files": _extracted}
+        _missing = (_stale or set()) - set(_extracted)
+        if _missing:
+            mLogError(f'{len(_missing)} assets could not be fetched: {sorted(_missing)[:10]}')
+
+    # Remove files that are not part of the assets anymore
+    if aPrune:
+        for _name in set(mBuildManifest(aDir)['files']) - set(_manifest['files']):
+            os.remove(os.path.join(aDir, _name))
+            _stats["pruned"] += 1
+
+    mWriteJsonFile(_localManifestPath, _manifest)
+    return _stats
+
+
+def mSyncPerkAssets() -> None:
+    """
+    Sync the perk images from the configured Google Drive archive.
+    """
+    _dir = mGetFile(mGetConfigProperty('PERKS_IMG_DIR'))
+    _source = GDriveSource(mGetConfigProperty('PERKS_IMG_URL'), mGetConfigProperty('PERKS_MANIFEST_URL') or None)
+    try:
+        _stats = mSyncAssets(_dir, _source, aRequireManifest=bool(mGetConfigProperty('PERKS_REQUIRE_MANIFEST')))
+        mLogInfo(f'Perk images synced: {_stats}')
+    except Exception as e:
+        mLogError(f'Could not sync perk images: {e}')
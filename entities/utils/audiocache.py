@@ -0,0 +1,241 @@
+# Generic imports
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+# Specific imports
+from collections import Counter, OrderedDict
+from typing import Callable
+
+# Custom imports
+from entities.utils.files import mGetFile, mGetMusicConfig
+from entities.utils.metrics import registry
+from entities.utils.opus import mGetOpusTransform
+from log.logger import mLogError, mLogInfo
+
+AUDIO_CACHE_MAX_MB = 2048
+AUDIO_CACHE_MIN_FREE_MB = 1024
+
+
+def mGetFileStem(aTrackKey: str) -> str:
+    # youtube:dQw4w9WgXcQ -> youtube_dQw4w9WgXcQ, anything else is hashed
+    _source, _, _id = aTrackKey.partition(':')
+    if re.fullmatch(r'[A-Za-z0-9_-]{1,64}', _id) and _source.isalnum():
+        return f'{_source}_{_id}'
+    return hashlib.blake2b(aTrackKey.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class AudioCache:
+    """
+    Downloaded songs by track key, least recently played first, kept under a byte budget and
+    above a minimum of free disk space. Pinned songs, the ones queued somewhere, are never
+    evicted. Downloads land in a temporary directory and are moved in once complete, so every
+    file in the cache is whole. An optional transform converts them before they're moved in.
+    """
+
+    def __init__(self, aDir: str, aMaxBytes: int, aMinFreeBytes: int = 0, aTransform: Callable[[str, str], str] = None, aName: str = 'audio_cache') -> None:
+        self.__dir = os.path.realpath(aDir)
+        self.__incoming = os.path.join(self.__dir, '.incoming')
+        self.__maxBytes = aMaxBytes
+        self.__minFreeBytes = aMinFreeBytes
+        self.__transform = aTransform
+        self.__name = aName
+        self.__lock = threading.Lock()
+        # File stem -> (path, size), least recently used first
+        self.__files: OrderedDict[str, tuple[str, int]] = OrderedDict()
+        self.__pins: Counter[str] = Counter()
+        self.__bytes = 0
+        # Metrics
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+        self.__rejected = 0
+        self.__transformFailures = 0
+        # Partial downloads of a previous run
+        shutil.rmtree(self.__incoming, ignore_errors=True)
+        os.makedirs(self.__incoming, exist_ok=True)
+        self.mReconcile()
+
+    @property
+    def dir(self) -> str:
+        return self.__dir
+
+    @property
+    def bytes(self) -> int:
+        return self.__bytes
+
+    def __len__(self) -> int:
+        return len(self.__files)
+
+    def mReconcile(self) -> None:
+        # Index the files already in the directory, oldest first
+        _files = []
+        with os.scandir(self.__dir) as _entries:
+            for _entry in _entries:
+                if _entry.is_file() and not _entry.name.startswith('.'):
+                    _stat = _entry.stat()
+                    _files.append((_stat.st_mtime, _entry.path, _stat.st_size))
+        with self.__lock:
+            self.__files.clear()
+            self.__bytes = 0
+            for _, _path, _size in sorted(_files):
+                self.__files[os.path.splitext(os.path.basename(_path))[0]] = (_path, _size)
+                self.__bytes += _size
+            self.mEvict()
+
+    def mGetPath(self, aTrackKey: str) -> str | None:
+        _stem = mGetFileStem(aTrackKey)
+        with self.__lock:
+            _entry = self.__files.get(_stem)
+            if _entry is None or not os.path.isfile(_entry[0]):
+                if _entry is not None:
+                    self.mForget(_stem)
+                self.__misses += 1
+                return None
+            self.__files.move_to_end(_stem)
+            self.__hits += 1
+        # The modified time keeps the order across restarts
+        try:
+            os.utime(_entry[0])
+        except OSError:
+            pass
+        return _entry[0]
+
+    def mPin(self, aTrackKey: str) -> None:
+        with self.__lock:
+            self.__pins[mGetFileStem(aTrackKey)] += 1
+
+    def mUnpin(self, aTrackKey: str) -> None:
+        _stem = mGetFileStem(aTrackKey)
+        with self.__lock:
+            self.__pins[_stem] -= 1
+            if self.__pins[_stem] <= 0:
+                del self.__pins[_stem]
+            self.mEvict()
+
+    def mIsPinned(self, aTrackKey: str) -> bool:
+        return mGetFileStem(aTrackKey) in self.__pins
+
+    def mFill(self, aTrackKey: str, aDownload: Callable[[str], str]) -> str | None:
+        """
+        Download a song into the cache.
+
+        Args:
+            aTrackKey (str): The track key of the song.
+            aDownload (Callable[[str], str]): Downloads the song into the given directory and returns the file.
+
+        Returns:
+            str | None: The cached file, or None if there's not enough free disk space.
+        """
+        if not self.mMakeRoom():
+            self.__rejected += 1
+            mLogInfo(f'Not caching {aTrackKey}, the disk is almost full')
+            return None
+        _stem = mGetFileStem(aTrackKey)
+        _tmpDir = tempfile.mkdtemp(dir=self.__incoming)
+        try:
+            _download = aDownload(_tmpDir)
+            if self.__transform is not None:
+                try:
+                    _download = self.__transform(_download, _tmpDir)
+                except Exception as e:
+                    # Keep the song as downloaded
+                    self.__transformFailures += 1
+                    mLogError(f'Could not convert {aTrackKey}: {e}')
+            _path = os.path.join(self.__dir, _stem + os.path.splitext(_download)[1])
+            # Files the download didn't write, like local songs, are copied and left where they are
+            if os.path.commonpath([os.path.realpath(_download), os.path.realpath(_tmpDir)]) != os.path.realpath(_tmpDir):
+                _copy = os.path.join(_tmpDir, os.path.basename(_path))
+                shutil.copyfile(_download, _copy)
+                _download = _copy
+            os.replace(_download, _path)
+        finally:
+            shutil.rmtree(_tmpDir, ignore_errors=True)
+        _size = os.path.getsize(_path)
+        with self.__lock:
+            _previous = self.__files.pop(_stem, None)
+            if _previous:
+                self.__bytes -= _previous[1]
+                if _previous[0] != _path:
+                    self.mDelete(_previous[0])
+            self.__files[_stem] = (_path, _size)
+            self.__bytes += _size
+            self.mEvict(aKeep=_stem)
+        return _path
+
+    def mMakeRoom(self) -> bool:
+        # Evict until the disk has the minimum free space, if possible
+        with self.__lock:
+            while shutil.disk_usage(self.__dir).free < self.__minFreeBytes:
+                if not self.mEvictOne():
+                    return False
+        return True
+
+    def mEvict(self, aKeep: str = None) -> None:
+        # Called with the lock held
+        while self.__bytes > self.__maxBytes:
+            if not self.mEvictOne(aKeep):
+                break
+
+    def mEvictOne(self, aKeep: str = None) -> bool:
+        # Called with the lock held. Removes the least recently used unpinned file
+        for _stem, (_path, _size) in self.__files.items():
+            if _stem != aKeep and _stem not in self.__pins:
+                self.mForget(_stem)
+                self.mDelete(_path)
+                self.__evictions += 1
+                return True
+        return False
+
+    def mForget(self, aStem: str) -> None:
+        _path, _size = self.__files.pop(aStem)
+        self.__bytes -= _size
+
+    def mDelete(self, aPath: str) -> None:
+        try:
+            os.remove(aPath)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            mLogError(f'Could not delete {aPath}: {e}')
+
+    def mGetStats(self) -> dict:
+        _lookups = self.__hits + self.__misses
+        return {
+            "name": self.__name,
+            "files": len(self.__files),
+            "bytes": self.__bytes,
+            "maxBytes": self.__maxBytes,
+            "pinned": len(self.__pins),
+            "hits": self.__hits,
+            "misses": self.__misses,
+            "evictions": self.__evictions,
+            "rejected": self.__rejected,
+            "transformFailures": self.__transformFailures,
+            "hitRate": self.__hits / _lookups if _lookups else 0.0
+        }
+
+
+_audioCache: AudioCache = None
+_audioCacheLock = threading.Lock()
+
+
+def mGetAudioCache() -> AudioCache | None:
+    # Created on first use in DOWNLOAD_PATH. None if AUDIO_CACHE_MAX_MB is 0
+    global _audioCache
+    with _audioCacheLock:
+        if _audioCache is None:
+            _config = mGetMusicConfig()
+            _maxMb = float(_config.get('AUDIO_CACHE_MAX_MB', AUDIO_CACHE_MAX_MB))
+            if _maxMb <= 0:
+                return None
+            _minFreeMb = float(_config.get('AUDIO_CACHE_MIN_FREE_MB', AUDIO_CACHE_MIN_FREE_MB))
+            _dir = mGetFile(_config.get('DOWNLOAD_PATH'))
+            os.makedirs(_dir, exist_ok=True)
+            _audioCache = AudioCache(_dir, int(_maxMb * 1024 * 1024), int(_minFreeMb * 1024 * 1024), mGetOpusTransform())
+            mLogInfo(f'Audio cache opened at {_dir} with {len(_audioCache)} files, {_audioCache.bytes} bytes')
+            registry.mRegisterCollector('audio_cache', _audioCache.mGetStats)
+        return _audioCache
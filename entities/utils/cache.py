@@ -0,0 +1,103 @@
+# Generic imports
+import time
+
+# Specific imports
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class TTLCache:
+    """
+    Small in-memory cache whose entries expire after a fixed time to live.
+
+    Keys are tuples whose first element is the owner (usually the user id), so every entry
+    belonging to a single owner can be dropped at once when their data changes.
+    """
+
+    def __init__(self, aTTLSeconds: float, aMaxEntries: int = 2048, aName: str = 'cache') -> None:
+        # Cache settings
+        self.__ttl = aTTLSeconds
+        self.__maxEntries = aMaxEntries
+        self.__name = aName
+        # Entries are kept in insertion order so the oldest one is evicted first
+        self.__entries: OrderedDict[tuple, tuple[float, Any]] = OrderedDict()
+        self.__ownerKeys: dict[Hashable, set[tuple]] = {}
+        # Metrics
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+        self.__invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def __contains__(self, aKey: tuple) -> bool:
+        _entry = self.__entries.get(aKey)
+        return _entry is not None and _entry[0] > time.monotonic()
+
+    def mGet(self, aKey: tuple, aDefault: Any = None) -> Any:
+        _entry = self.__entries.get(aKey)
+        # Count a miss if the key is missing or expired
+        if _entry is None:
+            self.__misses += 1
+            return aDefault
+        _expiry, _value = _entry
+        if _expiry <= time.monotonic():
+            self.mDelete(aKey)
+            self.__misses += 1
+            return aDefault
+        self.__hits += 1
+        return _value
+
+    def mSet(self, aKey: tuple, aValue: Any) -> None:
+        # Refresh position if the key is already cached
+        if aKey in self.__entries:
+            self.__entries.move_to_end(aKey)
+        self.__entries[aKey] = (time.monotonic() + self.__ttl, aValue)
+        self.__ownerKeys.setdefault(aKey[0], set()).add(aKey)
+        # Evict oldest entries when over capacity
+        while len(self.__entries) > self.__maxEntries:
+            _oldestKey = next(iter(self.__entries))
+            self.mDelete(_oldestKey)
+            self.__evictions += 1
+
+    def mGetOrCompute(self, aKey: tuple, aFactory: Callable[[], Any]) -> Any:
+        _sentinel = object()
+        _value = self.mGet(aKey, _sentinel)
+        if _value is _sentinel:
+            _value = aFactory()
+            self.mSet(aKey, _value)
+        return _value
+
+    def mDelete(self, aKey: tuple) -> None:
+        if self.__entries.pop(aKey, None) is None:
+            return
+        _ownerKeys = self.__ownerKeys.get(aKey[0])
+        if _ownerKeys is not None:
+            _ownerKeys.discard(aKey)
+            if not _ownerKeys:
+                self.__ownerKeys.pop(aKey[0])
+
+    def mInvalidateOwner(self, aOwner: Hashable) -> int:
+        # Drop every entry that belongs to the owner
+        _keys = self.__ownerKeys.pop(aOwner, set())
+        for _key in _keys:
+            self.__entries.pop(_key, None)
+        self.__invalidations += 1
+        return len(_keys)
+
+    def mClear(self) -> None:
+        self.__entries.clear()
+        self.__ownerKeys.clear()
+
+    def mGetStats(self) -> dict:
+        _lookups = self.__hits + self.__misses
+        return {
+            "name": self.__name,
+            "entries": len(self.__entries),
+            "hits": self.__hits,
+            "misses": self.__misses,
+            "evictions": self.__evictions,
+            "invalidations": self.__invalidations,
+            "hitRate": self.__hits / _lookups if _lookups else 0.0
+        }
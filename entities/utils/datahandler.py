@@ -7,7 +7,9 @@ import seaborn as sns
 from datetime import datetime
 from sklearn.cluster import KMeans
 
+from entities.utils.artifacts import mTrackArtifact
 from entities.utils.files import mGetDBDImgsDir
+from entities.utils.metrics import mTimed
 
 
 class DBDDataHandler:
@@ -36,6 +38,7 @@ class DBDDataHandler:
     def mGetDataFrame(self) -> pd.DataFrame:
         return self.__df
 
+    @mTimed('render')
     def mCreateBarPlot(self, aX: str, aY: str, aSavePath: str, aTitle: str = 'Generated Plot'):
         # Set the plot
         plt.style.use('dark_background')
@@ -55,3 +58,4 @@ class DBDDataHandler:
         plt.tight_layout()
         # Save image
         plt.savefig(aSavePath)
+        mTrackArtifact(aSavePath)
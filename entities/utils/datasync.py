@@ -0,0 +1,303 @@
+"""
+Keyed sync between record files (JSON, JSON Lines and CSV).
+
+Records are streamed from the source and compared against a compact index of the target, so
+memory grows with the number of keys and changed rows, not with the size of the files. The
+target is only rewritten, atomically, when something changed.
+"""
+# Generic imports
+import csv
+import hashlib
+import json
+import os
+import re
+
+# Specific imports
+from itertools import chain
+from typing import Callable, Iterator, TextIO
+
+# Custom imports
+from entities.utils.files import mOpenAtomic
+from entities.utils.metrics import mTimed
+from entities.utils.rare import mCleanString
+from log.logger import mLogInfo
+
+CHUNK_SIZE = 64 * 1024
+JSONL_EXTENSIONS = ('.jsonl', '.ndjson')
+
+_decoder = json.JSONDecoder()
+_NON_WHITESPACE = re.compile(r'[^ \t\r\n]')
+
+
+class _JsonStream:
+    """
+    Reads consecutive JSON values from a file, holding at most one value plus a chunk in memory.
+    """
+
+    def __init__(self, aFile: TextIO) -> None:
+        self.__file = aFile
+        self.__buffer = ''
+        self.__pos = 0
+        self.__eof = False
+
+    def mPeek(self) -> str:
+        # Skip whitespace and return the next character, or '' at the end of the file
+        while True:
+            _match = _NON_WHITESPACE.search(self.__buffer, self.__pos)
+            if _match:
+                self.__pos = _match.start()
+                return self.__buffer[self.__pos]
+            self.__pos = len(self.__buffer)
+            if not self.__mFill():
+                return ''
+
+    def mExpect(self, aChars: str) -> str:
+        _char = self.mPeek()
+        if not _char or _char not in aChars:
+            raise ValueError(f'Expected one of {aChars!r} but found {_char!r}')
+        self.__pos += 1
+        return _char
+
+    def mDecode(self) -> object:
+        self.mPeek()
+        while True:
+            try:
+                _value, _end = _decoder.raw_decode(self.__buffer, self.__pos)
+            except json.JSONDecodeError:
+                # The value continues in the next chunk
+                if not self.__mFill():
+                    raise
+                continue
+            # A number at the end of the buffer may also continue in the next chunk
+            if _end == len(self.__buffer) and self.__mFill():
+                continue
+            self.__pos = _end
+            return _value
+
+    def __mFill(self) -> bool:
+        if self.__eof:
+            return False
+        _chunk = self.__file.read(CHUNK_SIZE)
+        if not _chunk:
+            self.__eof = True
+            return False
+        self.__buffer = self.__buffer[self.__pos:] + _chunk
+        self.__pos = 0
+        return True
+
+
+def mGetFormat(aPath: str) -> str:
+    _ext = os.path.splitext(aPath)[1].lower()
+    if _ext == '.csv':
+        return 'csv'
+    return 'jsonl' if _ext in JSONL_EXTENSIONS else 'json'
+
+
+def mIterJsonRecords(aPath: str, aKeyField: str = 'id') -> Iterator[tuple[str, dict]]:
+    # Either an object of records by key, like the perks file, or an array of records
+    with open(aPath, 'r', encoding='utf-8') as _file:
+        _stream = _JsonStream(_file)
+        _open = _stream.mExpect('{[')
+        _close = '}' if _open == '{' else ']'
+        if _stream.mPeek() == _close:
+            return
+        while True:
+            if _open == '{':
+                _key = _stream.mDecode()
+                _stream.mExpect(':')
+                _record = _stream.mDecode()
+            else:
+                _record = _stream.mDecode()
+                _key = _record[aKeyField]
+            yield str(_key), _record
+            if _stream.mExpect(',' + _close) == _close:
+                return
+
+
+def mIterRecords(aPath: str, aKeyField: str = 'id') -> Iterator[tuple[str, dict]]:
+    """
+    Stream the (key, record) pairs of a JSON, JSON Lines or CSV file.
+    """
+    _format = mGetFormat(aPath)
+    if _format == 'json':
+        yield from mIterJsonRecords(aPath, aKeyField)
+        return
+    with open(aPath, 'r', encoding='utf-8', newline='') as _file:
+        if _format == 'csv':
+            for _row in csv.DictReader(_file):
+                yield _row[aKeyField], _row
+            return
+        for _line in _file:
+            if _line.strip():
+                _record = json.loads(_line)
+                yield str(_record[aKeyField]), _record
+
+
+def mGetJsonLayout(aPath: str) -> str:
+    # '{' for records by key, '[' for an array of records
+    try:
+        with open(aPath, 'r', encoding='utf-8') as _file:
+            return _JsonStream(_file).mPeek() or '{'
+    except FileNotFoundError:
+        return '{'
+
+
+def mGetFingerprint(aRecord: dict, aFields: list[str]) -> bytes:
+    # Compare values the way they would be written to a CSV file, so 1 and '1' are equal
+    _values = [_value if isinstance(_value, str) else '' if _value is None else json.dumps(_value) for _value in (aRecord.get(_field) for _field in aFields)]
+    return hashlib.blake2b(json.dumps(_values).encode('utf-8'), digest_size=8).digest()
+
+
+class _RecordWriter:
+    """
+    Writes records in the format of the target file.
+    """
+
+    def __init__(self, aFile: TextIO, aFormat: str, aLayout: str, aKeyField: str, aFieldNames: list[str]) -> None:
+        self.__file = aFile
+        self.__format = aFormat
+        self.__layout = aLayout
+        self.__keyField = aKeyField
+        self.__count = 0
+        self.__csv = None
+        if aFormat == 'csv':
+            self.__csv = csv.DictWriter(aFile, fieldnames=aFieldNames, extrasaction='ignore')
+            self.__csv.writeheader()
+        elif aFormat == 'json':
+            aFile.write(aLayout)
+
+    def mWrite(self, aKey: str, aRecord: dict) -> None:
+        if self.__format == 'csv':
+            self.__csv.writerow({**aRecord, self.__keyField: aKey})
+        elif self.__format == 'jsonl':
+            self.__file.write(json.dumps({self.__keyField: aKey, **aRecord}) + '\n')
+        else:
+            # Same output as json.dump(..., indent=4) of the whole file. Records by key are written
+            # as they come, with the key field only if they had it
+            _record = aRecord if self.__layout == '{' else {self.__keyField: aKey, **aRecord}
+            _entry = json.dumps(_record, indent=4).replace('\n', '\n    ')
+            _prefix = f'{json.dumps(aKey)}: ' if self.__layout == '{' else ''
+            self.__file.write(f'{"," if self.__count else ""}\n    {_prefix}{_entry}')
+        self.__count += 1
+
+    def mClose(self) -> None:
+        if self.__format == 'json':
+            self.__file.write(('\n' if self.__count else '') + ('}' if self.__layout == '{' else ']'))
+
+
+@mTimed('file')
+def mSyncRecords(aSource: str, aTarget: str, aKeyField: str = 'id', aFields: list[str] = None, aTransform: Callable[[str, dict], dict] = None,
+                 aPrune: bool = False, aDryRun: bool = False) -> dict:
+    """
+    Bring the records of a target file in line with a source file, matching them by key.
+
+    The target is indexed first, keeping an 8-byte fingerprint of the synced fields per key. The
+    source is then streamed once to find the added, changed and removed keys. Only when something
+    changed is the target streamed again into a temporary file that replaces it: changed rows get
+    the source's values for the synced fields and keep their other columns, added rows are
+    appended and removed rows are dropped if aPrune is set. Source and target may be the same file.
+
+    Args:
+        aSource (str): The file with the up to date records.
+        aTarget (str): The file to update. Created if it doesn't exist.
+        aKeyField (str, optional): The key column, or field of array records. Defaults to 'id'.
+        aFields (list[str], optional): The fields to sync. Defaults to the fields of the first source record.
+        aTransform (Callable[[str, dict], dict], optional): Applied to each source record before comparing.
+        aPrune (bool, optional): Remove target records missing from the source. Defaults to False.
+        aDryRun (bool, optional): Only report the changes. Defaults to False.
+
+    Returns:
+        dict: The added, changed and removed keys, the number of unchanged and duplicate source
+        records, and whether the target was written.
+    """
+    _format = mGetFormat(aTarget)
+    _layout = mGetJsonLayout(aTarget) if _format == 'json' else None
+    _sourceRecords = mIterRecords(aSource, aKeyField)
+    if aTransform:
+        _sourceRecords = ((_key, aTransform(_key, _record)) for _key, _record in _sourceRecords)
+
+    # Work out which fields are synced
+    _first = next(_sourceRecords, None)
+    _fields = aFields or ([_field for _field in _first[1] if _field != aKeyField] if _first else [])
+    if _first:
+        _sourceRecords = chain([_first], _sourceRecords)
+
+    # Index the target
+    _index: dict[str, bytes | None] = {}
+    _fieldNames = []
+    if os.path.exists(aTarget):
+        if _format == 'csv':
+            with open(aTarget, 'r', encoding='utf-8', newline='') as _file:
+                _fieldNames = list(csv.DictReader(_file).fieldnames or [])
+        for _key, _record in mIterRecords(aTarget, aKeyField):
+            _index[_key] = mGetFingerprint(_record, _fields)
+
+    # Diff the source against it in one pass
+    _added: dict[str, dict] = {}
+    _changed: dict[str, dict] = {}
+    _unchanged = 0
+    _duplicates = 0
+    for _key, _record in _sourceRecords:
+        _fingerprint = _index.get(_key, b'')
+        if _fingerprint is None:
+            _duplicates += 1
+            continue
+        _synced = {_field: _record.get(_field) for _field in _fields}
+        if _fingerprint == b'':
+            _added[_key] = {aKeyField: _record[aKeyField], **_synced} if aKeyField in _record else _synced
+        elif _fingerprint != mGetFingerprint(_synced, _fields):
+            _changed[_key] = _synced
+        else:
+            _unchanged += 1
+        _index[_key] = None
+    _removed = [_key for _key, _fingerprint in _index.items() if _fingerprint is not None]
+    del _index
+
+    _report = {
+        "added": list(_added),
+        "changed": list(_changed),
+        "removed": _removed,
+        "unchanged": _unchanged,
+        "duplicates": _duplicates,
+        "written": False
+    }
+    if aDryRun or not (_added or _changed or (aPrune and _removed)):
+        mLogInfo(f'{aTarget} is up to date with {aSource}' if not aDryRun else f'Dry run of {aSource} -> {aTarget}: {len(_added)} added, {len(_changed)} changed, {len(_removed)} removed')
+        return _report
+
+    # Rewrite the target, streaming the unchanged rows through
+    _removedKeys = set(_removed) if aPrune else set()
+    for _field in [aKeyField] + _fields:
+        if _field not in _fieldNames:
+            _fieldNames.append(_field)
+    with mOpenAtomic(aTarget, 'w', encoding='utf-8', newline='') as _file:
+        _writer = _RecordWriter(_file, _format, _layout, aKeyField, _fieldNames)
+        if os.path.exists(aTarget):
+            for _key, _record in mIterRecords(aTarget, aKeyField):
+                if _key in _removedKeys:
+                    continue
+                _writer.mWrite(_key, {**_record, **_changed[_key]} if _key in _changed else _record)
+        for _key, _record in _added.items():
+            _writer.mWrite(_key, _record)
+        _writer.mClose()
+    _report["written"] = True
+    mLogInfo(f'{aTarget} synced with {aSource}: {len(_added)} added, {len(_changed)} changed, {len(_removedKeys)} removed')
+    return _report
+
+
+# Get a map of the id and the name of the perk from a JSON or CSV file
+def mGetIdTitleMap(aPath: str) -> dict:
+    return {_key: _record['title'] for _key, _record in mIterRecords(aPath)}
+
+def mGetIdTitleMapCSV(aPath: str) -> dict:
+    return mGetIdTitleMap(aPath)
+
+def mAddImgPlaceholders(aPath: str) -> dict:
+    # Point every perk at its image placeholder
+    def _mAddImg(aKey: str, aPerk: dict) -> dict:
+        return {**aPerk, 'img': f'assets/dbd/imgs/perks/{mCleanString(aPerk["title"])}.png'}
+    return mSyncRecords(aPath, aPath, aFields=['img'], aTransform=_mAddImg)
+
+def mUpdateCSVBasedOnJSONFile(aJsonPath: str, aCsvPath: str) -> dict:
+    # Sync the perk titles of a CSV file with the JSON file, keeping the CSV's other columns
+    return mSyncRecords(aJsonPath, aCsvPath, aFields=['title'], aPrune=True)
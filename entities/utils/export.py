@@ -0,0 +1,197 @@
+# Generic imports
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+# Custom imports
+from entities.utils.files import mGetConfigProperty, mGetFile, mParseJsonFile, mWriteFileAtomic
+from entities.utils.metrics import mTimed
+from entities.utils.sql import SQLRetriever
+from log.logger import mLogError, mLogInfo
+
+MATCH_COLUMNS = ['id', 'user', 'match_date', 'outcome', 'perk_1_name', 'perk_2_name', 'perk_3_name', 'perk_4_name']
+EXPORT_CHUNK_SIZE = 5000
+# Per-user exports unused for this long are deleted
+USER_EXPORT_MAX_AGE_MINS = 24 * 60
+# Copies of an export being uploaded
+SNAPSHOT_PREFIX = '.upload_'
+
+# One export per file at a time
+_exportLocks: dict[str, threading.Lock] = {}
+_exportLocksLock = threading.Lock()
+
+
+def mGetStatePath(aPath: str) -> str:
+    return f'{aPath}.state.json'
+
+
+def mGetUserExportPath(aPath: str, aUser: int) -> str:
+    # e.g. matches_612432506813284373.csv.gz
+    _dir, _name = os.path.split(aPath)
+    _stem, _dot, _ext = _name.partition('.')
+    return os.path.join(_dir, f'{_stem}_{int(aUser)}{_dot}{_ext}')
+
+
+def mGetExportLock(aPath: str) -> threading.Lock:
+    with _exportLocksLock:
+        return _exportLocks.setdefault(os.path.realpath(aPath), threading.Lock())
+
+
+@mTimed('file')
+def mExportTable(aRetriever: SQLRetriever, aTable: str, aColumns: list[str], aPath: str, aKey: str = 'id', aWhere: str = None,
+                 aChunkSize: int = EXPORT_CHUNK_SIZE, aFresh: bool = False, aCompress: bool = None) -> dict:
+    """
+    Export a table to CSV in key order, one chunk at a time, so memory stays the same however
+    large the table is. After each chunk the file is synced and the last key and file size are
+    saved next to it, so an interrupted export resumes from the last chunk and a finished one
+    only appends the rows added since.
+
+    Gzip exports write each chunk as its own gzip member. Concatenated members are a valid gzip
+    file, and every checkpoint falls on a member boundary.
+
+    Args:
+        aRetriever (SQLRetriever): The connection to read from. It's busy until the export ends.
+        aTable (str): The table to export.
+        aColumns (list[str]): The columns to export, including aKey.
+        aPath (str): The output file.
+        aKey (str, optional): An increasing integer column to resume from. Defaults to 'id'.
+        aWhere (str, optional): An extra SQL condition.
+        aChunkSize (int, optional): Rows per chunk and checkpoint. Defaults to EXPORT_CHUNK_SIZE.
+        aFresh (bool, optional): Ignore any previous export and start over. Defaults to False.
+        aCompress (bool, optional): Write gzip. Defaults to whether aPath ends with .gz.
+
+    Returns:
+        dict: The rows exported by this call, the total rows and bytes in the file and its path.
+    """
+    _compress = aPath.endswith('.gz') if aCompress is None else aCompress
+    _statePath = mGetStatePath(aPath)
+    _export = {"table": aTable, "columns": aColumns, "key": aKey, "where": aWhere, "compress": _compress}
+    _state = mParseJsonFile(_statePath) if not aFresh and os.path.exists(_statePath) else {}
+    # A different export or a missing file starts over
+    if _state.get("export") != _export or not os.path.exists(aPath):
+        _state = {"export": _export, "last_key": None, "rows": 0, "bytes": 0}
+    _startRows = _state["rows"]
+    _keyIndex = aColumns.index(aKey)
+
+    # Keyset pagination, so resuming doesn't scan the rows already exported
+    _conditions = [f'({aWhere})'] if aWhere else []
+    if _state["last_key"] is not None:
+        _conditions.append(f'{aKey} > {int(_state["last_key"])}')
+    _query = f'SELECT {", ".join(aColumns)} FROM {aTable}'
+    if _conditions:
+        _query += f' WHERE {" AND ".join(_conditions)}'
+    _query += f' ORDER BY {aKey};'
+
+    with open(aPath, 'ab') as _file:
+        # Drop whatever was written after the last checkpoint
+        _file.truncate(_state["bytes"])
+        _header = _state["bytes"] == 0
+        for _rows in aRetriever.mStream(_query, aChunkSize):
+            _text = io.StringIO()
+            _writer = csv.writer(_text, lineterminator='\n')
+            if _header:
+                _writer.writerow(aColumns)
+                _header = False
+            _writer.writerows(_rows)
+            _data = _text.getvalue().encode('utf-8')
+            _file.write(gzip.compress(_data) if _compress else _data)
+            _file.flush()
+            os.fsync(_file.fileno())
+            # Checkpoint
+            _state["last_key"] = _rows[-1][_keyIndex]
+            _state["rows"] += len(_rows)
+            _state["bytes"] = _file.tell()
+            mWriteFileAtomic(_statePath, json.dumps(_state, indent=4))
+        # Empty tables still get a header
+        if _header:
+            _data = (','.join(aColumns) + '\n').encode('utf-8')
+            _file.write(gzip.compress(_data) if _compress else _data)
+            _state["bytes"] = _file.tell()
+            mWriteFileAtomic(_statePath, json.dumps(_state, indent=4))
+
+    _exported = _state["rows"] - _startRows
+    mLogInfo(f'{_exported} rows of {aTable} exported to {aPath} ({_state["rows"]} rows, {_state["bytes"]} bytes in total)')
+    return {"exported": _exported, "rows": _state["rows"], "bytes": _state["bytes"], "path": aPath}
+
+
+def mExportMatches(aPath: str = None, aUser: int = None, aFresh: bool = False, aRetriever: SQLRetriever = None, aSnapshotMaxBytes: int = None) -> dict | None:
+    """
+    Export the match history to MATCH_EXPORT_PATH, or to aPath, with the matches of one user
+    going to their own file. Uses its own connection unless one is given, since the server-side
+    cursor keeps it busy until the export ends. Returns None if the file is already being exported.
+
+    With aSnapshotMaxBytes, an export up to that size is also copied, before the lock is released,
+    to a file only this call uses. The copy is returned as "snapshot" and can be uploaded while
+    other exports append to the file. The caller deletes it.
+    """
+    _path = aPath or mGetFile(mGetConfigProperty('MATCH_EXPORT_PATH'))
+    if aUser is not None and not aPath:
+        _path = mGetUserExportPath(_path, aUser)
+    _lock = mGetExportLock(_path)
+    if not _lock.acquire(blocking=False):
+        mLogInfo(f'An export to {_path} is already running')
+        return None
+    try:
+        _retriever = aRetriever or SQLRetriever()
+        _chunkSize = int(mGetConfigProperty('MATCH_EXPORT_CHUNK_SIZE') or EXPORT_CHUNK_SIZE)
+        _where = f'user = {int(aUser)}' if aUser is not None else None
+        _result = mExportTable(_retriever, 'matches', MATCH_COLUMNS, _path, aWhere=_where, aChunkSize=_chunkSize, aFresh=aFresh)
+        if aSnapshotMaxBytes is not None and _result["bytes"] <= aSnapshotMaxBytes:
+            _fd, _result["snapshot"] = tempfile.mkstemp(prefix=SNAPSHOT_PREFIX, suffix=f'_{os.path.basename(_path)}', dir=os.path.dirname(_path))
+            with os.fdopen(_fd, 'wb') as _snapshot, open(_path, 'rb') as _file:
+                shutil.copyfileobj(_file, _snapshot)
+        return _result
+    finally:
+        _lock.release()
+
+
+def mCleanupUserExports(aPath: str = None, aMaxAgeMinutes: float = None, aNow: float = None) -> int:
+    """
+    Delete the per-user exports of aPath (MATCH_EXPORT_PATH by default) and their checkpoints when
+    they haven't been exported to for aMaxAgeMinutes, and snapshots left behind by failed uploads.
+
+    Returns:
+        int: The number of deleted files.
+    """
+    _path = aPath or mGetFile(mGetConfigProperty('MATCH_EXPORT_PATH'))
+    _maxAge = aMaxAgeMinutes if aMaxAgeMinutes is not None else float(mGetConfigProperty('MATCH_EXPORT_USER_MAX_AGE_MINS') or USER_EXPORT_MAX_AGE_MINS)
+    _before = (aNow or time.time()) - _maxAge * 60
+    _dir, _name = os.path.split(_path)
+    _stem, _dot, _ext = _name.partition('.')
+    _userExport = re.compile(rf'{re.escape(_stem)}_\d+{re.escape(_dot + _ext)}')
+    _removed = 0
+    try:
+        _entries = list(os.scandir(_dir))
+    except FileNotFoundError:
+        return 0
+    for _entry in _entries:
+        try:
+            if not _entry.is_file() or _entry.stat().st_mtime >= _before:
+                continue
+            if _entry.name.startswith(SNAPSHOT_PREFIX):
+                os.remove(_entry.path)
+                _removed += 1
+            elif _userExport.fullmatch(_entry.name):
+                # Skip exports that are running
+                _lock = mGetExportLock(_entry.path)
+                if not _lock.acquire(blocking=False):
+                    continue
+                try:
+                    for _file in (_entry.path, mGetStatePath(_entry.path)):
+                        if os.path.exists(_file):
+                            os.remove(_file)
+                            _removed += 1
+                finally:
+                    _lock.release()
+        except OSError as e:
+            mLogError(f'Could not delete {_entry.path}: {e}')
+    if _removed:
+        mLogInfo(f'{_removed} old exports deleted from {_dir}')
+    return _removed
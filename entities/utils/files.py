@@ -1,16 +1,23 @@
 # Generic imports
+import atexit
+import contextlib
 import csv
 import gdown
 import json
 import os
 import re
+import stat
+import tempfile
+import threading
 import time
 import zipfile
 
 # Specific imports
+from collections import OrderedDict
 from urllib.request import urlretrieve
 
 # Custom imports
+from entities.utils.metrics import mTimed, registry
 from entities.utils.rare import mGenerateProjectId, mIsProjectId, mCleanString
 from log.logger import mLogError, mLogInfo
 
@@ -60,47 +67,149 @@ def mOpenFile(aPath: str) -> object:
     mLogInfo(f'File {aPath} opened')
     return _file
 
+def mGetBackupPath(aPath: str) -> str:
+    # Backups sit next to the file, e.g. config/hctasks_bkp.json
+    _root, _extension = os.path.splitext(aPath)
+    return f'{_root}_bkp{_extension}'
+
+@mTimed('file')
 def mParseJsonFile(aPath: str) -> dict:
     try:
         with open(aPath, 'r') as _data:
             _jsonData = json.load(_data)
             return _jsonData
     except json.JSONDecodeError:
+        # Fall back to the last backup before giving up
+        _backupPath = mGetBackupPath(aPath)
+        if os.path.exists(_backupPath):
+            mLogError(f'File {aPath} is not a valid JSON file. Loading backup {_backupPath}')
+            try:
+                with open(_backupPath, 'r') as _data:
+                    return json.load(_data)
+            except json.JSONDecodeError:
+                pass
         mLogError(f'File {aPath} is not a valid JSON file. Returning empty dictionary')
         return {}
 
-def mWriteJsonFile(aPath: str, aData: dict) -> None:
-    # Open file
-    _file = open(aPath, 'w')
-    mLogInfo(f'File {aPath} opened')
-
-    # Write JSON data
-    _file.write(json.dumps(aData, indent=4))
-    
-    # Close file
-    _file.close()
+# Read once at import, os.umask can only be read by setting it, which isn't thread safe
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+@contextlib.contextmanager
+def mOpenAtomic(aPath: str, aMode: str = 'w', **aKwargs):
+    """
+    Open a temporary file next to aPath that replaces it when the block exits without errors, so
+    readers see either the old or the new file, even if the process dies halfway. The file is
+    synced to disk before the rename, and the directory after it.
+    """
+    _dir = os.path.dirname(os.path.abspath(aPath))
+    _fd, _tmpPath = tempfile.mkstemp(dir=_dir, prefix=f'.{os.path.basename(aPath)}.', suffix='.tmp')
+    try:
+        # mkstemp creates the file as 0600, keep the mode of the file it replaces
+        try:
+            _mode = stat.S_IMODE(os.stat(aPath).st_mode)
+        except FileNotFoundError:
+            _mode = 0o666 & ~_UMASK
+        os.chmod(_tmpPath, _mode)
+        with os.fdopen(_fd, aMode, **aKwargs) as _file:
+            yield _file
+            _file.flush()
+            os.fsync(_file.fileno())
+        os.replace(_tmpPath, aPath)
+    except BaseException:
+        os.remove(_tmpPath)
+        raise
+    # Persist the rename itself
+    if hasattr(os, 'O_DIRECTORY'):
+        _dirFd = os.open(_dir, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(_dirFd)
+        finally:
+            os.close(_dirFd)
+
+def mWriteFileAtomic(aPath: str, aContent: str) -> None:
+    # Replace a file with new content, see mOpenAtomic
+    with mOpenAtomic(aPath) as _file:
+        _file.write(aContent)
+
+@mTimed('file')
+def mWriteJsonFile(aPath: str, aData: dict, aBackup: bool = False) -> None:
+    """
+    Atomically write JSON data to a file.
+
+    Args:
+        aPath (str): The file to write.
+        aData (dict): The data to write.
+        aBackup (bool, optional): Keep the previous content in the backup file (see mGetBackupPath). Defaults to False.
+    """
+    _content = json.dumps(aData, indent=4)
+    # Keep the last good version
+    if aBackup and os.path.exists(aPath):
+        with open(aPath, 'r') as _file:
+            _previous = _file.read()
+        try:
+            json.loads(_previous)
+            mWriteFileAtomic(mGetBackupPath(aPath), _previous)
+        except json.JSONDecodeError:
+            mLogError(f'File {aPath} is not a valid JSON file. Keeping previous backup')
+    mWriteFileAtomic(aPath, _content)
     mLogInfo(f'File {aPath} written')
 
-def mAddImgPlaceholders(aPath: str) -> None:
-    # Open file
-    _data = mParseJsonFile(aPath)
-    
-    # Transform JSON data
-    for _perkId in _data:
-        # Get all the information of the perk
-        _perk: dict = _data[_perkId]
-        
-        # Add img placeholder
-        _cleanTitle = mCleanString(_perk['title'])
-        _imgPath = f'assets/dbd/imgs/perks/{_cleanTitle}.png'
-        _perk['img'] = _imgPath
-        
-        # Set new img path in JSON data
-        _data[_perkId] = _perk
-        
-    # Write dict to file
-    with open(aPath, 'w') as _file:
-        json.dump(_data, _file, indent=4)
+class JsonStateWriter:
+    """
+    Coalesces frequent writes of runtime state. Each path is written at most once per aDelay
+    seconds with the latest data given for it; the data is serialized when it's passed in, so
+    callers can keep mutating their dictionaries.
+    """
+
+    def __init__(self, aDelay: float = 1.0, aBackup: bool = True) -> None:
+        self.__delay = aDelay
+        self.__backup = aBackup
+        self.__lock = threading.Lock()
+        self.__pending: dict[str, str] = {}
+        self.__timers: dict[str, threading.Timer] = {}
+        self.__requested = 0
+        self.__written = 0
+
+    def mWrite(self, aPath: str, aData: dict) -> None:
+        _data = json.loads(json.dumps(aData))
+        with self.__lock:
+            self.__requested += 1
+            self.__pending[aPath] = _data
+            if aPath in self.__timers:
+                return
+            _timer = threading.Timer(self.__delay, self.mFlush, args=(aPath,))
+            _timer.daemon = True
+            self.__timers[aPath] = _timer
+            _timer.start()
+
+    def mFlush(self, aPath: str = None) -> None:
+        """
+        Write pending data now, for one path or for all of them.
+        """
+        with self.__lock:
+            _paths = [aPath] if aPath else list(self.__pending)
+            _writes = []
+            for _path in _paths:
+                _timer = self.__timers.pop(_path, None)
+                if _timer:
+                    _timer.cancel()
+                if _path in self.__pending:
+                    _writes.append((_path, self.__pending.pop(_path)))
+            self.__written += len(_writes)
+            # Writes happen under the lock so a path is never written by two threads at once
+            for _path, _data in _writes:
+                try:
+                    mWriteJsonFile(_path, _data, aBackup=self.__backup)
+                except OSError as e:
+                    mLogError(f'Could not write state to {_path}: {e}')
+
+    def mGetStats(self) -> dict:
+        return {"requested": self.__requested, "written": self.__written, "pending": len(self.__pending)}
+
+# Shared writer for runtime state files, flushed on exit
+stateWriter = JsonStateWriter()
+atexit.register(stateWriter.mFlush)
 
 def mCleanPerkImgFiles() -> None:
     # Make set of img paths under the given directory
@@ -208,47 +317,91 @@ def mUpdatePerksJSON(aPath: str) -> None:
     with open(aPath, 'w') as _file:
         json.dump(_newData, _file, indent=4)
 
-def mMakeUserFile(aUserId: str, aPath: str) -> str:
-    # Skip if user_id is empty
-    if not aUserId:
-        return aPath
-    # Extract directory and original filename from aPath
-    _dir = os.path.dirname(aPath)
-    _originalFilename = os.path.basename(aPath)
-    # Alter filename to include user_id
-    _filename, _ext = os.path.splitext(_originalFilename)
-    _filename = f"{aUserId}_{_filename}"
-    _ext = _ext.lstrip('.')  # Remove the dot from the extension
-    mLogInfo(f"Original filename: {_originalFilename}")
-
-    # Regex pattern to match filenames and extract repeated_count
-    _pattern = re.compile(rf"{re.escape(str(_filename))}")
-    mLogInfo(f"Scanning for pattern: {_pattern.pattern} in directory {_dir}")
-
-    # Get the list of files in the directory
-    _currentFiles = os.listdir(_dir)
-    mLogInfo(f"Found {_currentFiles} files in the directory")
-
-    # Find the highest repeated_count for the given user_id and filename
-    _count = 0
-    for file in _currentFiles:
-        match = _pattern.match(file)
-        if match:
-            _count += 1
-    mLogInfo(f"Found {_count} files with the pattern")
-
-    # Increment the repeated_count for the new file
-    new_count = _count + 1
-
-    # Construct the new filename
-    new_filename = f"{_filename}_{new_count}.{_ext}"
-    
-    # Create the new file path
-    new_file_path = os.path.join(_dir, new_filename)
-    
-    # Rename the original file to the new file path
-    mLogInfo(f"Renamed file to: {new_file_path}")
-    return new_file_path
+# Name stems whose counters FileNamer keeps in memory
+MAX_NAMER_STEMS = 4096
+
+class FileNamer:
+    """
+    Hands out unique numbered file names in constant time. Each name stem (e.g. a user's
+    collage) has its own counter in memory, and every name is claimed by creating the file
+    with O_EXCL, so concurrent renders never get the same name. The first reservation in a
+    directory scans it once and starts the counters of every stem in it after the highest
+    number already on disk. Only the most recently used stems keep a counter, a dropped one
+    resumes by probing from the start.
+    """
+
+    def __init__(self, aMaxStems: int = MAX_NAMER_STEMS) -> None:
+        self.__lock = threading.Lock()
+        self.__counters: OrderedDict[str, int] = OrderedDict()
+        self.__scannedDirs: set[str] = set()
+        self.__maxStems = aMaxStems
+        self.__collisions = 0
+
+    def mReserve(self, aPath: str, aStart: int = 0, aWidth: int = 0) -> str:
+        """
+        Create an empty file named like aPath with a sequence number and return its path.
+
+        Args:
+            aPath (str): The path the name is based on, e.g. generated/user_randombuild.png.
+            aStart (int, optional): The first sequence number. Defaults to 0.
+            aWidth (int, optional): Zero-pad sequence numbers to this width. Defaults to 0.
+
+        Returns:
+            str: The reserved path, e.g. generated/user_randombuild_003.png.
+        """
+        _stem, _ext = os.path.splitext(aPath)
+        _dir = os.path.dirname(_stem)
+        if _dir not in self.__scannedDirs:
+            self.mSeedDir(_dir)
+        while True:
+            with self.__lock:
+                _index = max(aStart, self.__counters.pop(_stem, 0))
+                self.__counters[_stem] = _index + 1
+                self.mTrim()
+            _path = f'{_stem}_{_index:0{aWidth}}{_ext}'
+            try:
+                os.close(os.open(_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+                return _path
+            except FileExistsError:
+                self.__collisions += 1
+
+    def mSeedDir(self, aDir: str) -> None:
+        # Scanned outside the lock, a concurrent scan of the same directory is merged
+        _found = self.mGetNextOnDisk(aDir)
+        with self.__lock:
+            self.__scannedDirs.add(aDir)
+            for _stem, _next in _found.items():
+                if _next > self.__counters.get(_stem, 0):
+                    self.__counters[_stem] = _next
+            self.mTrim()
+
+    def mTrim(self) -> None:
+        # Called with the lock held, drops the least recently used stems
+        while len(self.__counters) > self.__maxStems:
+            self.__counters.popitem(last=False)
+
+    @staticmethod
+    def mGetNextOnDisk(aDir: str) -> dict[str, int]:
+        # One past the highest sequence number of each stem in the directory, with any extension
+        _pattern = re.compile(r'(.+)_(\d+)')
+        _next: dict[str, int] = {}
+        try:
+            with os.scandir(aDir or '.') as _entries:
+                for _entry in _entries:
+                    _match = _pattern.fullmatch(os.path.splitext(_entry.name)[0])
+                    if _match:
+                        _stem = os.path.join(aDir, _match.group(1))
+                        _next[_stem] = max(_next.get(_stem, 0), int(_match.group(2)) + 1)
+        except FileNotFoundError:
+            pass
+        return _next
+
+    def mGetStats(self) -> dict:
+        return {"stems": len(self.__counters), "collisions": self.__collisions}
+
+# Shared namer for generated files
+fileNamer = FileNamer()
+registry.mRegisterCollector('file_namer', fileNamer.mGetStats)
 
 def mGetFile(aRelativePath: str, aCheck: bool = False) -> str:
     # Get base directory
@@ -262,25 +415,23 @@ def mGetFile(aRelativePath: str, aCheck: bool = False) -> str:
     # Return file
     return _fullPath
 
+@mTimed('file')
 def mCleanupDir(aDir: str, aMinutes: int, aExcludeFiles: list[str] = None, aExcludeExts: list[str] = None) -> None:
-    # Get all files in the directory older than a certain amount of hours
-    _files = os.listdir(aDir)
-    _now = time.time()
-    _before = _now - aMinutes * 60
-    _filesToDelete = [os.path.join(aDir, _file) for _file in _files if os.path.getmtime(os.path.join(aDir, _file)) < _before]
-    # Delete all files in list
-    for _file in _filesToDelete:
-        # Skip if file extension is included in the exclude list
-        if aExcludeExts:
-            if os.path.splitext(_file)[1] in aExcludeExts:
+    # Delete the files in the directory older than a certain amount of minutes
+    _before = time.time() - aMinutes * 60
+    with os.scandir(aDir) as _entries:
+        for _entry in _entries:
+            if not _entry.is_file() or _entry.stat().st_mtime >= _before:
+                continue
+            # Skip if file extension is included in the exclude list
+            if aExcludeExts and os.path.splitext(_entry.name)[1] in aExcludeExts:
                 continue
-        # Skip if file is included in the exclude list
-        if aExcludeFiles:
-            if os.path.basename(_file) in aExcludeFiles:
+            # Skip if file is included in the exclude list
+            if aExcludeFiles and _entry.name in aExcludeFiles:
                 continue
-        # Delete file
-        os.remove(_file)
-        mLogInfo(f'File {_file} deleted')
+            # Delete file
+            os.remove(_entry.path)
+            mLogInfo(f'File {_entry.path} deleted')
 
 def mGetDBDConfig() -> dict:
     # Get config file
@@ -294,20 +445,6 @@ def mGetMusicConfig() -> dict:
     _config = mParseJsonFile(_configFile)
     return _config
 
-def mCleanupDbdGenImgsDir(aExcludeFiles: list[str] = None, aExcludeExts: list[str] = None) -> None:
-    # Get config
-    _config = mGetDBDConfig()
-    # Get dbd generated images directory
-    try:
-        _imgsDir = mGetFile(_config['GENERATED_IMG_DIR'], aCheck=True)
-    except FileNotFoundError:
-        mLogError('DBD generated images directory not found')
-        return
-    # Get cleanup interval
-    _maxImgAge = _config['MAX_GENERATED_IMG_AGE']
-    # Cleanup directory
-    mCleanupDir(_imgsDir, _maxImgAge, aExcludeFiles=aExcludeFiles, aExcludeExts=aExcludeExts)
-
 def mGetDBDDataDir() -> str:
     # Get config
     _assetsDir = mGetAssetsDir()
@@ -339,27 +476,6 @@ def mExtractCSVColumn(aPath: str, aColumn: str) -> list[str]:
         _data = [row[aColumn] for row in _csvReader]
         return _data
 
-# Get a map of the id and the name of the perk from a JSON file
-def mGetIdTitleMap(aPath: str) -> dict:
-    # Open file
-    _data = mParseJsonFile(aPath)
-    _map = {}
-    # Extract data
-    for _perkId in _data:
-        _perk = _data[_perkId]
-        _map[_perkId] = _perk['title']
-    return _map
-
-# Get a map of the id and the name of the perk from a CSV file
-def mGetIdTitleMapCSV(aPath: str) -> dict:
-    # Extract data
-    _data = mExtractCSVData(aPath)
-    _map = {}
-    # Extract data
-    for _perk in _data:
-        _map[_perk['id']] = _perk['title']
-    return _map
-
 # Find differences between two maps sets of keys
 def mFindDifferentTitles(aMap1: dict, aMap2: dict) -> list:
     # Check if keys are the same
@@ -381,31 +497,8 @@ def mFindDifferentTitles(aMap1: dict, aMap2: dict) -> list:
 
     return _diffValues
 
-# Find differences between two files and update the second file
-def mUpdateCSVBasedOnJSONFile(aJsonPath: str, aCsvPath: str) -> None:
-    # Get maps from files
-    _jsonMap = mGetIdTitleMap(aJsonPath)
-    _csvMap = mGetIdTitleMapCSV(aCsvPath)
-    # Find differences
-    _diffs = mFindDifferentTitles(_jsonMap, _csvMap)
-    # Update CSV file
-    if not len(_diffs) > 0:
-        mLogInfo('No differences found between JSON and CSV files')
-        return
-    
-    mLogInfo(f'{len(_diffs)} differences found between JSON and CSV files')
-    mLogInfo('Updating CSV file')
-    # Open CSV file
-    with open(aCsvPath, 'w') as _file:
-        # Write CSV data
-        _csvWriter = csv.DictWriter(_file, fieldnames=['id', 'title'])
-        _csvWriter.writeheader()
-        for _perkId in _jsonMap:
-            _perk = _jsonMap[_perkId]
-            _csvWriter.writerow({'id': _perkId, 'title': _perk})
-    mLogInfo('CSV file updated')
-
 # Download files from a URL from Google Drive
+@mTimed('file')
 def mDownloadFromGDrive(aUrl: str, aPath: str) -> None:
     # Get file id from URL
     _match = re.search(r'(?<=d/)(.*?)(?=/view\?)', aUrl)
@@ -417,6 +510,7 @@ def mDownloadFromGDrive(aUrl: str, aPath: str) -> None:
     gdown.download(f'https://drive.google.com/uc?id={_fileId}', aPath, quiet=True)
 
 # Extract a zip file
+@mTimed('file')
 def mExtractZip(aZipPath: str, aExtractPath: str, aRemoveWhenDone: bool = False) -> None:
     with zipfile.ZipFile(aZipPath, 'r') as _zip:
         _zip.extractall(aExtractPath)
@@ -0,0 +1,260 @@
+"""
+Packs the perk images into a single file and serves them through mmap.
+
+Layout:
+    header  struct '<4sHI': magic b'UBPK', version, index length
+    index   JSON: {"name.png": [offset, length, sha256]}, offsets relative to the data
+    data    the encoded images, back to back
+
+Usage:
+    python -m entities.utils.imagepack [--dir assets/dbd/imgs/perks] [--output assets/dbd/imgs/perks.pack]
+"""
+# Generic imports
+import argparse
+import hashlib
+import io
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+
+# Custom imports
+from entities.utils.assets import CHUNK_SIZE, MANIFEST_NAME, mHashFile
+from entities.utils.files import mGetConfigProperty, mGetFile
+from entities.utils.metrics import mTimed, registry
+from log.logger import mLogError, mLogInfo
+
+PACK_MAGIC = b'UBPK'
+PACK_VERSION = 1
+PACK_HEADER = struct.Struct('<4sHI')
+
+
+class PackedImage(io.RawIOBase):
+    """
+    Read-only file object over a slice of the pack. Nothing is copied until it is read, so it
+    can be handed to PIL or discord.File in place of a path.
+    """
+
+    def __init__(self, aView: memoryview, aName: str) -> None:
+        super().__init__()
+        self.__view = aView
+        self.__pos = 0
+        self.name = aName
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, aBuffer) -> int:
+        _size = min(len(aBuffer), len(self.__view) - self.__pos)
+        if _size <= 0:
+            return 0
+        aBuffer[:_size] = self.__view[self.__pos:self.__pos + _size]
+        self.__pos += _size
+        return _size
+
+    def readall(self) -> bytes:
+        _data = bytes(self.__view[self.__pos:])
+        self.__pos = len(self.__view)
+        return _data
+
+    def seek(self, aOffset: int, aWhence: int = io.SEEK_SET) -> int:
+        _base = {io.SEEK_SET: 0, io.SEEK_CUR: self.__pos, io.SEEK_END: len(self.__view)}[aWhence]
+        if _base + aOffset < 0:
+            raise ValueError('Negative seek position')
+        self.__pos = _base + aOffset
+        return self.__pos
+
+    def tell(self) -> int:
+        return self.__pos
+
+    def close(self) -> None:
+        if not self.closed:
+            self.__view.release()
+        super().close()
+
+
+class ImagePack:
+    """
+    Random access to the images of a pack file. The index is parsed once and every lookup is a
+    slice of the mapped file.
+    """
+
+    def __init__(self, aPath: str) -> None:
+        self.__path = aPath
+        with open(aPath, 'rb') as _file:
+            self.__stat = os.fstat(_file.fileno())
+            self.__mmap = mmap.mmap(_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            _magic, _version, _indexSize = PACK_HEADER.unpack_from(self.__mmap, 0)
+            if _magic != PACK_MAGIC or _version != PACK_VERSION:
+                raise ValueError(f'{aPath} is not a version {PACK_VERSION} image pack')
+            _indexEnd = PACK_HEADER.size + _indexSize
+            self.__index: dict[str, list] = json.loads(self.__mmap[PACK_HEADER.size:_indexEnd])
+            self.__dataStart = _indexEnd
+            self.__view = memoryview(self.__mmap)
+        except Exception:
+            self.__mmap.close()
+            raise
+        # Metrics
+        self.__hits = 0
+        self.__misses = 0
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    def __contains__(self, aName: str) -> bool:
+        return aName in self.__index
+
+    def __len__(self) -> int:
+        return len(self.__index)
+
+    def mIsCurrent(self) -> bool:
+        # False once the file on disk was replaced
+        try:
+            _stat = os.stat(self.__path)
+        except OSError:
+            return False
+        return (_stat.st_ino, _stat.st_mtime_ns, _stat.st_size) == (self.__stat.st_ino, self.__stat.st_mtime_ns, self.__stat.st_size)
+
+    def mGetNames(self) -> list[str]:
+        return list(self.__index)
+
+    def mGetBytes(self, aName: str) -> memoryview | None:
+        _entry = self.__index.get(aName)
+        if _entry is None:
+            self.__misses += 1
+            return None
+        self.__hits += 1
+        _start = self.__dataStart + _entry[0]
+        return self.__view[_start:_start + _entry[1]]
+
+    def mOpen(self, aName: str) -> PackedImage | None:
+        _view = self.mGetBytes(aName)
+        return PackedImage(_view, aName) if _view is not None else None
+
+    def mVerify(self) -> list[str]:
+        """
+        Hash every image against the index and return the names that don't match.
+        """
+        _bad = []
+        for _name, (_offset, _length, _sha) in self.__index.items():
+            _start = self.__dataStart + _offset
+            if _start + _length > len(self.__mmap) or hashlib.sha256(self.__view[_start:_start + _length]).hexdigest() != _sha:
+                _bad.append(_name)
+        return _bad
+
+    def mClose(self) -> None:
+        self.__view.release()
+        try:
+            self.__mmap.close()
+        except BufferError:
+            # Images that are still being read keep the mapping alive until they are closed
+            pass
+
+    def mGetStats(self) -> dict:
+        return {
+            "images": len(self.__index),
+            "bytes": len(self.__mmap) - self.__dataStart,
+            "hits": self.__hits,
+            "misses": self.__misses
+        }
+
+
+@mTimed('file')
+def mBuildImagePack(aDir: str, aPath: str, aExtensions: tuple[str, ...] = ('.png',)) -> dict:
+    """
+    Convert a directory of images into a pack file. The pack is written next to its final path
+    and renamed into place, so readers never see a partial file.
+
+    Args:
+        aDir (str): The directory with the images. Names in the pack are relative to it.
+        aPath (str): The pack file to write.
+        aExtensions (tuple[str, ...]): The file extensions to include.
+
+    Returns:
+        dict: How many images and bytes were packed.
+    """
+    # Index the files first so the header can be written before the data
+    _files = []
+    for _root, _, _names in os.walk(aDir):
+        for _name in _names:
+            if _name == MANIFEST_NAME or not _name.lower().endswith(aExtensions):
+                continue
+            _files.append(os.path.join(_root, _name))
+    _files.sort()
+    _index = {}
+    _offset = 0
+    for _file in _files:
+        _sha, _size = mHashFile(_file)
+        _index[os.path.relpath(_file, aDir).replace(os.sep, '/')] = [_offset, _size, _sha]
+        _offset += _size
+    _indexData = json.dumps(_index, separators=(',', ':')).encode('utf-8')
+
+    # Write the pack atomically
+    _dir = os.path.dirname(os.path.abspath(aPath))
+    os.makedirs(_dir, exist_ok=True)
+    _fd, _tmpPath = tempfile.mkstemp(dir=_dir, suffix='.part')
+    try:
+        with os.fdopen(_fd, 'wb') as _pack:
+            _pack.write(PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, len(_indexData)))
+            _pack.write(_indexData)
+            for _file in _files:
+                with open(_file, 'rb') as _image:
+                    shutil.copyfileobj(_image, _pack, CHUNK_SIZE)
+            _pack.flush()
+            os.fsync(_pack.fileno())
+        os.replace(_tmpPath, aPath)
+    except BaseException:
+        if os.path.exists(_tmpPath):
+            os.remove(_tmpPath)
+        raise
+    mLogInfo(f'{len(_index)} images packed into {aPath} ({_offset} bytes)')
+    return {"images": len(_index), "bytes": _offset}
+
+
+# Perk image pack, reopened when the file is replaced
+_perkPack: ImagePack | None = None
+_perkPackLock = threading.Lock()
+
+
+def mGetPerkPack() -> ImagePack | None:
+    """
+    Return the configured perk image pack, or None if there isn't one.
+    """
+    global _perkPack
+    _packPath = mGetConfigProperty('PERKS_IMG_PACK')
+    if not _packPath:
+        return None
+    with _perkPackLock:
+        if _perkPack is not None and _perkPack.mIsCurrent():
+            return _perkPack
+        if _perkPack is not None:
+            _perkPack.mClose()
+            _perkPack = None
+        _path = mGetFile(_packPath)
+        if not os.path.exists(_path):
+            return None
+        try:
+            _perkPack = ImagePack(_path)
+            mLogInfo(f'Perk image pack {_path} opened with {len(_perkPack)} images')
+        except (OSError, ValueError) as e:
+            mLogError(f'Could not open perk image pack {_path}: {e}')
+        return _perkPack
+
+
+registry.mRegisterCollector('perk_pack', lambda: _perkPack.mGetStats() if _perkPack else {})
+
+
+if __name__ == '__main__':
+    _parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _parser.add_argument('--dir', default=mGetConfigProperty('PERKS_IMG_DIR'), help='The directory with the perk images.')
+    _parser.add_argument('--output', default=mGetConfigProperty('PERKS_IMG_PACK'), help='The pack file to write.')
+    _args = _parser.parse_args()
+    print(mBuildImagePack(mGetFile(_args.dir), mGetFile(_args.output)))
@@ -1,13 +1,27 @@
-# General imports
+# Generic imports
 import os
 
 # Specific imports
 from PIL import Image, ImageDraw, ImageFont
+from typing import BinaryIO
 
 # Custom imports
-from log.logger import mLogInfo
-from entities.utils.files import mMakeUserFile
+from entities.utils.artifacts import mTrackArtifact
+from entities.utils.metrics import mTimed
+from log.logger import mLogError, mLogInfo
+from entities.utils.files import fileNamer, mGetConfigProperty
 
+# Encoding profiles for generated images. "colors" quantizes to a palette before encoding.
+ENCODING_PROFILES = {
+    "png": {"format": "PNG", "ext": ".png", "options": {}},
+    "png_fast": {"format": "PNG", "ext": ".png", "options": {"compress_level": 1}},
+    "png_palette": {"format": "PNG", "ext": ".png", "colors": 256, "options": {"compress_level": 6}},
+    "webp": {"format": "WEBP", "ext": ".webp", "options": {"quality": 85, "method": 4}},
+    "webp_lossless": {"format": "WEBP", "ext": ".webp", "options": {"lossless": True, "quality": 0, "method": 1}}
+}
+DEFAULT_ENCODING = 'png'
+
+@mTimed('render')
 def mCreateCollage(aImagePaths: list[str], aWidth: int, aHeight: int, aTitle=None, aOffset: int = 5) -> Image:
     # Initialize the width and height of the image
     _titleOffset = 15 if aTitle else 0
@@ -42,23 +56,43 @@ def mCreateCollage(aImagePaths: list[str], aWidth: int, aHeight: int, aTitle=Non
     mLogInfo(f'Collage of size {_totalWidth}x{_totalHeight} created with title {aTitle if aTitle else "None"}')
     return _collage
 
-def mSaveImage(aImage: Image, aPath: str) -> str:
-    # Check if the filename already exists
-    _counter = 0
-    _parentDir = os.path.dirname(aPath)
-    _basename = os.path.basename(aPath)
-    _filename = os.path.splitext(_basename)[0]
-    _extension = os.path.splitext(_basename)[1]
-    
-    for _file in os.listdir(_parentDir):
-        if _file.startswith(_filename):
-            _counter += 1
-    
-    # Create the new filename
-    _path = os.path.join(_parentDir, f'{_filename}_{_counter:03}.{_extension}')
-    
-    # Save the image
-    aImage.save(_path)
+def mGetEncodingProfile(aName: str = None) -> dict:
+    """
+    Return an encoding profile by name, or the one set in COLLAGE_ENCODING. For the configured
+    profile, options in COLLAGE_ENCODING_OPTIONS override its encoder options.
+    """
+    _name = aName or mGetConfigProperty('COLLAGE_ENCODING') or DEFAULT_ENCODING
+    if _name not in ENCODING_PROFILES:
+        mLogError(f'Unknown encoding profile {_name}, using {DEFAULT_ENCODING}')
+        _name = DEFAULT_ENCODING
+    _profile = dict(ENCODING_PROFILES[_name])
+    _options = mGetConfigProperty('COLLAGE_ENCODING_OPTIONS') if aName is None else None
+    _profile["options"] = {**_profile["options"], **(_options or {})}
+    _profile["name"] = _name
+    return _profile
+
+@mTimed('render')
+def mEncodeImage(aImage: Image, aFile: str | BinaryIO, aProfile: dict) -> None:
+    # Quantize first for palette profiles, keeping the transparency
+    _image = aImage
+    if aProfile.get("colors"):
+        _image = aImage.quantize(aProfile["colors"], method=Image.Quantize.FASTOCTREE)
+    _image.save(aFile, aProfile["format"], **aProfile["options"])
+
+@mTimed('render')
+def mSaveImage(aImage: Image, aPath: str, aProfile: str = None) -> str:
+    # The extension follows the profile's format
+    _profile = mGetEncodingProfile(aProfile)
+    _path = os.path.splitext(aPath)[0] + _profile["ext"]
+    # Claim a unique numbered name, e.g. user_randombuild_003.png
+    _path = fileNamer.mReserve(_path, aWidth=3)
+
+    # Save the image, giving the name back if it fails
+    try:
+        mEncodeImage(aImage, _path, _profile)
+    except Exception:
+        os.remove(_path)
+        raise
+    mTrackArtifact(_path)
     mLogInfo(f'Image saved to {_path}')
     return _path
-
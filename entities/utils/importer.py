@@ -0,0 +1,177 @@
+"""
+Bulk import of CSV files shaped like exported/matches.csv or dbdperkusage.csv.
+
+Usage:
+    python -m entities.utils.importer FILE [FILE ...] [--batch-size 5000] [--transaction-rows 50000] [--keep-ids]
+
+Rows are read in batches and loaded with executemany, committing every --transaction-rows rows.
+Perk names are checked against the perks table, and rows that don't validate are skipped and
+reported with their line number.
+"""
+# Generic imports
+import argparse
+import csv
+import time
+
+# Specific imports
+from datetime import datetime
+
+# Custom imports
+from entities.utils.metrics import mTimed
+from entities.utils.sql import SQLRetriever
+from log.logger import mLogError, mLogInfo
+
+IMPORT_BATCH_SIZE = 5000
+IMPORT_TRANSACTION_ROWS = 50000
+MAX_REPORTED_ERRORS = 20
+MATCH_OUTCOMES = {'ESCAPE', 'DEATH'}
+MATCH_DATE_EXAMPLE = '2024-08-31 20:48:49'
+MATCH_PERK_COLUMNS = ['perk_1_name', 'perk_2_name', 'perk_3_name', 'perk_4_name']
+
+# Supported file shapes, told apart by their header
+IMPORT_SPECS = {
+    "matches": {
+        "header": {'user', 'match_date', 'outcome', *MATCH_PERK_COLUMNS},
+        "columns": ['user', 'outcome', 'match_date', *MATCH_PERK_COLUMNS],
+        "statement": 'INSERT INTO matches ({columns}) VALUES ({values});'
+    },
+    "perk_usage": {
+        "header": {'title', 'games', 'escapes', 'deaths'},
+        "columns": ['perk_name', 'games', 'escapes', 'deaths'],
+        "create": 'CREATE TABLE IF NOT EXISTS perk_usage (perk_name VARCHAR(255) PRIMARY KEY, games INT, escapes INT, deaths INT);',
+        # A usage file is a snapshot, so importing it again replaces the previous counts
+        "statement": 'REPLACE INTO perk_usage ({columns}) VALUES ({values});'
+    }
+}
+
+
+def mGetCatalog(aRetriever: SQLRetriever) -> dict[str, str]:
+    # Lowercased perk name -> name in the perks table
+    _results, _ = aRetriever.mRetrieve('SELECT name FROM perks;')
+    return {_row[0].lower(): _row[0] for _row in _results}
+
+
+def mGetShape(aFieldNames: list[str]) -> str:
+    for _shape, _spec in IMPORT_SPECS.items():
+        if _spec["header"] <= set(aFieldNames):
+            return _shape
+    raise ValueError(f'Unknown CSV shape with columns {aFieldNames}')
+
+
+def mGetPerkName(aName: str, aCatalog: dict[str, str]) -> str:
+    _name = aCatalog.get(aName.strip().lower())
+    if _name is None:
+        raise ValueError(f'unknown perk {aName!r}')
+    return _name
+
+
+def mGetCount(aRow: dict, aColumn: str) -> int:
+    _count = int(aRow[aColumn])
+    if _count < 0:
+        raise ValueError(f'negative {aColumn}')
+    return _count
+
+
+def mParseMatchRow(aRow: dict, aCatalog: dict[str, str], aKeepIds: bool) -> tuple:
+    _outcome = aRow['outcome'].strip().upper()
+    if _outcome not in MATCH_OUTCOMES:
+        raise ValueError(f'unknown outcome {aRow["outcome"]!r}')
+    # Validate the date but keep the text, both databases parse it. fromisoformat is much faster
+    # than strptime but also takes other ISO forms, hence the length check
+    _date = aRow['match_date'].strip()
+    if len(_date) != len(MATCH_DATE_EXAMPLE):
+        raise ValueError(f'match_date {_date!r} is not like {MATCH_DATE_EXAMPLE}')
+    datetime.fromisoformat(_date)
+    _perks = tuple(mGetPerkName(aRow[_column], aCatalog) for _column in MATCH_PERK_COLUMNS)
+    _values = (int(aRow['user']), _outcome, _date) + _perks
+    return (int(aRow['id']),) + _values if aKeepIds else _values
+
+
+def mParsePerkUsageRow(aRow: dict, aCatalog: dict[str, str], aKeepIds: bool) -> tuple:
+    return mGetPerkName(aRow['title'], aCatalog), mGetCount(aRow, 'games'), mGetCount(aRow, 'escapes'), mGetCount(aRow, 'deaths')
+
+
+_parsers = {"matches": mParseMatchRow, "perk_usage": mParsePerkUsageRow}
+
+
+@mTimed('sql')
+def mImportCsv(aPath: str, aRetriever: SQLRetriever, aCatalog: dict[str, str] = None, aBatchSize: int = IMPORT_BATCH_SIZE,
+               aTransactionRows: int = IMPORT_TRANSACTION_ROWS, aKeepIds: bool = False) -> dict:
+    """
+    Stream a CSV file into its table in batches.
+
+    Args:
+        aPath (str): The CSV file, shaped like matches.csv or dbdperkusage.csv.
+        aRetriever (SQLRetriever): The database to load into.
+        aCatalog (dict[str, str], optional): Lowercased perk name -> perk name. Read from the perks table if not given.
+        aBatchSize (int, optional): Rows per executemany call. Defaults to IMPORT_BATCH_SIZE.
+        aTransactionRows (int, optional): Rows per transaction. Defaults to IMPORT_TRANSACTION_ROWS.
+        aKeepIds (bool, optional): Keep the ids of a matches file instead of assigning new ones. Defaults to False.
+
+    Returns:
+        dict: The table, rows read, imported and invalid, the first errors and the import speed.
+    """
+    _start = time.perf_counter()
+    _catalog = aCatalog if aCatalog is not None else mGetCatalog(aRetriever)
+    with open(aPath, 'r', encoding='utf-8', newline='') as _file:
+        _reader = csv.DictReader(_file)
+        _shape = mGetShape(_reader.fieldnames or [])
+        _spec = IMPORT_SPECS[_shape]
+        _parser = _parsers[_shape]
+        _columns = (['id'] if aKeepIds and _shape == 'matches' else []) + _spec["columns"]
+        _query = _spec["statement"].format(columns=', '.join(_columns), values=', '.join([aRetriever.mGetPlaceholder()] * len(_columns)))
+        if "create" in _spec:
+            aRetriever.mExecute(_spec["create"])
+
+        _report = {"table": _shape, "rows": 0, "imported": 0, "invalid": 0, "errors": []}
+        _batch = []
+        _uncommitted = 0
+        try:
+            for _row in _reader:
+                _report["rows"] += 1
+                try:
+                    _batch.append(_parser(_row, _catalog, aKeepIds))
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    _report["invalid"] += 1
+                    if len(_report["errors"]) < MAX_REPORTED_ERRORS:
+                        _report["errors"].append(f'line {_reader.line_num}: {e}')
+                    continue
+                if len(_batch) >= aBatchSize:
+                    _uncommitted += aRetriever.mExecuteMany(_query, _batch)
+                    _batch = []
+                    if _uncommitted >= aTransactionRows:
+                        aRetriever.conn.commit()
+                        _report["imported"] += _uncommitted
+                        _uncommitted = 0
+            if _batch:
+                _uncommitted += aRetriever.mExecuteMany(_query, _batch)
+            aRetriever.conn.commit()
+            _report["imported"] += _uncommitted
+        except Exception as e:
+            # Earlier transactions stay committed, see "imported"
+            aRetriever.conn.rollback()
+            mLogError(f'Import of {aPath} failed after {_report["imported"]} rows: {e}')
+            raise
+
+    _seconds = time.perf_counter() - _start
+    _report["seconds"] = _seconds
+    _report["rowsPerSec"] = _report["imported"] / _seconds if _seconds else 0.0
+    mLogInfo(f'{_report["imported"]} rows imported into {_shape} from {aPath} ({_report["invalid"]} invalid, {_report["rowsPerSec"]:.0f} rows/s)')
+    return _report
+
+
+if __name__ == '__main__':
+    _parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _parser.add_argument('files', nargs='+', help='CSV files to import.')
+    _parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    _parser.add_argument('--transaction-rows', type=int, default=IMPORT_TRANSACTION_ROWS)
+    _parser.add_argument('--keep-ids', action='store_true', help='Keep the ids of matches files.')
+    _args = _parser.parse_args()
+
+    _retriever = SQLRetriever()
+    _catalog = mGetCatalog(_retriever)
+    for _path in _args.files:
+        _report = mImportCsv(_path, _retriever, _catalog, _args.batch_size, _args.transaction_rows, _args.keep_ids)
+        print(f'{_path}: {_report["imported"]}/{_report["rows"]} rows into {_report["table"]}, {_report["invalid"]} invalid, {_report["rowsPerSec"]:.0f} rows/s')
+        for _error in _report["errors"]:
+            print(f'  {_error}')
@@ -0,0 +1,222 @@
+# Generic imports
+import functools
+import inspect
+import os
+import threading
+import time
+
+# Specific imports
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+# Custom imports
+from entities.utils.tracing import mChildSpan, mSpan
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Latency buckets in seconds, from autocomplete lookups up to slow uploads
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Layers whose calls start a trace, the others are only traced inside one
+TRACE_ROOT_LAYERS = ('command', 'interaction')
+
+
+class Histogram:
+    """
+    Cumulative latency histogram with fixed buckets, as exposed by Prometheus.
+    """
+
+    def __init__(self, aBuckets: tuple = LATENCY_BUCKETS) -> None:
+        self.buckets = aBuckets
+        self.counts = [0] * (len(aBuckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def mObserve(self, aValue: float) -> None:
+        self.counts[bisect_left(self.buckets, aValue)] += 1
+        self.sum += aValue
+        self.count += 1
+
+    def mGetQuantile(self, aQuantile: float) -> float:
+        # Upper bound of the bucket holding the quantile
+        _target = aQuantile * self.count
+        _seen = 0
+        for _index, _count in enumerate(self.counts):
+            _seen += _count
+            if _seen >= _target and _count:
+                return self.buckets[_index] if _index < len(self.buckets) else float('inf')
+        return 0.0
+
+
+class MetricsRegistry:
+    """
+    Latency histograms, error counters and in-flight gauges per (layer, name), plus gauges
+    read from registered collectors when the metrics are exported.
+    """
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__latencies: dict[tuple[str, str], Histogram] = {}
+        self.__errors: dict[tuple[str, str], int] = {}
+        self.__inFlight: dict[tuple[str, str], int] = {}
+        self.__collectors: dict[str, Callable[[], dict]] = {}
+
+    def mStart(self, aKey: tuple[str, str]) -> None:
+        with self.__lock:
+            self.__inFlight[aKey] = self.__inFlight.get(aKey, 0) + 1
+
+    def mFinish(self, aKey: tuple[str, str], aSeconds: float, aFailed: bool) -> None:
+        with self.__lock:
+            self.__inFlight[aKey] -= 1
+            _histogram = self.__latencies.get(aKey)
+            if _histogram is None:
+                _histogram = self.__latencies[aKey] = Histogram()
+            _histogram.mObserve(aSeconds)
+            if aFailed:
+                self.__errors[aKey] = self.__errors.get(aKey, 0) + 1
+
+    def mRegisterCollector(self, aName: str, aCollector: Callable[[], dict]) -> None:
+        self.__collectors[aName] = aCollector
+
+    def mGetSummary(self) -> list[dict]:
+        with self.__lock:
+            return [{
+                "layer": _key[0],
+                "name": _key[1],
+                "count": _histogram.count,
+                "errors": self.__errors.get(_key, 0),
+                "inFlight": self.__inFlight.get(_key, 0),
+                "avg": _histogram.sum / _histogram.count,
+                "p50": _histogram.mGetQuantile(0.5),
+                "p95": _histogram.mGetQuantile(0.95)
+            } for _key, _histogram in self.__latencies.items()]
+
+    def mGetCollected(self) -> dict[str, dict]:
+        _collected = {"process": mGetProcessStats()}
+        for _name, _collector in self.__collectors.items():
+            _collected[_name] = _collector()
+        return _collected
+
+    def mRenderPrometheus(self) -> str:
+        _lines = [
+            '# HELP ultrabot_latency_seconds Latency of instrumented calls.',
+            '# TYPE ultrabot_latency_seconds histogram'
+        ]
+        with self.__lock:
+            for (_layer, _name), _histogram in sorted(self.__latencies.items()):
+                _labels = f'layer="{_layer}",name="{_name}"'
+                _cumulative = 0
+                for _bound, _count in zip(_histogram.buckets + (float('inf'),), _histogram.counts):
+                    _cumulative += _count
+                    _le = '+Inf' if _bound == float('inf') else repr(_bound)
+                    _lines.append(f'ultrabot_latency_seconds_bucket{{{_labels},le="{_le}"}} {_cumulative}')
+                _lines.append(f'ultrabot_latency_seconds_sum{{{_labels}}} {_histogram.sum}')
+                _lines.append(f'ultrabot_latency_seconds_count{{{_labels}}} {_histogram.count}')
+            _lines += ['# HELP ultrabot_errors_total Instrumented calls that raised.', '# TYPE ultrabot_errors_total counter']
+            for (_layer, _name), _errors in sorted(self.__errors.items()):
+                _lines.append(f'ultrabot_errors_total{{layer="{_layer}",name="{_name}"}} {_errors}')
+            _lines += ['# HELP ultrabot_in_flight Instrumented calls currently running.', '# TYPE ultrabot_in_flight gauge']
+            for (_layer, _name), _count in sorted(self.__inFlight.items()):
+                _lines.append(f'ultrabot_in_flight{{layer="{_layer}",name="{_name}"}} {_count}')
+        # Gauges from collectors
+        for _collector, _values in self.mGetCollected().items():
+            for _key, _value in _values.items():
+                if isinstance(_value, (int, float)):
+                    _lines.append(f'# TYPE ultrabot_{_collector}_{_key} gauge')
+                    _lines.append(f'ultrabot_{_collector}_{_key} {float(_value)}')
+        return '\n'.join(_lines) + '\n'
+
+
+# Global registry used by the instrumentation decorator
+registry = MetricsRegistry()
+
+
+def mGetProcessStats() -> dict:
+    _stats = {
+        "cpu_seconds": time.process_time(),
+        "threads": threading.active_count()
+    }
+    if resource is not None:
+        # ru_maxrss is reported in kilobytes on Linux
+        _stats["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return _stats
+
+
+def mTimed(aLayer: str, aName: str = None):
+    """
+    Record latency, errors and in-flight calls of a function or coroutine function, and a
+    tracing span for each call. Calls in TRACE_ROOT_LAYERS start a trace, calls in other
+    layers only get a span inside one.
+
+    Args:
+        aLayer (str): The layer the function belongs to, e.g. 'command', 'handler' or 'sql'.
+        aName (str, optional): The metric name. Defaults to the qualified name of the function.
+    """
+    def _mDecorator(aFunction):
+        _key = (aLayer, aName or aFunction.__qualname__)
+        _mSpan = mSpan if aLayer in TRACE_ROOT_LAYERS else mChildSpan
+
+        if inspect.iscoroutinefunction(aFunction):
+            @functools.wraps(aFunction)
+            async def _mAsyncWrapper(*args, **kwargs):
+                registry.mStart(_key)
+                _start = time.perf_counter()
+                _failed = True
+                try:
+                    with _mSpan(_key[1], layer=aLayer):
+                        _result = await aFunction(*args, **kwargs)
+                    _failed = False
+                    return _result
+                finally:
+                    registry.mFinish(_key, time.perf_counter() - _start, _failed)
+            return _mAsyncWrapper
+
+        @functools.wraps(aFunction)
+        def _mWrapper(*args, **kwargs):
+            registry.mStart(_key)
+            _start = time.perf_counter()
+            _failed = True
+            try:
+                with _mSpan(_key[1], layer=aLayer):
+                    _result = aFunction(*args, **kwargs)
+                _failed = False
+                return _result
+            finally:
+                registry.mFinish(_key, time.perf_counter() - _start, _failed)
+        return _mWrapper
+    return _mDecorator
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        _body = registry.mRenderPrometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(_body)))
+        self.end_headers()
+        self.wfile.write(_body)
+
+    def log_message(self, format, *args):
+        # Scrapes are not worth a log line
+        pass
+
+
+def mStartMetricsServer(aPort: int = None, aHost: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """
+    Serve the metrics in Prometheus text format on a local port from a daemon thread.
+
+    Args:
+        aPort (int, optional): The port to listen on. Defaults to the METRICS_PORT env variable or 9108.
+        aHost (str, optional): The interface to bind to. Defaults to localhost only.
+    """
+    _port = aPort if aPort is not None else int(os.getenv('METRICS_PORT', 9108))
+    _server = ThreadingHTTPServer((aHost, _port), _MetricsRequestHandler)
+    _thread = threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True)
+    _thread.start()
+    return _server
@@ -1,40 +1,192 @@
+import asyncio
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple, Any
 
 import youtube_dl as ydl
 
-from entities.utils.files import mGetMusicConfig
+from entities.utils.audiocache import AudioCache, mGetAudioCache
+from entities.utils.files import mGetFile, mGetMusicConfig
+from entities.utils.metrics import mTimed
+from entities.utils.trackcache import TrackCache, mGetTrackCache, mGetTrackKey, mNormalizeInfo
 
-async def mGetSource(aUrl: str) -> tuple[Any, str]:
+# Songs resolved ahead of the one playing
+PREFETCH_COUNT = 2
+# 'stream' plays the media URL through FFmpeg, 'download' saves the file first
+PLAYBACK_MODE = 'stream'
+# Reconnect when a media server drops the connection mid-song
+FFMPEG_STREAM_OPTIONS = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+
+_executor: ThreadPoolExecutor = None
+_extractor = None
+
+
+class YoutubeDLExtractor:
+    """
+    Resolves and downloads a song with youtube_dl. Blocking, so it runs in the music executor.
+    """
+    def __init__(self, aOptions: dict = None) -> None:
+        self.options = aOptions or {
+            'format': 'bestaudio/best',
+            'noplaylist': True,
+            'extractaudio': True,
+            'audioformat': 'mp3',
+            # Named by video id, titles can collide
+            'outtmpl': os.path.join(mGetFile(mGetMusicConfig().get('DOWNLOAD_PATH')), '%(id)s.%(ext)s'),
+            'quiet': True,
+            'no_warnings': True
+        }
+
+    def mExtract(self, aUrl: str, aDownload: bool = True, aDir: str = None) -> tuple[Any, str | None]:
+        _options = self.options
+        if aDir:
+            _options = dict(self.options, outtmpl=os.path.join(aDir, os.path.basename(self.options["outtmpl"])))
+        with ydl.YoutubeDL(_options) as _ydl:
+            # Extract song info and download in one pass, download([url]) would extract again
+            _info = _ydl.extract_info(aUrl, download=aDownload)
+            _fileName = _ydl.prepare_filename(_info) if aDownload else None
+        return _info, _fileName
+
+
+class LocalExtractor:
+    """
+    Plays local files, given as paths or file:// URLs. For tests and offline use.
     """
-    Get the source of a URL.
+    def mExtract(self, aUrl: str, aDownload: bool = True, aDir: str = None) -> tuple[Any, str]:
+        _path = aUrl.removeprefix('file://')
+        if not os.path.isfile(_path):
+            raise FileNotFoundError(f'No such file: {_path}')
+        _title = os.path.splitext(os.path.basename(_path))[0]
+        return {"id": _path, "title": _title, "duration": 0, "formats": [{"url": _path}]}, _path
+
+
+class CachedExtractor:
+    """
+    Looks a URL up in the track cache before extracting it, and caches what the wrapped
+    extractor returns. A hit needs the downloaded file to still be there, or when streaming, a
+    media URL that hasn't expired. With an audio cache, downloads go through it and cached files
+    are played even when streaming.
+    """
+    def __init__(self, aExtractor, aCache: TrackCache = None, aAudioCache: AudioCache = None) -> None:
+        self.extractor = aExtractor
+        self.cache = aCache
+        self.audioCache = aAudioCache
+
+    def mGetCachedPath(self, aUrl: str, aInfo: dict) -> str | None:
+        if self.audioCache is not None:
+            return self.audioCache.mGetPath(mGetTrackKey(aUrl))
+        return aInfo["path"] if aInfo.get('path') and os.path.isfile(aInfo["path"]) else None
+
+    def mGetCached(self, aUrl: str, aDownload: bool = True) -> tuple[Any, str | None] | None:
+        _info = self.cache.mGet(aUrl) if self.cache is not None else None
+        if not _info:
+            return None
+        _path = self.mGetCachedPath(aUrl, _info)
+        if _path:
+            # The passthrough check was made for the file cached with the info
+            if _info.get('path') != _path:
+                _info["opus_passthrough"] = False
+            _info["path"] = _path
+            return _info, _path
+        if not aDownload and mGetStreamUrl(_info) and mIsStreamValid(_info):
+            return _info, None
+        return None
+
+    def mExtract(self, aUrl: str, aDownload: bool = True) -> tuple[Any, str | None]:
+        _cached = self.mGetCached(aUrl, aDownload)
+        if _cached:
+            return _cached
+        _key = mGetTrackKey(aUrl)
+        _path = self.audioCache.mGetPath(_key) if self.audioCache is not None else None
+        if _path or not aDownload:
+            _info, _ = self.extractor.mExtract(aUrl, False)
+        elif self.audioCache is not None:
+            _result = {}
+
+            def _mDownload(aDir: str) -> str:
+                _result["info"], _file = self.extractor.mExtract(aUrl, True, aDir)
+                return _file
+            _path = self.audioCache.mFill(_key, _mDownload)
+            # Stream instead when the disk is full
+            _info = _result["info"] if _path else self.extractor.mExtract(aUrl, False)[0]
+        else:
+            _info, _path = self.extractor.mExtract(aUrl, True)
+        _info = mNormalizeInfo(_info, _path)
+        if self.cache is not None:
+            self.cache.mSet(aUrl, _info)
+        return _info, _path
+
+
+def mGetStreamUrl(aInfo: dict) -> str | None:
+    # The selected format's URL, or the best audio format's
+    if aInfo.get('url'):
+        return aInfo["url"]
+    _formats = [_format for _format in aInfo.get('formats') or [] if _format.get('url') and _format.get('acodec') != 'none']
+    return max(_formats, key=lambda aFormat: aFormat.get('abr') or 0)["url"] if _formats else None
+
+
+def mIsStreamValid(aInfo: dict) -> bool:
+    # Media URLs expire, leave time to play the whole song. One without a known expiry isn't trusted
+    _expires = aInfo.get('stream_expires')
+    return _expires is not None and _expires > time.time() + (aInfo.get('duration') or 0) + 60
+
+
+def mGetFFmpegOptions(aSource: str) -> dict:
+    """
+    FFmpegPCMAudio options for a file or a media URL.
+    """
+    _options = {"options": '-vn'}
+    if aSource.startswith(('http://', 'https://')):
+        _options["before_options"] = mGetMusicConfig().get('FFMPEG_STREAM_OPTIONS', FFMPEG_STREAM_OPTIONS)
+    return _options
+
+
+def mGetExtractor():
+    global _extractor
+    if _extractor is None:
+        _cache = mGetTrackCache()
+        _audioCache = mGetAudioCache()
+        if _cache is None and _audioCache is None:
+            _extractor = YoutubeDLExtractor()
+        else:
+            _extractor = CachedExtractor(YoutubeDLExtractor(), _cache, _audioCache)
+    return _extractor
+
+
+def mSetExtractor(aExtractor) -> None:
+    # Any object with a blocking mExtract(url, download, dir=None) -> (info, path or None)
+    global _extractor
+    _extractor = aExtractor
+
+
+def mGetExecutor() -> ThreadPoolExecutor:
+    # Bounded, so prefetching a long queue can't start a download per song. Two workers more than
+    # the prefetched songs keep one free for a skip next to a cache download
+    global _executor
+    if _executor is None:
+        _workers = int(mGetMusicConfig().get('PREFETCH_WORKERS', PREFETCH_COUNT + 2))
+        _executor = ThreadPoolExecutor(max_workers=_workers, thread_name_prefix='music')
+    return _executor
+
+
+@mTimed('music')
+async def mGetSource(aUrl: str, aExtractor=None, aDownload: bool = True) -> tuple[Any, str | None]:
+    """
+    Get the source of a URL without blocking the event loop.
 
     Args:
         aUrl (str): The URL to get the source of.
+        aExtractor (optional): The extractor to use. Defaults to mGetExtractor().
+        aDownload (bool, optional): Download the song. Otherwise only its media URL is resolved.
 
     Returns:
-        ydl.YoutubeDL: The source of the URL.
-    """
-    _ydlOptions = {
-        'format': 'bestaudio/best',
-        'noplaylist': True,
-        'extractaudio': True,
-        'audioformat': 'mp3',
-        'outtmpl': '%(id)s.%(ext)s',
-        'quiet': True,
-        'no_warnings': True
-    }
-
-    with ydl.YoutubeDL(_ydlOptions) as _ydl:
-        # Extract song info
-        _info = _ydl.extract_info(aUrl, download=False)
-        _songName: str = _info.get('title', 'Unknown Song')
-        # Remove special characters from the song name
-        _songName = ''.join(e for e in _songName if e.isalnum())[:20]
-        # Set the download directory
-        _downloadDir = mGetMusicConfig().get('DOWNLOAD_PATH')
-        _fileName = os.path.join(_downloadDir, f'{_songName}.{_ydlOptions.get("audioformat")}')
-        _ydl.prepare_filename(_fileName)
-        _ydl.download([aUrl])
-
-    return _info, _fileName
+        tuple[Any, str | None]: The song info and the path of the downloaded file, if any.
+    """
+    _extractor = aExtractor or mGetExtractor()
+    # Cache hits don't wait for an executor worker
+    _getCached = getattr(_extractor, 'mGetCached', None)
+    _cached = _getCached(aUrl, aDownload) if _getCached else None
+    if _cached:
+        return _cached
+    return await asyncio.get_running_loop().run_in_executor(mGetExecutor(), _extractor.mExtract, aUrl, aDownload)
@@ -0,0 +1,142 @@
+# Generic imports
+import os
+import shutil
+import subprocess
+
+# Specific imports
+from discord import AudioSource
+from discord.oggparse import OggError, OggStream
+
+# Custom imports
+from entities.utils.files import mGetMusicConfig
+from log.logger import mLogInfo
+
+OPUS_BITRATE = '96k'
+# Discord sends one Opus packet every 20 ms
+OPUS_PACKET_MS = 20
+OPUS_CHECKED_PACKETS = 50
+
+
+def mGetPacketDuration(aPacket: bytes) -> float:
+    """
+    Milliseconds of audio in an Opus packet, from its TOC byte (RFC 6716, section 3.1).
+    """
+    if not aPacket:
+        return 0.0
+    _toc = aPacket[0]
+    _config = _toc >> 3
+    if _config < 12:
+        _frame = (10, 20, 40, 60)[_config % 4]
+    elif _config < 16:
+        _frame = (10, 20)[_config % 2]
+    else:
+        _frame = (2.5, 5, 10, 20)[_config % 4]
+    _code = _toc & 3
+    if _code == 0:
+        _frames = 1
+    elif _code in (1, 2):
+        _frames = 2
+    else:
+        _frames = aPacket[1] & 0x3F if len(aPacket) > 1 else 0
+    return _frame * _frames
+
+
+def mIsOggOpus(aPath: str) -> bool:
+    return os.path.splitext(aPath)[1].lower() in ('.ogg', '.opus')
+
+
+def mIsPassthroughOpus(aPath: str, aPackets: int = OPUS_CHECKED_PACKETS) -> bool:
+    # Whether the first packets of an Ogg Opus file can be sent as they are
+    try:
+        with open(aPath, 'rb') as _file:
+            _packets = OggStream(_file).iter_packets()
+            if not next(_packets, b'').startswith(b'OpusHead'):
+                return False
+            _checked = 0
+            for _packet in _packets:
+                if _packet.startswith(b'OpusTags'):
+                    continue
+                if mGetPacketDuration(_packet) != OPUS_PACKET_MS:
+                    return False
+                _checked += 1
+                if _checked >= aPackets:
+                    break
+            return _checked > 0
+    except (OSError, OggError):
+        return False
+
+
+class OggOpusAudio(AudioSource):
+    """
+    Plays an Ogg Opus file by handing its packets to the voice client as they are, so there's
+    no FFmpeg process and no encoding. The packets must be 20 ms long, see mIsPassthroughOpus.
+    """
+
+    def __init__(self, aPath: str) -> None:
+        self.__file = None
+        self.__file = open(aPath, 'rb')
+        self.__packets = OggStream(self.__file).iter_packets()
+        try:
+            _head = next(self.__packets, b'')
+        except OggError:
+            _head = b''
+        if not _head.startswith(b'OpusHead'):
+            self.cleanup()
+            raise ValueError(f'{aPath} is not an Ogg Opus file')
+
+    def read(self) -> bytes:
+        try:
+            for _packet in self.__packets:
+                if not _packet.startswith(b'OpusTags'):
+                    return _packet
+        except OggError:
+            pass
+        return b''
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self) -> None:
+        if self.__file is not None:
+            self.__file.close()
+
+
+def mEncodeOpus(aSource: str, aDir: str) -> str:
+    """
+    Convert a song to Ogg Opus for OggOpusAudio. Opus audio is copied as it is, and encoded
+    only if it isn't Opus or its packets aren't 20 ms. Blocking.
+
+    Args:
+        aSource (str): The downloaded song.
+        aDir (str): Where to write the converted file.
+
+    Returns:
+        str: The Ogg Opus file.
+    """
+    if mIsOggOpus(aSource) and mIsPassthroughOpus(aSource):
+        return aSource
+    _stem = os.path.splitext(os.path.basename(aSource))[0]
+    _target = os.path.join(aDir, f'{_stem}.ogg')
+    if os.path.abspath(_target) == os.path.abspath(aSource):
+        _target = os.path.join(aDir, f'{_stem}_opus.ogg')
+    _args = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-y', '-i', aSource, '-vn', '-map_metadata', '-1']
+    _copy = subprocess.run(_args + ['-c:a', 'copy', _target], capture_output=True)
+    if _copy.returncode == 0 and mIsPassthroughOpus(_target):
+        return _target
+    _bitrate = str(mGetMusicConfig().get('OPUS_BITRATE', OPUS_BITRATE))
+    _encode = subprocess.run(_args + ['-c:a', 'libopus', '-b:a', _bitrate, '-ar', '48000', '-ac', '2', '-frame_duration', str(OPUS_PACKET_MS),
+                                      '-application', 'audio', _target], capture_output=True)
+    if _encode.returncode != 0:
+        raise RuntimeError(f'FFmpeg could not encode {aSource}: {_encode.stderr.decode(errors="replace").strip()}')
+    mLogInfo(f'Encoded {os.path.basename(aSource)} to Opus')
+    return _target
+
+
+def mGetOpusTransform():
+    # The audio cache transform, None if cached songs stay as downloaded
+    if mGetMusicConfig().get('AUDIO_CACHE_FORMAT', 'opus') != 'opus':
+        return None
+    if shutil.which('ffmpeg') is None:
+        mLogInfo('FFmpeg not found, cached songs are kept as downloaded')
+        return None
+    return mEncodeOpus
@@ -1,11 +1,15 @@
 import jellyfish
 import Levenshtein
+import numpy as np
 import random
 import rapidfuzz
 import re
 import unicodedata
 import uuid
 
+from dataclasses import dataclass
+from rapidfuzz import fuzz, process, utils
+
 # Get a random letter in lowercase
 def mGetRandomLetter() -> str:
     return chr(random.randint(97, 122))
@@ -76,6 +80,48 @@ def mFindMostSimilarPartial(aStr: str, aList: list[str]) -> str:
             _mostSimilar = _str
     return _mostSimilar
 
+@dataclass
+class SimilarMatch:
+    token: str
+    match: str
+    confidence: float
+    ambiguous: bool
+
+# Resolve several strings against a list at once, without assigning the same item twice
+def mResolveMostSimilarBatch(aStrs: list[str], aList: list[str], aMinScore: float = 70, aMinMargin: float = 10) -> list[SimilarMatch]:
+    if not aStrs or not aList:
+        return [SimilarMatch(_str, '', 0.0, True) for _str in aStrs]
+
+    # Score every input against every item in a single pass, with partial_ratio like the single
+    # lookup. WRatio tries several scorers per pair and made a batch slower than separate lookups
+    _strs = [utils.default_process(_str) for _str in aStrs]
+    _items = [utils.default_process(_item) for _item in aList]
+    _scores = process.cdist(_strs, _items, scorer=fuzz.partial_ratio, dtype=np.float32)
+    # Partial matches tie often ('dead' is in several perks), the full ratio breaks the ties
+    _ratios = process.cdist(_strs, _items, scorer=fuzz.ratio, dtype=np.float32)
+    _ranks = _scores * 101 + _ratios
+    # Runner-up score of each input, used to detect inputs that fit several items
+    _ordered = np.sort(_scores, axis=1)
+    _best = _ordered[:, -1]
+    _runnerUp = _ordered[:, -2] if len(aList) > 1 else np.zeros(len(aStrs), dtype=np.float32)
+
+    # Greedily assign the best remaining (input, item) pair until every input has an item
+    _matches: list[SimilarMatch | None] = [None] * len(aStrs)
+    _available = _ranks.copy()
+    for _ in range(min(len(aStrs), len(aList))):
+        _row, _col = np.unravel_index(np.argmax(_available), _available.shape)
+        _score = float(_scores[_row, _col])
+        # Flag weak matches, inputs that lost their best item to another input, and close calls
+        # that aren't exact
+        _isClose = _ratios[_row, _col] < 100 and _best[_row] - _runnerUp[_row] < aMinMargin
+        _ambiguous = bool(_score < aMinScore or _score < _best[_row] or _isClose)
+        _matches[_row] = SimilarMatch(aStrs[_row], aList[_col], _score / 100, _ambiguous)
+        _available[_row, :] = -1
+        _available[:, _col] = -1
+
+    # Inputs left over when there are more inputs than items
+    return [_match or SimilarMatch(aStrs[_index], '', 0.0, True) for _index, _match in enumerate(_matches)]
+
 # Build message to show lists:
 def mBuildEnlistedMessage(aTitle: str, aList: list[str], marker: str = '-', level: int = 0) -> str:
     _msg = f'{aTitle}\n'
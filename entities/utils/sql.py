@@ -2,16 +2,17 @@ import pymysql as sql
 
 from dotenv import load_dotenv
 from os import getenv
-from typing import Any
+from typing import Any, Iterator
 
 from entities.utils.rare import mPrepareString
+from entities.utils.metrics import mTimed
 
 class SQLRetriever:
-    def __init__(self):
+    def __init__(self, aConnection: Any = None):
         # Load environment variables
         load_dotenv()
-        # SQL connection
-        self.conn = sql.connect(
+        # SQL connection, unless an open DB-API connection is given (e.g. an embedded database)
+        self.conn = aConnection or sql.connect(
             host='localhost',
             user='root',
             password=getenv('SQL_PASSWORD'),
@@ -24,24 +25,47 @@ class SQLRetriever:
         self.__cursor.execute(aQuery)
         return self.__cursor.fetchall(), self.__cursor.description
 
+    # Stream the results of a query in chunks, through a server-side cursor on MySQL
+    def mStream(self, aQuery: str, aChunkSize: int = 1000) -> Iterator[list[tuple]]:
+        _cursor = self.conn.cursor(sql.cursors.SSCursor) if isinstance(self.conn, sql.connections.Connection) else self.conn.cursor()
+        try:
+            _cursor.execute(aQuery)
+            while _rows := _cursor.fetchmany(aChunkSize):
+                yield _rows
+        finally:
+            _cursor.close()
+
+    # Run a statement once per row in a single call, so the driver can batch them (pymysql turns
+    # INSERT/REPLACE ... VALUES into multi-row statements). Committing is left to the caller
+    def mExecuteMany(self, aQuery: str, aRows: list[tuple]) -> int:
+        self.__cursor.executemany(aQuery, aRows)
+        return len(aRows)
+
+    # Parameter placeholder of the connection's driver
+    def mGetPlaceholder(self) -> str:
+        return '%s' if isinstance(self.conn, sql.connections.Connection) else '?'
+
     # Generic execution method
     def mExecute(self, aQuery: str) -> None:
         self.__cursor.execute(aQuery)
         self.conn.commit()
 
     # Get all perks
+    @mTimed('sql')
     def mGetAllPerksBasicInfo(self) -> list[dict]:
         _query = f'SELECT p.name, p.main_effect, p.is_exhaustion, u.name AS owner_name FROM perks p JOIN characters u ON p.owner_id = u.id;'
         _results, _ = self.mRetrieve(_query)
         return list({"name": _row[0], "main_effect": _row[1], "exhaustion": bool(_row[2]), "character": _row[3]} for _row in _results)
 
     # Get blacklist
+    @mTimed('sql')
     def mGetBlackList(self, aUserId: str) -> set:
         _query = f'SELECT p.name FROM blacklists b JOIN perks p ON b.perk_name = p.name WHERE b.user_id = {aUserId};'
         _results, _ = self.mRetrieve(_query)
         return set([_row[0] for _row in _results])
 
     # Update blacklist
+    @mTimed('sql')
     def mUpdateBlackList(self, aUserId: str, aBlackList: set) -> None:
         _query = f'DELETE FROM blacklists WHERE user_id = {aUserId};'
         self.mExecute(_query)
@@ -51,6 +75,7 @@ class SQLRetriever:
             self.mExecute(_query)
 
     # Register match result
+    @mTimed('sql')
     def mRegisterMatchResult(self, aParams: dict) -> None:
         # Get parameters
         _userId = aParams['userId']
@@ -70,11 +95,13 @@ class SQLRetriever:
         self.mExecute(_query)
 
     # Add user to database
+    @mTimed('sql')
     def mAddUser(self, aUserId: str, aUserName: str) -> None:
         _query = f'INSERT INTO users (id, name) VALUES ({aUserId}, \'{aUserName}\') ON DUPLICATE KEY UPDATE name = VALUES(name);'
         self.mExecute(_query)
 
     # Get all perks where there was a particular result
+    @mTimed('sql')
     def mGetMatchPerks(self, aResult: str, aUser: int = None):
         # Extract from MySQL
         _query = f"SELECT perk_1_name, perk_2_name, perk_3_name, perk_4_name FROM matches WHERE outcome = {aResult}"
@@ -85,6 +112,7 @@ class SQLRetriever:
         _results, _ = self.mRetrieve(_query)
         return _results
 
+    @mTimed('sql')
     def mGetPerkUsage(self, aOrder: str, aUser: int, aLimit: int) -> tuple:
         # Build SQL query
         _query = "SELECT perk_name, COUNT(*) as usage_count FROM ("
@@ -0,0 +1,164 @@
+# Generic imports
+import itertools
+import json
+import os
+import random
+import threading
+import time
+
+# Specific imports
+from collections import deque
+from contextvars import ContextVar
+
+# Tracing settings
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 1.0))
+TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', 256))
+
+
+class Span:
+    """
+    A timed operation inside a trace. Spans of the same trace share the trace's span list.
+    """
+    __slots__ = ('name', 'traceId', 'spanId', 'parentId', 'start', 'end', 'threadId', 'attrs', 'spans')
+
+    def __init__(self, aName: str, aTraceId: int, aParentId: int | None, aSpans: list, aAttrs: dict) -> None:
+        self.name = aName
+        self.traceId = aTraceId
+        self.spanId = next(_ids)
+        self.parentId = aParentId
+        self.start = time.perf_counter_ns()
+        self.end = None
+        self.threadId = threading.get_ident()
+        self.attrs = aAttrs
+        self.spans = aSpans
+
+    @property
+    def duration(self) -> float:
+        return ((self.end or time.perf_counter_ns()) - self.start) / 1e9
+
+
+class _NotSampled:
+    """
+    Marks a context whose trace was not sampled, so nested spans are skipped cheaply.
+    """
+
+
+_ids = itertools.count(1)
+_notSampled = _NotSampled()
+_currentSpan: ContextVar[Span | _NotSampled | None] = ContextVar('ultrabot_current_span', default=None)
+_traces: deque[list[Span]] = deque(maxlen=TRACE_BUFFER_SIZE)
+
+
+class _SpanContext:
+    __slots__ = ('name', 'attrs', 'root', 'span', 'token')
+
+    def __init__(self, aName: str, aAttrs: dict, aRoot: bool = True) -> None:
+        self.name = aName
+        self.attrs = aAttrs
+        self.root = aRoot
+        self.span = None
+        self.token = None
+
+    def __enter__(self) -> Span | None:
+        _parent = _currentSpan.get()
+        if _parent is _notSampled or (_parent is None and not self.root):
+            return None
+        if _parent is None:
+            # Root span, decide whether the whole trace is kept
+            if TRACE_SAMPLE_RATE < 1 and random.random() >= TRACE_SAMPLE_RATE:
+                self.token = _currentSpan.set(_notSampled)
+                return None
+            self.span = Span(self.name, next(_ids), None, [], self.attrs)
+        else:
+            self.span = Span(self.name, _parent.traceId, _parent.spanId, _parent.spans, self.attrs)
+        self.span.spans.append(self.span)
+        self.token = _currentSpan.set(self.span)
+        return self.span
+
+    def __exit__(self, aExcType, aExc, aTraceback) -> None:
+        if self.token is not None:
+            _currentSpan.reset(self.token)
+        if self.span is None:
+            return
+        self.span.end = time.perf_counter_ns()
+        if aExc is not None:
+            self.span.attrs['error'] = repr(aExc)
+        # Finished root spans store their trace in the ring buffer
+        if self.span.parentId is None:
+            _traces.append(self.span.spans)
+
+
+def mSpan(aName: str, **aAttrs) -> _SpanContext:
+    """
+    Record a span under the current one. Outside of a trace it starts a new trace, which is
+    kept with probability TRACE_SAMPLE_RATE.
+
+    Example:
+        with mSpan('fetch_message', messageId=_lastBuildId):
+            _msg = await aCtx.channel.fetch_message(_lastBuildId)
+    """
+    return _SpanContext(aName, aAttrs)
+
+
+def mChildSpan(aName: str, **aAttrs) -> _SpanContext:
+    """
+    Record a span under the current one, or nothing outside of a trace. For code that also runs
+    outside of commands, like file reads or background downloads, so it doesn't fill the trace
+    buffer with traces of its own.
+    """
+    return _SpanContext(aName, aAttrs, False)
+
+
+def mGetCurrentSpan() -> Span | None:
+    _span = _currentSpan.get()
+    return None if _span is _notSampled else _span
+
+
+def mGetTraces(aName: str = None) -> list[list[Span]]:
+    return [_trace for _trace in list(_traces) if aName is None or _trace[0].name == aName]
+
+
+def mGetSlowestTrace(aName: str = None) -> list[Span] | None:
+    _matching = mGetTraces(aName)
+    if not _matching:
+        return None
+    return max(_matching, key=lambda _trace: _trace[0].duration)
+
+
+def mClearTraces() -> None:
+    _traces.clear()
+
+
+def mToChromeTrace(aTraces: list[list[Span]]) -> dict:
+    """
+    Convert traces to the Chrome trace-event format, viewable in chrome://tracing or Perfetto.
+    Each trace is shown as its own process so traces don't overlap in the viewer.
+
+    Args:
+        aTraces (list[list[Span]]): The traces to convert.
+
+    Returns:
+        dict: The trace-event JSON object.
+    """
+    _events = []
+    for _trace in aTraces:
+        _root = _trace[0]
+        _events.append({"name": "process_name", "ph": "M", "pid": _root.traceId, "args": {"name": f'{_root.name} #{_root.traceId}'}})
+        for _span in _trace:
+            _events.append({
+                "name": _span.name,
+                "cat": _span.attrs.get('layer', 'span'),
+                "ph": "X",
+                "ts": _span.start / 1000,
+                "dur": ((_span.end or _span.start) - _span.start) / 1000,
+                "pid": _root.traceId,
+                "tid": _span.threadId,
+                "args": {_key: str(_value) for _key, _value in _span.attrs.items()}
+            })
+    return {"traceEvents": _events, "displayTimeUnit": "ms"}
+
+
+def mWriteChromeTrace(aPath: str, aTraces: list[list[Span]]) -> str:
+    with open(aPath, 'w') as _file:
+        json.dump(mToChromeTrace(aTraces), _file)
+    return aPath
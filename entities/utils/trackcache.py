@@ -0,0 +1,179 @@
+# Generic imports
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Specific imports
+from urllib.parse import parse_qs, parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Custom imports
+from entities.utils.files import mGetFile, mGetMusicConfig
+from entities.utils.metrics import registry
+from entities.utils.opus import mIsOggOpus, mIsPassthroughOpus
+from log.logger import mLogError, mLogInfo
+
+TRACK_CACHE_TTL = 7 * 24 * 60 * 60
+# Media URLs without an expiry are trusted for this long after they were resolved
+STREAM_URL_TTL = 3 * 60 * 60
+_YOUTUBE_HOSTS = {'youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com'}
+
+
+def mGetTrackKey(aUrl: str) -> str:
+    """
+    The cache key of a URL. YouTube links to the same video share their video id, any other URL
+    is normalized.
+    """
+    _parts = urlsplit(aUrl.strip())
+    _host = _parts.netloc.lower()
+    _id = None
+    if _host == 'youtu.be':
+        _id = _parts.path.strip('/')
+    elif _host in _YOUTUBE_HOSTS:
+        if _parts.path == '/watch':
+            _id = parse_qs(_parts.query).get('v', [None])[0]
+        elif _parts.path.startswith(('/shorts/', '/embed/', '/live/')):
+            _id = _parts.path.split('/')[2]
+    if _id:
+        return f'youtube:{_id}'
+    _query = urlencode(sorted(parse_qsl(_parts.query, keep_blank_values=True)))
+    return urlunsplit((_parts.scheme.lower(), _host, _parts.path, _query, ''))
+
+
+def mGetStreamExpiry(aUrl: str) -> float | None:
+    # YouTube media URLs carry their expiry as a timestamp
+    _expire = parse_qs(urlsplit(aUrl).query).get('expire', [None])[0]
+    return float(_expire) if _expire and _expire.isdigit() else None
+
+
+def mGetDefaultStreamExpiry() -> float:
+    # For media URLs that don't say when they expire
+    return time.time() + STREAM_URL_TTL
+
+
+def mNormalizeInfo(aInfo: dict, aPath: str = None) -> dict:
+    """
+    The fields of an extractor result worth keeping. Formats are reduced to the audio ones.
+    """
+    _formats = [
+        {_field: _format.get(_field) for _field in ('format_id', 'url', 'ext', 'acodec', 'abr', 'asr', 'filesize')}
+        for _format in aInfo.get('formats') or [] if _format.get('url') and _format.get('acodec') != 'none'
+    ]
+    _urls = [_format["url"] for _format in _formats] + ([aInfo["url"]] if aInfo.get('url') else [])
+    _expiries = [_expiry for _expiry in map(mGetStreamExpiry, _urls) if _expiry]
+    return {
+        "id": aInfo.get('id'),
+        "extractor": aInfo.get('extractor_key') or aInfo.get('extractor'),
+        "title": aInfo.get('title', 'Unknown Song'),
+        "duration": aInfo.get('duration', 0),
+        "webpage_url": aInfo.get('webpage_url'),
+        # The selected format, what gets streamed
+        "url": aInfo.get('url'),
+        "formats": _formats,
+        "stream_expires": min(_expiries) if _expiries else (mGetDefaultStreamExpiry() if _urls else None),
+        "path": aPath,
+        # Checked here, off the event loop, so playback doesn't have to read the file
+        "opus_passthrough": bool(aPath) and mIsOggOpus(aPath) and mIsPassthroughOpus(aPath)
+    }
+
+
+class TrackCache:
+    """
+    Normalized extractor results by track key, in an embedded SQLite database so they survive
+    restarts. Entries expire after a fixed time to live and are evicted on lookup and by mPurge.
+    """
+
+    def __init__(self, aPath: str, aTTLSeconds: float = TRACK_CACHE_TTL, aName: str = 'track_cache') -> None:
+        if aPath != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(aPath)), exist_ok=True)
+        self.__ttl = aTTLSeconds
+        self.__name = aName
+        # Looked up from the event loop and written from the music executor
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(aPath, check_same_thread=False, isolation_level=None)
+        self.__conn.execute('PRAGMA journal_mode=WAL;')
+        self.__conn.execute('CREATE TABLE IF NOT EXISTS tracks (key TEXT PRIMARY KEY, info TEXT NOT NULL, expires REAL NOT NULL);')
+        # Metrics
+        self.__hits = 0
+        self.__misses = 0
+        self.__expired = 0
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return self.__conn.execute('SELECT COUNT(*) FROM tracks;').fetchone()[0]
+
+    def mGet(self, aUrl: str) -> dict | None:
+        _key = mGetTrackKey(aUrl)
+        with self.__lock:
+            _row = self.__conn.execute('SELECT info, expires FROM tracks WHERE key = ?;', (_key,)).fetchone()
+            if _row is None:
+                self.__misses += 1
+                return None
+            if _row[1] <= time.time():
+                self.__conn.execute('DELETE FROM tracks WHERE key = ?;', (_key,))
+                self.__expired += 1
+                self.__misses += 1
+                return None
+            self.__hits += 1
+        return json.loads(_row[0])
+
+    def mSet(self, aUrl: str, aInfo: dict) -> None:
+        # Stored under the requested URL and, if it differs, the canonical one of the track
+        _keys = {mGetTrackKey(aUrl)}
+        if aInfo.get('webpage_url'):
+            _keys.add(mGetTrackKey(aInfo["webpage_url"]))
+        _info = json.dumps(aInfo, separators=(',', ':'))
+        _expires = time.time() + self.__ttl
+        with self.__lock:
+            self.__conn.executemany('INSERT OR REPLACE INTO tracks (key, info, expires) VALUES (?, ?, ?);', [(_key, _info, _expires) for _key in _keys])
+
+    def mDelete(self, aUrl: str) -> None:
+        with self.__lock:
+            self.__conn.execute('DELETE FROM tracks WHERE key = ?;', (mGetTrackKey(aUrl),))
+
+    def mPurge(self) -> int:
+        # Drop every expired entry
+        with self.__lock:
+            _removed = self.__conn.execute('DELETE FROM tracks WHERE expires <= ?;', (time.time(),)).rowcount
+            self.__expired += _removed
+        return _removed
+
+    def mClose(self) -> None:
+        with self.__lock:
+            self.__conn.close()
+
+    def mGetStats(self) -> dict:
+        _lookups = self.__hits + self.__misses
+        return {
+            "name": self.__name,
+            "entries": len(self),
+            "hits": self.__hits,
+            "misses": self.__misses,
+            "expired": self.__expired,
+            "hitRate": self.__hits / _lookups if _lookups else 0.0
+        }
+
+
+_trackCache: TrackCache = None
+_trackCacheLock = threading.Lock()
+
+
+def mGetTrackCache() -> TrackCache | None:
+    # Created on first use. None if TRACK_CACHE_PATH is not set or the database can't be opened
+    global _trackCache
+    with _trackCacheLock:
+        if _trackCache is None:
+            _config = mGetMusicConfig()
+            if not _config.get('TRACK_CACHE_PATH'):
+                return None
+            _path = mGetFile(_config["TRACK_CACHE_PATH"])
+            try:
+                _trackCache = TrackCache(_path, float(_config.get('TRACK_CACHE_TTL', TRACK_CACHE_TTL)))
+            except sqlite3.Error as e:
+                mLogError(f'Could not open the track cache at {_path}: {e}')
+                return None
+            _removed = _trackCache.mPurge()
+            mLogInfo(f'Track cache opened at {_path}, {_removed} expired entries removed')
+            registry.mRegisterCollector('track_cache', _trackCache.mGetStats)
+        return _trackCache
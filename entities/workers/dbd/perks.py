@@ -3,8 +3,9 @@ import os
 import random
 
 # Custom imports
-from log.logger import mLogError, mLogInfo
+from log.logger import mLogDebug, mLogError, mLogInfo
 from entities.utils.files import mGetConfigProperty
+from entities.utils.imagepack import ImagePack, PackedImage, mGetPerkPack
 from entities.utils.rare import mSuperCleanString
 
 class PerkTracker:
@@ -33,7 +34,7 @@ class PerkTracker:
 
     def mSetLastBuildId(self, aBuildId: int) -> None:
         self.__lastBuildId = aBuildId
-        mLogInfo(f'Last build id set for user {self.__userId}: {aBuildId}')
+        mLogInfo('Last build id set for user %s: %s', self.__userId, aBuildId)
 
     def mGetLastBuildId(self) -> int:
         return self.__lastBuildId
@@ -42,33 +43,33 @@ class PerkTracker:
         # Check if perk is in tracker
         if aPerkId not in self.__tracker:
             self.__tracker[aPerkId] = 1
-            mLogInfo(f'Perk {aPerkId} added to tracker for user {self.__userId}')
+            mLogDebug('Perk %s added to tracker for user %s', aPerkId, self.__userId, per_second=20)
             return
         # If perk is already at 5, in which case it is removed.
         if self.__tracker[aPerkId] >= self.MAX_PERK_COUNT:
             self.__tracker.pop(aPerkId)
-            mLogInfo(f'Perk {aPerkId} removed from tracker for user {self.__userId}')
+            mLogDebug('Perk %s removed from tracker for user %s', aPerkId, self.__userId, per_second=20)
             return
         # Increment perk count
         self.__tracker[aPerkId] += 1
-        mLogInfo(f'Perk {aPerkId} count updated to {self.__tracker[aPerkId]} for user {self.__userId}')
+        mLogDebug('Perk %s count updated to %s for user %s', aPerkId, self.__tracker[aPerkId], self.__userId, per_second=20)
 
     def mIsRepeated(self, aPerkId: str) -> bool:
         _result = aPerkId in self.__tracker
         if _result:
-            mLogInfo(f'Perk {aPerkId} is repeated for user {self.__userId}')
+            mLogDebug('Perk %s is repeated for user %s', aPerkId, self.__userId, per_second=20)
         return _result
 
     def mUpdateLastRoll(self, aRoll: list) -> None:
         self.__lastRoll = aRoll
-        mLogInfo(f'Last roll updated for user {self.__userId}. Roll: {aRoll}')
+        mLogInfo('Last roll updated for user %s. Roll: %s', self.__userId, aRoll)
 
     def mGetLastRoll(self) -> list:
         return self.__lastRoll
 
     def mSetLastMessage(self, aMessage: str) -> None:
         self.__lastMessage = aMessage
-        mLogInfo(f'Last message id set for user {self.__userId}: {aMessage}')
+        mLogInfo('Last message id set for user %s: %s', self.__userId, aMessage)
 
     def mGetLastMessage(self) -> str:
         return self.__lastMessage
@@ -84,13 +85,13 @@ class PerkTracker:
     def mIsBlacklisted(self, aPerkId: str) -> bool:
         _result = aPerkId in self.__blacklist
         if _result:
-            mLogInfo(f'Perk {aPerkId} is blacklisted for user {self.__userName}')
+            mLogDebug('Perk %s is blacklisted for user %s', aPerkId, self.__userName, per_second=20)
         return _result
 
     def mAddPerkToBlackList(self, aPerkId: str) -> None:
         # Check if perk is already blacklisted
         if self.mIsBlacklisted(aPerkId):
-            mLogError(f'Perk {aPerkId} is already blacklisted for user {self.__userName}')
+            mLogError('Perk %s is already blacklisted for user %s', aPerkId, self.__userName)
             return
         # Add perk to blacklist
         self.__blacklist.add(aPerkId)
@@ -98,11 +99,11 @@ class PerkTracker:
     def mRemovePerkFromBlackList(self, aPerkId: str) -> None:
         # Check if perk is blacklisted
         if not self.mIsBlacklisted(aPerkId):
-            mLogError(f'Perk {aPerkId} is not blacklisted for user {self.__userName}')
+            mLogError('Perk %s is not blacklisted for user %s', aPerkId, self.__userName)
             return
         # Remove perk from blacklist
         self.__blacklist.remove(aPerkId)
-        mLogInfo(f'Perk {aPerkId} removed from blacklist for user {self.__userName}')
+        mLogInfo('Perk %s removed from blacklist for user %s', aPerkId, self.__userName)
 
     def mIsValid(self, aPerkId: str) -> bool:
         return not self.mIsBlacklisted(aPerkId) and not self.mIsRepeated(aPerkId)
@@ -112,7 +113,7 @@ class PerkTracker:
         _perk = random.choice(self.__perks)
         # Get perk name from perk 
         _perkId = _perk.get(self.TITLE)
-        mLogInfo(f'Random perk {_perkId} selected for user {self.__userName}')
+        mLogDebug('Random perk %s selected for user %s', _perkId, self.__userName, per_second=20)
         return _perkId
 
     def mGetRandomValidPerk(self) -> str:
@@ -122,12 +123,12 @@ class PerkTracker:
         # Check if perk is blacklisted
         while not self.mIsValid(_perkId):
             self.mUpdateTracker(_perkId)
-            mLogError(f'Perk {_perkId} is blacklisted or repeated for user {self.__userId}. Getting another perk')
+            mLogDebug('Perk %s is blacklisted or repeated for user %s. Getting another perk', _perkId, self.__userId, per_second=20)
             _perkId = self.mGetRandomPerkId()
 
         # Get all the information of the perk
         self.mUpdateTracker(_perkId)
-        mLogInfo(f'Valid perk {_perkId} selected for user {self.__userId}')
+        mLogDebug('Valid perk %s selected for user %s', _perkId, self.__userId)
         return _perkId
 
     def mGetRoll(self) -> list:
@@ -141,9 +142,20 @@ class PerkTracker:
         return _roll
 
     @staticmethod
-    def mGetImage(aPerkId: str) -> str:
+    def mGetImage(aPerkId: str) -> str | PackedImage:
+        return PerkTracker.mGetImageFrom(aPerkId, mGetPerkPack())
+
+    @staticmethod
+    def mGetImageFrom(aPerkId: str, aPack: ImagePack | None) -> str | PackedImage:
         # Get clean perk name
         _perkName = mSuperCleanString(aPerkId)
+        # Serve the image straight from the pack when there is one
+        _pack = aPack
+        if _pack is not None:
+            _image = _pack.mOpen(f'{_perkName}.png')
+            if _image is not None:
+                mLogDebug('Image for perk %s retrieved from pack', aPerkId, per_second=20)
+                return _image
         # Get image path
         _imgDir = mGetConfigProperty('PERKS_IMG_DIR')
         if not _imgDir:
@@ -153,9 +165,11 @@ class PerkTracker:
         if not os.path.exists(_imgPath):
             _err_msg = f'Image {_imgPath} not found'
             mLogError(_err_msg)
+            if _pack is not None and 'notfound.png' in _pack:
+                return _pack.mOpen('notfound.png')
             return os.path.join(_imgDir, f'notfound.png')
         # Get image path
-        mLogInfo(f'Image path for perk {aPerkId} retrieved: {_imgPath}')
+        mLogDebug('Image path for perk %s retrieved: %s', aPerkId, _imgPath)
         return _imgPath
 
     def mGetDescription(self, aPerkId: str) -> str:
@@ -163,22 +177,32 @@ class PerkTracker:
         for _perk in self.__perks:
             if _perk.get(self.TITLE) == aPerkId:
                 _description = _perk.get(self.DESCRIPTION)
-                mLogInfo(f'Description for perk {aPerkId} retrieved.')
+                mLogInfo('Description for perk %s retrieved.', aPerkId)
                 return _description
-        mLogInfo(f'Description for perk {aPerkId} not found.')
+        mLogInfo('Description for perk %s not found.', aPerkId)
 
-    def mGetImages(self, aPerkIds: list[str]) -> list[str]:
+    def mGetImages(self, aPerkIds: list[str]) -> list[str | PackedImage]:
         # Set images list
         _images = []
+        # Look the pack up once for every image
+        _pack = mGetPerkPack()
         # Try to get images
         try:
             for _perkId in aPerkIds:
-                _images.append(self.mGetImage(_perkId))
+                _images.append(self.mGetImageFrom(_perkId, _pack))
             return _images
         except ValueError as e:
             mLogError(f'Error during image retrieval: {e}')
+            self.mCloseImages(_images)
             return []
 
+    @staticmethod
+    def mCloseImages(aImages: list[str | PackedImage]) -> None:
+        # Packed images hold a view of the pack until they're closed
+        for _image in aImages:
+            if isinstance(_image, PackedImage):
+                _image.close()
+
     def mGetWhitelistedPerkNames(self) -> list[str]:
         _perks = [_perk[self.TITLE] for _perk in self.__perks if not self.mIsBlacklisted(_perk['name'])]
         return _perks
@@ -189,4 +213,4 @@ class PerkTracker:
 
     def mSetLastRoll(self, aRoll: list) -> None:
         self.__lastRoll = aRoll
-        mLogInfo(f'Last roll set for user {self.__userId}. Roll: {aRoll}')
\ No newline at end of file
+        mLogInfo('Last roll set for user %s. Roll: %s', self.__userId, aRoll)
\ No newline at end of file
@@ -1,4 +1,5 @@
 # Generic imports
+import io
 import os
 
 # Specific imports
@@ -6,7 +7,7 @@ from discord import File, Interaction
 from datetime import datetime, timedelta
 
 # Custom imports
-from log.logger import mLogInfo
+from log.logger import mLogDebug, mLogInfo
 from entities.utils.datahandler import DBDDataHandler
 from entities.utils.files import mGetAssetsDir, mGetConfigProperty
 from entities.utils.images import mCreateCollage, mSaveImage
@@ -30,7 +31,7 @@ class DbdWorker:
         self.__sql.mAddUser(self.__userId, self.__userName)
         # Get blacklist from config
         self.__perks = self.mGetAllPerks()
-        mLogInfo(f"Perks: {self.__perks}")
+        mLogDebug('Perks: %s', self.__perks)
         self.__tracker = PerkTracker(self.__userId, self.__userName, self.__perks)
         self.mLoadUserBlackListFromDB()
         # Load data handler
@@ -95,7 +96,10 @@ class DbdWorker:
         # Get title
         _title = f'Build for user {_username}'
         # Create and save collage
-        _collage = mCreateCollage(_images, 800, 160, aTitle=_title)
+        try:
+            _collage = mCreateCollage(_images, 800, 160, aTitle=_title)
+        finally:
+            self.__tracker.mCloseImages(_images)
         _collagePath = os.path.join(self.__dbdGenImagesDir, f'{_username}_randombuild.png')
         _imagePath = mSaveImage(_collage, _collagePath)
         return File(_imagePath)
@@ -155,7 +159,10 @@ class DbdWorker:
         _username = aCtx.user.name
         _images = self.__tracker.mGetImages(_lastRoll)
         _title = f'Build for user {_username}'
-        _collage = mCreateCollage(_images, 800, 160, aTitle=_title)
+        try:
+            _collage = mCreateCollage(_images, 800, 160, aTitle=_title)
+        finally:
+            self.__tracker.mCloseImages(_images)
 
         # Save collage
         _collagePath = os.path.join(self.__dbdGenImagesDir, f'randombuild.png')
@@ -189,7 +196,11 @@ class DbdWorker:
     def mGetPerkImage(self, aPerkId: str) -> File:
         # Get image path
         _imagePath = self.__tracker.mGetImage(aPerkId)
-        return File(_imagePath)
+        if isinstance(_imagePath, str):
+            return File(_imagePath)
+        # discord.File doesn't close file objects it didn't open, so copy the packed image
+        with _imagePath:
+            return File(io.BytesIO(_imagePath.read()), filename=_imagePath.name)
 
     def mGetPerkFromBuild(self, aPerkIndex: int) -> str:
         _lastRoll = self.__tracker.mGetLastRoll()
@@ -218,7 +229,7 @@ class DbdWorker:
     def mGetUsageGraph(self, aOrder: str = 'most', aUser: int = None, aLimit: int = 10) -> File:
         # Get SQL results
         _results, _columns = self.__sql.mGetPerkUsage(aOrder, aUser, aLimit)
-        mLogInfo(f"Results: {_results}")
+        mLogDebug('Results: %s', _results)
         # Get path of image
         _date = datetime.now().strftime('%Y-%m-%d')
         _userStr = str(aUser) if aUser else "all"
@@ -1,14 +1,30 @@
 # General imports
+import asyncio
+import os
 import random
 
 # Specific imports
-from discord import Color, Embed, Guild, Interaction, VoiceChannel
-from typing import Optional
+from collections import deque
+from enum import Enum
+from discord import AudioSource, Color, Embed, FFmpegPCMAudio, Guild, Interaction, VoiceChannel, VoiceClient
+from typing import Callable, Optional
 
 
 # Custom imports
-from entities.utils.musicutils import mGetSource
-from log.logger import mLogInfo, mLogError
+from entities.utils.audiocache import AudioCache
+from entities.utils.files import mGetMusicConfig
+from entities.utils.musicutils import PLAYBACK_MODE, PREFETCH_COUNT, mGetExecutor, mGetFFmpegOptions, mGetSource, mGetStreamUrl, mIsStreamValid
+from entities.utils.opus import OggOpusAudio, mIsOggOpus, mIsPassthroughOpus
+from entities.utils.trackcache import mGetDefaultStreamExpiry, mGetStreamExpiry, mGetTrackKey
+from log.logger import mLogDebug, mLogInfo, mLogError
+
+# Seconds a player stays connected without music
+IDLE_TIMEOUT = 300
+
+class PlayStatus(Enum):
+    STARTED = 'started'  # Playing right away
+    QUEUED = 'queued'    # Waiting behind other songs
+    FAILED = 'failed'    # Could not be resolved and was skipped
 
 class Song:
     def __init__(self, aUrl: str) -> None:
@@ -17,9 +33,10 @@ class Song:
         self.__title: str = None
         self.__duration: int = None
         self.__output = None
-        # Song queue
-        self.__next: Song = None
-        self.__previous: Song = None
+        self.__passthrough: bool = False
+        self.__stream: str = None
+        self.__streamExpires: float = None
+        self.__task: asyncio.Task = None
 
     @property
     def title(self) -> str:
@@ -36,18 +53,27 @@ class Song:
     @property
     def output(self) -> str:
         return self.__output
-    
+
     @property
-    def next(self) -> Optional['Song']:
-        return self.__next
-    
+    def passthrough(self) -> bool:
+        # Whether output is Ogg Opus with 20 ms packets, which is played without FFmpeg
+        return self.__passthrough
+
     @property
-    def previous(self) -> Optional['Song']:
-        return self.__previous
+    def stream(self) -> str:
+        return self.__stream
+
+    @property
+    def key(self) -> str:
+        return mGetTrackKey(self.__url)
     
-    def mGetOutput(self) -> str:
+    def mGetOutput(self, aNext: Optional['Song'] = None, aPrevious: Optional['Song'] = None) -> Embed:
         """Create an embed with the song information
 
+        Args:
+            aNext (Song, optional): The song queued after this one.
+            aPrevious (Song, optional): The song played before this one.
+
         Returns:
             Embed: The embed with the song information
         """
@@ -56,86 +82,230 @@ class Song:
             _embed.add_field(name='Duration:', value=self.duration)
         if self.url:
             _embed.add_field(name='URL:', value=self.url)
-        if self.next:
-            _embed.add_field(name='Up next:', value=self.next.title)
-        if self.previous:
-            _embed.add_field(name='Previously:', value=self.previous.title)
+        if aNext:
+            _embed.add_field(name='Up next:', value=aNext.title)
+        if aPrevious:
+            _embed.add_field(name='Previously:', value=aPrevious.title)
         return _embed
 
-    def mGetSource(self) -> None:
+    @property
+    def resolved(self) -> bool:
+        return self.__output is not None or self.__stream is not None
+
+    @property
+    def failed(self) -> bool:
+        # The last attempt to resolve it raised
+        return self.__task is not None and self.__task.done() and not self.__task.cancelled() and self.__task.exception() is not None
+
+    def mPrefetch(self, aExtractor=None, aDownload: bool = True) -> asyncio.Task:
+        # Start resolving in the background, once, and again when the result went stale
+        if self.__task is not None and self.__task.done() and not self.__task.cancelled() and not self.__task.exception() and self.mIsStale():
+            self.__task = None
+        if self.__task is None:
+            self.__task = asyncio.ensure_future(self.mResolve(aExtractor, aDownload))
+        return self.__task
+
+    async def mResolve(self, aExtractor=None, aDownload: bool = True) -> None:
         # Get info sources
-        _info, _path = mGetSource(self.url)
-        _formats: list[dict] = _info.get('formats', [{}])
-        _source = _formats[0].get('url', None)
+        _info, _path = await mGetSource(self.url, aExtractor, aDownload)
         # Set song data
         self.__title = _info.get('title', 'Unknown Song')
         self.__duration = _info.get('duration', 0)
-        self.__output = _path
-        
+        await self.mSetOutput(_info, _path)
+        self.__stream = mGetStreamUrl(_info)
+        self.__streamExpires = _info.get('stream_expires') or ((mGetStreamExpiry(self.__stream) or mGetDefaultStreamExpiry()) if self.__stream else None)
+
+    async def mDownload(self, aExtractor=None) -> None:
+        # Download a streamed song, so it plays from disk next time
+        _info, _path = await mGetSource(self.url, aExtractor, True)
+        if _path:
+            await self.mSetOutput(_info, _path)
+
+    async def mSetOutput(self, aInfo: dict, aPath: str | None) -> None:
+        # Cached songs come with the passthrough check, other Ogg files are checked in the executor
+        _passthrough = aInfo.get('opus_passthrough')
+        if _passthrough is None and aPath and mIsOggOpus(aPath):
+            _passthrough = await asyncio.get_running_loop().run_in_executor(mGetExecutor(), mIsPassthroughOpus, aPath)
+        self.__passthrough = bool(_passthrough) and aPath is not None
+        self.__output = aPath
+
+    def mIsStale(self) -> bool:
+        # A looping song is played again long after it was resolved. Its file may have been
+        # evicted from the audio cache and its media URL may have expired
+        if self.__output is not None:
+            return not os.path.isfile(self.__output)
+        return self.__stream is not None and not mIsStreamValid({"stream_expires": self.__streamExpires, "duration": self.__duration})
+
+    async def mGetSource(self, aExtractor=None, aDownload: bool = True) -> None:
+        # Waits for a prefetch already running, and tries again if one failed
+        if self.__task is not None and self.__task.done() and (self.__task.cancelled() or self.__task.exception()):
+            self.__task = None
+        await asyncio.shield(self.mPrefetch(aExtractor, aDownload))
 
 
 class Playlist:
+    """
+    The current song and a deque of the upcoming ones. Queueing, playing next, advancing and
+    the length are O(1), so long playlists stay cheap. Positions count the upcoming songs from 0.
+    """
     def __init__(self) -> None:
         self.__current: Song = None
+        self.__previous: Song = None
+        self.__upcoming: deque[Song] = deque()
         self.__loop: bool = False
-        self.__shuffle: bool = False
 
     def __len__(self) -> int:
-        _count = 0
-        _current = self.__current
-        while _current:
-            _count += 1
-            _current = _current.next
-        return _count
+        return len(self.__upcoming) + (1 if self.__current else 0)
 
     def __iter__(self):
-        _current = self.__current
-        while _current:
-            yield _current
-            _current = _current.next
+        if self.__current:
+            yield self.__current
+        yield from self.__upcoming
+
+    def __getitem__(self, aPosition: int) -> Song:
+        return self.__upcoming[aPosition]
+
+    @property
+    def current(self) -> Optional[Song]:
+        return self.__current
+
+    @property
+    def previous(self) -> Optional[Song]:
+        return self.__previous
+
+    @property
+    def next(self) -> Optional[Song]:
+        return self.__upcoming[0] if self.__upcoming else None
+
+    @property
+    def loop(self) -> bool:
+        return self.__loop
+
+    def mSetLoop(self, aLoop: bool) -> None:
+        # Finished songs go back to the end of the queue
+        self.__loop = aLoop
 
     def mQueueSong(self, aSong: Song) -> None:
         # Set song to current if no song is playing
         if not self.__current:
             self.__current = aSong
             return
-        # Add song to the end of the playlist
-        _current = self.__current
-        while _current.next:
-            _current = _current.next
-        _current.next = aSong
-        aSong.previous = _current
+        self.__upcoming.append(aSong)
+
+    def mQueueSongs(self, aSongs: list[Song]) -> None:
+        _songs = iter(aSongs)
+        if not self.__current:
+            self.__current = next(_songs, None)
+        self.__upcoming.extend(_songs)
 
     def mForceNext(self, aSong: Song) -> None:
         # Set song to current if no song is playing
         if not self.__current:
             self.__current = aSong
             return
-        # If no next song, add this song to the front
-        aSong.previous = self.__current
-        if not self.__current.next:
-            self.__current.next = aSong
-            return
-        aSong.next = self.__current.next
+        self.__upcoming.appendleft(aSong)
+
+    def mNext(self) -> Optional[Song]:
+        """
+        Move on to the next song, requeueing the current one if looping.
+
+        Returns:
+            Song: The new current song, or None if the playlist ended.
+        """
+        if self.__current:
+            self.__previous = self.__current
+            if self.__loop:
+                self.__upcoming.append(self.__current)
+        self.__current = self.__upcoming.popleft() if self.__upcoming else None
+        return self.__current
+
+    def mRemove(self, aPosition: int) -> Song:
+        # Raises IndexError for a position outside the queue
+        _song = self.__upcoming[aPosition]
+        del self.__upcoming[aPosition]
+        return _song
+
+    def mMove(self, aFrom: int, aTo: int) -> Song:
+        _song = self.mRemove(aFrom)
+        _to = min(max(aTo, 0), len(self.__upcoming))
+        self.__upcoming.insert(_to, _song)
+        return _song
+
+    def mShuffle(self, aRandom: random.Random = None) -> None:
+        # Shuffle the upcoming songs as a list, deque indexing isn't O(1) in the middle
+        _songs = list(self.__upcoming)
+        (aRandom or random).shuffle(_songs)
+        self.__upcoming = deque(_songs)
 
     def mEmpty(self) -> None:
         self.__current = None
+        self.__previous = None
+        self.__upcoming.clear()
 
 
 class Player:
-    def __init__(self) -> None:
-        self.__playlists: dict[int, Playlist] = {}
+    """
+    Plays one guild's playlist through a single voice connection, which is kept across songs and
+    moved between channels instead of reconnecting. Playback advances from the voice client's
+    after callback, and the player disconnects after IDLE_TIMEOUT seconds without music.
+    """
+    def __init__(self, aGuildId: int, aLoop: asyncio.AbstractEventLoop = None, aIdleTimeout: float = None, aOnDisconnect: Callable[['Player'], None] = None,
+                 aExtractor=None, aPrefetch: int = None, aStream: bool = None, aAudioCache: AudioCache = None) -> None:
+        self.__guildId: int = aGuildId
+        self.__playlist: Playlist = Playlist()
+        self.__voiceClient: VoiceClient = None
+        self.__loop = aLoop or asyncio.get_running_loop()
+        self.__idleTimeout: float = aIdleTimeout if aIdleTimeout is not None else float(mGetMusicConfig().get('IDLE_TIMEOUT', IDLE_TIMEOUT))
+        self.__idleHandle: asyncio.TimerHandle = None
+        self.__onDisconnect = aOnDisconnect
+        self.__extractor = aExtractor
+        self.__prefetch: int = aPrefetch if aPrefetch is not None else int(mGetMusicConfig().get('PREFETCH_COUNT', PREFETCH_COUNT))
+        # Stream songs into FFmpeg instead of downloading them first
+        self.__stream: bool = aStream if aStream is not None else mGetMusicConfig().get('PLAYBACK_MODE', PLAYBACK_MODE) == 'stream'
+        # Queued songs are pinned in the audio cache, and streamed ones downloaded into it
+        self.__audioCache = aAudioCache
+        self.__cacheOnPlay: bool = bool(mGetMusicConfig().get('AUDIO_CACHE_ON_PLAY', True))
+        # Set while stopping on purpose, so the after callback doesn't advance the playlist
+        self.__stopping: bool = False
+        self.__starting: bool = False
+        self.__connects: int = 0
+        self.__disconnects: int = 0
 
-    async def mRegisterVC(self, aVoiceChannel: VoiceChannel) -> None:
-        self.__voiceChannel = aVoiceChannel
-        self.__voiceClient = await self.__voiceChannel.connect()
+    @property
+    def guildId(self) -> int:
+        return self.__guildId
+
+    @property
+    def playlist(self) -> Playlist:
+        return self.__playlist
 
-    def mGetPlaylist(self, aGuild: Guild) -> Playlist:
-        if not self.__playlists.get(aGuild.id):
-            self.__playlists[aGuild.id] = Playlist()
-        return self.__playlists[aGuild.id]
+    @property
+    def voiceClient(self) -> Optional[VoiceClient]:
+        return self.__voiceClient
+
+    @property
+    def connects(self) -> int:
+        return self.__connects
 
-    async def mCanPlay(self, aCtx: Interaction) -> bool:
+    def mIsConnected(self) -> bool:
+        return self.__voiceClient is not None and self.__voiceClient.is_connected()
+
+    def mIsPlaying(self) -> bool:
+        return self.mIsConnected() and (self.__voiceClient.is_playing() or self.__voiceClient.is_paused())
+
+    async def mRegisterVC(self, aVoiceChannel: VoiceChannel) -> VoiceClient:
+        # Reuse the connection, moving it if the user is somewhere else
+        if self.mIsConnected():
+            if self.__voiceClient.channel.id != aVoiceChannel.id:
+                await self.__voiceClient.move_to(aVoiceChannel)
+            return self.__voiceClient
+        self.__voiceClient = await aVoiceChannel.connect()
+        self.__connects += 1
+        mLogInfo(f'Connected to voice channel {aVoiceChannel.id} in guild {self.__guildId}')
+        return self.__voiceClient
+
+    @staticmethod
+    async def mCanPlay(aCtx: Interaction) -> bool:
         # Check if author is in a voice channel
         if not aCtx.user.voice:
             await aCtx.response.send_message('You need to be in a voice channel to play music.', ephemeral=True)
@@ -146,24 +316,198 @@ class Player:
             return False
         return True
 
-    async def mPlay(self, aCtx: Interaction, aSong: Song, aForceNext: bool = False) -> None:
-        # Register voice client
+    async def mPlay(self, aCtx: Interaction, aSong: Song, aForceNext: bool = False) -> PlayStatus:
+        """
+        Queue a song and start playing if nothing is.
+
+        Returns:
+            PlayStatus: Whether the song started, was queued or could not be played.
+        """
         if not aCtx.user.voice:
             mLogInfo(f'User {aCtx.user.name} is not in a voice channel.')
-            return
+            return PlayStatus.FAILED
+        # Don't let the idle timer disconnect while the song resolves
+        self.mCancelIdle()
         await self.mRegisterVC(aCtx.user.voice.channel)
-        # Queue song
-        _playlist = self.mGetPlaylist()
         if aForceNext:
-            _playlist.mForceNext(aSong)
+            self.__playlist.mForceNext(aSong)
         else:
-            _playlist.mQueueSong(aSong)
-        await self.__voiceClient.play(aSong.output)
-
-    def mAfterPlay(self, aCtx: Interaction):
-        self.__playlist.__current = self.__playlist.__current.next
-        if self.__playlist.__current:
-            next_song = self.__playlist.__current
-            self.mPlay(aCtx, next_song)
+            self.__playlist.mQueueSong(aSong)
+        if self.__audioCache is not None:
+            self.__audioCache.mPin(aSong.key)
+        if self.mIsPlaying() or self.__starting:
+            self.mPrefetch()
+            return PlayStatus.QUEUED
+        await self.mPlayCurrent()
+        # mPlayCurrent skips songs that can't be resolved
+        if aSong.failed:
+            return PlayStatus.FAILED
+        return PlayStatus.STARTED if self.__playlist.current is aSong else PlayStatus.QUEUED
+
+    def mGetAudioSource(self, aSong: Song) -> AudioSource:
+        # Cached Opus with 20 ms packets is sent as it is, without FFmpeg or encoding
+        if aSong.output and aSong.passthrough:
+            try:
+                return OggOpusAudio(aSong.output)
+            except (OSError, ValueError) as e:
+                mLogError(f'Could not pass {aSong.output} through: {e}')
+        # A downloaded file if there is one, the media URL otherwise
+        _source = aSong.output or aSong.stream
+        return FFmpegPCMAudio(_source, **mGetFFmpegOptions(_source))
+
+    async def mPlayCurrent(self) -> None:
+        # Only one song is resolved at a time, a second /play just queues
+        if self.__starting:
+            return
+        self.__starting = True
+        _disconnects = self.__disconnects
+        try:
+            # Skip songs that can't be resolved, at most once around a looping playlist
+            _song = self.__playlist.current
+            _attempts = len(self.__playlist)
+            while _song and _attempts:
+                try:
+                    await _song.mGetSource(self.__extractor, not self.__stream)
+                    break
+                except Exception as e:
+                    mLogError(f'Could not get {_song.url}: {e}')
+                    _song = self.mAdvance()
+                    _attempts -= 1
+            # Stopped while resolving, the playlist is gone
+            if self.__disconnects != _disconnects:
+                return
+            if not _song or not _attempts or not self.mIsConnected():
+                self.mScheduleIdle()
+                return
+            self.mCancelIdle()
+            self.__voiceClient.play(self.mGetAudioSource(_song), after=self.mAfterPlay)
+            mLogInfo(f'Playing {_song.title} in guild {self.__guildId}')
+            if self.__audioCache is not None and self.__cacheOnPlay and not _song.output:
+                self.mCacheSong(_song)
+            self.mPrefetch()
+        finally:
+            self.__starting = False
+
+    def mPrefetch(self) -> None:
+        """
+        Resolve the next songs in the background while the current one plays, so the next one
+        starts right away. Failures are left for mPlayCurrent to report and skip.
+        """
+        for _position in range(min(self.__prefetch, len(self.__playlist) - 1)):
+            _task = self.__playlist[_position].mPrefetch(self.__extractor, not self.__stream)
+            _task.add_done_callback(self.mOnBackgroundDone)
+
+    def mCacheSong(self, aSong: Song) -> None:
+        # Download a streamed song in the background, so replays come from disk
+        _task = asyncio.ensure_future(aSong.mDownload(self.__extractor))
+        _task.add_done_callback(self.mOnBackgroundDone)
+
+    def mOnBackgroundDone(self, aTask: asyncio.Task) -> None:
+        # Retrieve the exception so it isn't logged as never retrieved
+        if not aTask.cancelled() and aTask.exception():
+            mLogDebug(f'Background download failed in guild {self.__guildId}: {aTask.exception()}')
+
+    def mUnpin(self, aSong: Song) -> None:
+        if self.__audioCache is not None:
+            self.__audioCache.mUnpin(aSong.key)
+
+    def mAdvance(self) -> Optional[Song]:
+        # A finished song leaves the playlist unless it's looping
+        _finished = self.__playlist.current
+        _next = self.__playlist.mNext()
+        if _finished and not self.__playlist.loop:
+            self.mUnpin(_finished)
+        return _next
+
+    def mRemove(self, aPosition: int) -> Song:
+        _song = self.__playlist.mRemove(aPosition)
+        self.mUnpin(_song)
+        return _song
+
+    def mAfterPlay(self, aError: Exception = None) -> None:
+        # Runs in the voice thread, the playlist is only touched from the event loop
+        if aError:
+            mLogError(f'Playback error in guild {self.__guildId}: {aError}')
+        if self.__stopping or self.__loop.is_closed():
+            return
+        asyncio.run_coroutine_threadsafe(self.mPlayNext(), self.__loop)
+
+    async def mPlayNext(self) -> None:
+        if self.mAdvance():
+            await self.mPlayCurrent()
         else:
-            mLogInfo('Playlist is empty.')
\ No newline at end of file
+            mLogInfo('Playlist is empty.')
+            self.mScheduleIdle()
+
+    def mSkip(self) -> bool:
+        # Stopping fires the after callback, which plays the next song
+        if not self.mIsPlaying():
+            return False
+        self.__voiceClient.stop()
+        return True
+
+    def mScheduleIdle(self) -> None:
+        self.mCancelIdle()
+        self.__idleHandle = self.__loop.call_later(self.__idleTimeout, self.mOnIdle)
+
+    def mCancelIdle(self) -> None:
+        if self.__idleHandle:
+            self.__idleHandle.cancel()
+            self.__idleHandle = None
+
+    def mOnIdle(self) -> None:
+        self.__idleHandle = None
+        # mPlayCurrent schedules it again if the song can't be played
+        if not self.mIsPlaying() and not self.__starting:
+            mLogInfo(f'Disconnecting idle player in guild {self.__guildId}')
+            self.__loop.create_task(self.mDisconnect())
+
+    async def mDisconnect(self) -> None:
+        self.mCancelIdle()
+        self.__disconnects += 1
+        for _song in self.__playlist:
+            self.mUnpin(_song)
+        self.__playlist.mEmpty()
+        if self.__voiceClient:
+            self.__stopping = True
+            try:
+                self.__voiceClient.stop()
+                await self.__voiceClient.disconnect()
+            finally:
+                self.__stopping = False
+                self.__voiceClient = None
+        if self.__onDisconnect:
+            self.__onDisconnect(self)
+
+
+class PlayerRegistry:
+    """
+    One Player per guild, created on first use and dropped when it disconnects.
+    """
+    def __init__(self, aIdleTimeout: float = None, aExtractor=None, aAudioCache: AudioCache = None) -> None:
+        self.__players: dict[int, Player] = {}
+        self.__idleTimeout = aIdleTimeout
+        self.__extractor = aExtractor
+        self.__audioCache = aAudioCache
+
+    def __len__(self) -> int:
+        return len(self.__players)
+
+    def mGetPlayer(self, aGuild: Guild) -> Player:
+        _player = self.__players.get(aGuild.id)
+        if _player is None:
+            _player = Player(aGuild.id, aIdleTimeout=self.__idleTimeout, aOnDisconnect=self.mRemove, aExtractor=self.__extractor,
+                             aAudioCache=self.__audioCache)
+            self.__players[aGuild.id] = _player
+        return _player
+
+    def mFindPlayer(self, aGuild: Guild) -> Optional[Player]:
+        return self.__players.get(aGuild.id)
+
+    def mRemove(self, aPlayer: Player) -> None:
+        if self.__players.get(aPlayer.guildId) is aPlayer:
+            del self.__players[aPlayer.guildId]
+
+    async def mDisconnectAll(self) -> None:
+        for _player in list(self.__players.values()):
+            await _player.mDisconnect()
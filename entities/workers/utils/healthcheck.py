@@ -1,20 +1,35 @@
 # General imports
-from datetime import datetime, timedelta
-import time
-import threading
+import asyncio
+import heapq
+import itertools
+import random
 
 # Specific imports
 from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from datetime import datetime, timedelta
 from enum import Enum
-from threading import Thread
+from typing import Callable
 
 # Custom imports
-from entities.utils.files import  mParseJsonFile, mGetFile, mCleanupDbdGenImgsDir, mWriteJsonFile
+from entities.utils.artifacts import mCleanupArtifacts
+from entities.utils.export import mCleanupUserExports, mExportMatches
+from entities.utils.files import  mParseJsonFile, mGetFile, stateWriter
 from log.logger import mLogInfo, mLogError
 
+# Threads shared by the blocking health tasks
+HC_MAX_WORKERS = 2
+# Most missed runs executed back to back with the 'all' catch-up policy
+MAX_CATCH_UP_RUNS = 10
+
 class TaskNames(Enum):
     CLEANUP_DBD_GENERATED_IMAGES = 'cleanup_dbd_generated_imgs'
+    EXPORT_MATCHES = 'export_matches'
+
+class CatchUp(Enum):
+    SKIP = 'skip'   # Drop missed runs and wait for the next slot
+    ONCE = 'once'   # Run once for all the missed runs
+    ALL = 'all'     # Run every missed run, up to MAX_CATCH_UP_RUNS
 
 @dataclass
 class TaskInfo:
@@ -22,52 +37,96 @@ class TaskInfo:
     interval: timedelta
     last_run: datetime
     next_run: datetime
+    enabled: bool = True
+    jitter: float = 0.0
+    timeout: float | None = None
+    catch_up: CatchUp = CatchUp.ONCE
+    pending: int = 0
 
 
 def mRunTask(task: TaskInfo) -> None:
     match task.name:
         case TaskNames.CLEANUP_DBD_GENERATED_IMAGES.value:
             mLogInfo(f'Running task {task.name}')
-            mCleanupDbdGenImgsDir(aExcludeFiles=['.gitignore'])
+            mCleanupArtifacts()
+            mCleanupUserExports()
+            mLogInfo(f'Task {task.name} finished')
+        case TaskNames.EXPORT_MATCHES.value:
+            mLogInfo(f'Running task {task.name}')
+            mExportMatches()
             mLogInfo(f'Task {task.name} finished')
         case _:
             mLogError(f'Task {task.name} not found')
 
 
 class HealthWorker:
+    """
+    Runs the tasks in config/hctasks.json on the running event loop. Deadlines are kept in a heap
+    and the scheduler sleeps until the earliest one; the blocking task bodies run on a bounded
+    thread pool.
+
+    Task settings:
+        enabled (bool): Whether the task is scheduled. Defaults to true.
+        interval (int | float): Minutes between runs.
+        last_run (str): Last start time, updated after each run.
+        jitter (float, optional): Up to this many seconds are added to each deadline.
+        timeout (float, optional): Seconds after which a run is reported as timed out.
+        catch_up (str, optional): What to do with runs missed while the bot was down: 'skip', 'once' or 'all'.
+    """
 
     # Set paths
     __invervalsPath = 'config/hctasks.json'
     __intervalsFile = mGetFile(__invervalsPath)
 
-    def __init__(self):
-        # Set stop event
-        self.__stopEvent = threading.Event()
+    def __init__(self, aTasksFile: str = None, aRunTask: Callable[[TaskInfo], None] = mRunTask):
+        self.__tasksFile = aTasksFile or self.__intervalsFile
+        self.__runTask = aRunTask
         # Get intervals dictionary
-        self.__intervals: dict[str, dict] = mParseJsonFile(self.__intervalsFile)
+        self.__intervals: dict[str, dict] = mParseJsonFile(self.__tasksFile)
         self.__tasks: list[TaskInfo] = self.mLoadTasks()
-        # Get last run of each task every checkInterval
-        self.__checkInterval = 1 # Every minute
-        self.__daemon: Thread | None = None
+        # Scheduler state, created on start
+        self.__heap: list[tuple[float, int, TaskInfo]] = []
+        self.__order = itertools.count()
+        self.__running: dict[str, asyncio.Task] = {}
+        self.__wakeUp: asyncio.Event | None = None
+        self.__executor: ThreadPoolExecutor | None = None
+        self.__daemon: asyncio.Task | None = None
 
     def mGetTasknameSet(self) -> set:
         return set(self.__intervals.keys())
 
+    def mGetTasks(self) -> list[TaskInfo]:
+        return list(self.__tasks)
+
+    @staticmethod
+    def mToInterval(aInterval: timedelta | int | float) -> timedelta:
+        # Intervals are given in minutes
+        if isinstance(aInterval, timedelta):
+            return aInterval
+        return timedelta(minutes=aInterval)
+
     @staticmethod
-    def mCalculateNextRun(aLastRun: datetime, aInterval: timedelta | int) -> datetime:
-        # Convert interval to timedelta if int
-        if isinstance(aInterval, int):
-            aInterval = timedelta(minutes=aInterval)
-        # If next run is in the past, set next run to now + interval
-        if aLastRun + aInterval < datetime.now():
-            _nextRun = datetime.now() + aInterval
-            return _nextRun
-        return aLastRun + aInterval
+    def mCalculateNextRun(aLastRun: datetime, aInterval: timedelta, aCatchUp: CatchUp = CatchUp.ONCE, aNow: datetime = None) -> tuple[datetime, int]:
+        """
+        Get the next run of a task and how many runs are owed because they were missed.
+        """
+        _now = aNow or datetime.now()
+        _nextRun = aLastRun + aInterval
+        if _nextRun > _now:
+            return _nextRun, 0
+        _missed = int((_now - aLastRun) / aInterval)
+        match aCatchUp:
+            case CatchUp.SKIP:
+                return aLastRun + aInterval * (_missed + 1), 0
+            case CatchUp.ALL:
+                return _now, min(_missed, MAX_CATCH_UP_RUNS)
+            case _:
+                return _now, 1
 
     @staticmethod
     def mDateTimeToStr(aDateTime: datetime) -> str:
         return aDateTime.strftime('%Y-%m-%d %H:%M:%S')
-    
+
     @staticmethod
     def mStrToDateTime(aStr: str) -> datetime:
         return datetime.strptime(aStr, '%Y-%m-%d %H:%M:%S')
@@ -75,59 +134,105 @@ class HealthWorker:
     def mLoadTasks(self) -> list[TaskInfo]:
         _tasks = []
         for _taskName, _taskInfo in self.__intervals.items():
-            # Convert last run to datetime and string
-            _lastRun = _taskInfo.get('last_run', datetime.now())
-            _lastRunStr = _lastRun if isinstance(_lastRun, str) else self.mDateTimeToStr(_lastRun)
-            _lastRunDt = self.mStrToDateTime(_lastRunStr)
-            # Update last run if different
-            if _lastRunStr != _taskInfo.get('last_run'):
-                _taskInfo['last_run'] = _lastRunStr
+            # Skip disabled tasks
+            if not _taskInfo.get('enabled', True):
+                mLogInfo(f'Task {_taskName} is disabled')
+                continue
+            # Convert last run to datetime
+            _lastRun = _taskInfo.get('last_run')
+            _lastRunDt = self.mStrToDateTime(_lastRun) if _lastRun else datetime.now()
             # Calculate next run
-            _interval = _taskInfo.get('interval', timedelta(minutes=60))
-            _nextRun = self.mCalculateNextRun(_lastRunDt, _interval)
-            _task = TaskInfo(_taskName, _interval, _lastRunDt, _nextRun)
+            _interval = self.mToInterval(_taskInfo.get('interval', 60))
+            _catchUp = CatchUp(_taskInfo.get('catch_up', CatchUp.ONCE.value))
+            _nextRun, _pending = self.mCalculateNextRun(_lastRunDt, _interval, _catchUp)
+            _task = TaskInfo(_taskName, _interval, _lastRunDt, _nextRun, True, float(_taskInfo.get('jitter', 0)), _taskInfo.get('timeout'), _catchUp, _pending)
             _tasks.append(_task)
-        # Rewrite to json file
-        mWriteJsonFile(self.__intervalsFile, self.__intervals)
         return _tasks
 
     def mUpdateTaskRuntime(self, aTask: TaskInfo) -> TaskInfo:
         # Update internally
         aTask.last_run = datetime.now()
-        aTask.next_run = aTask.last_run + timedelta(minutes=aTask.interval)
-        # Update in file
+        # Update in file, close runs are saved together
         _taskInfo = self.__intervals.get(aTask.name)
         _taskInfo['last_run'] = self.mDateTimeToStr(aTask.last_run)
-        mWriteJsonFile(self.__intervalsFile, self.__intervals)
+        stateWriter.mWrite(self.__tasksFile, self.__intervals)
         return aTask
 
-    def mRun(self) -> None:
-        while not self.__stopEvent.is_set():
-            _now = datetime.now()
-            mLogInfo(f'Checking if any task needs to be run.')
-            _runningTasks = list()
-            for _task in self.__tasks:
-                if _now >= _task.next_run:
-                    mLogInfo(f'Task {_task.name} needs to be run.')
-                    _thread = threading.Thread(target=mRunTask, args=(_task,))
-                    _runningTasks.append(_thread)
-                    _thread.start()
-                    self.mUpdateTaskRuntime(_task)
-            for _thread in _runningTasks:
-                _thread.join()
-                mLogInfo(f'Task {_thread.name} runtime updated.')
-            mLogInfo(f'All tasks checked. Sleeping for {self.__checkInterval} minutes.')
-            time.sleep(self.__checkInterval * 60)
-
-    def start(self):
-        mLogInfo('Starting healthcheck worker')
-        self.__daemon = threading.Thread(target=self.mRun)
-        self.__daemon.start()
-        self.__daemon.daemon = True
+    def mSchedule(self, aTask: TaskInfo, aRunAt: datetime) -> None:
+        aTask.next_run = aRunAt
+        _delay = max(0.0, (aRunAt - datetime.now()).total_seconds()) + random.uniform(0, aTask.jitter)
+        heapq.heappush(self.__heap, (asyncio.get_running_loop().time() + _delay, next(self.__order), aTask))
+        self.__wakeUp.set()
 
-    def stop(self):
+    def mStart(self) -> None:
+        """
+        Start the scheduler on the running event loop.
+        """
+        mLogInfo('Starting healthcheck worker')
+        self.__wakeUp = asyncio.Event()
+        self.__executor = ThreadPoolExecutor(max_workers=HC_MAX_WORKERS, thread_name_prefix='healthcheck')
+        for _task in self.__tasks:
+            self.mSchedule(_task, _task.next_run)
+        self.__daemon = asyncio.create_task(self.mRun(), name='healthcheck')
+
+    async def mRun(self) -> None:
+        _loop = asyncio.get_running_loop()
+        while True:
+            # Sleep until the earliest deadline or until a task is scheduled
+            self.__wakeUp.clear()
+            if not self.__heap:
+                await self.__wakeUp.wait()
+                continue
+            _delay = self.__heap[0][0] - _loop.time()
+            if _delay > 0:
+                try:
+                    await asyncio.wait_for(self.__wakeUp.wait(), _delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, _task = heapq.heappop(self.__heap)
+            self.mDispatch(_task)
+
+    def mDispatch(self, aTask: TaskInfo) -> None:
+        _running = self.__running.get(aTask.name)
+        if _running and not _running.done():
+            mLogError(f'Task {aTask.name} is still running, skipping this run')
+        else:
+            self.__running[aTask.name] = asyncio.create_task(self.mExecute(aTask), name=f'healthcheck-{aTask.name}')
+        self.mSchedule(aTask, datetime.now() + aTask.interval)
+
+    async def mExecute(self, aTask: TaskInfo) -> None:
+        _loop = asyncio.get_running_loop()
+        # Owed catch-up runs are executed back to back
+        while True:
+            aTask.pending = max(0, aTask.pending - 1)
+            self.mUpdateTaskRuntime(aTask)
+            mLogInfo(f'Task {aTask.name} needs to be run.')
+            _future = _loop.run_in_executor(self.__executor, self.__runTask, aTask)
+            try:
+                await asyncio.wait_for(asyncio.shield(_future), aTask.timeout)
+            except asyncio.TimeoutError:
+                # The thread can't be interrupted, so later runs of the task are skipped until it returns
+                mLogError(f'Task {aTask.name} timed out after {aTask.timeout} seconds')
+                await asyncio.gather(_future, return_exceptions=True)
+                return
+            except Exception as e:
+                mLogError(f'Task {aTask.name} failed: {e}')
+            if not aTask.pending:
+                return
+
+    async def mStop(self) -> None:
+        # Called when the bot closes, does nothing if the worker isn't running
+        if self.__daemon is None:
+            return
         mLogInfo('Stopping healthcheck worker')
-        self.__stopEvent.set()
-        self.__daemon.join(timeout=300)
-        if self.__daemon.is_alive():
-            mLogError('Healthcheck worker could not be stopped gracefully')
\ No newline at end of file
+        self.__daemon.cancel()
+        for _task in self.__running.values():
+            _task.cancel()
+        await asyncio.gather(self.__daemon, *self.__running.values(), return_exceptions=True)
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+        self.__daemon = None
+        self.__executor = None
+        self.__running.clear()
+        self.__heap.clear()
+        stateWriter.mFlush(self.__tasksFile)
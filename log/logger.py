@@ -1,6 +1,20 @@
 # Generic imports
+import atexit
 import logging
+import os
+import queue
 import sys
+import time
+
+# Specific imports
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Logging settings
+LOG_DIR = os.path.dirname(os.path.realpath(__file__))
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+LOG_BUFFER_SIZE = 64 * 1024
+LOG_FLUSH_INTERVAL = 1.0
 
 # Configure the logger
 _logger = logging.getLogger("UltraBot")
@@ -12,20 +26,120 @@ _handlers = {}
 # Create formatters
 formatter = logging.Formatter('[%(asctime)s] [%(levelname)s] %(filename)s @ %(funcName)s:%(lineno)d | %(message)s')
 
+
+class BufferedRotatingFileHandler(RotatingFileHandler):
+    """
+    Rotating file handler that writes through a large buffer and only flushes it every
+    LOG_FLUSH_INTERVAL seconds or when an error is logged, instead of after every record.
+    The listener also flushes it once the queue has been idle for an interval, so the end of
+    a burst isn't left in the buffer. The file size is tracked in memory so records are
+    formatted once and never trigger a seek.
+    """
+
+    def __init__(self, aFilename: str, aMaxBytes: int = LOG_MAX_BYTES, aBackupCount: int = LOG_BACKUP_COUNT,
+                 aBufferSize: int = LOG_BUFFER_SIZE, aFlushInterval: float = LOG_FLUSH_INTERVAL) -> None:
+        self.__bufferSize = aBufferSize
+        self.__flushInterval = aFlushInterval
+        self.__lastFlush = time.monotonic()
+        self.__pending = False
+        self.__size = 0
+        super().__init__(aFilename, maxBytes=aMaxBytes, backupCount=aBackupCount, encoding='utf-8')
+
+    def _open(self):
+        _stream = open(self.baseFilename, self.mode, buffering=self.__bufferSize, encoding=self.encoding, errors=self.errors)
+        self.__size = _stream.tell()
+        return _stream
+
+    @property
+    def flushInterval(self) -> float:
+        return self.__flushInterval
+
+    @property
+    def pending(self) -> bool:
+        # Records written since the last flush
+        return self.__pending
+
+    def flush(self) -> None:
+        super().flush()
+        self.__pending = False
+        self.__lastFlush = time.monotonic()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            _msg = self.format(record) + self.terminator
+            if self.stream is None:
+                self.stream = self._open()
+            # Rotate before the file goes over its size limit
+            if self.maxBytes > 0 and self.__size + len(_msg) >= self.maxBytes:
+                self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+            self.stream.write(_msg)
+            self.__size += len(_msg)
+            self.__pending = True
+            # Flush errors right away, everything else once per interval
+            if record.levelno >= logging.ERROR or time.monotonic() - self.__lastFlush >= self.__flushInterval:
+                self.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+
+class _LogQueueHandler(QueueHandler):
+    """
+    Queue handler that hands records to the listener thread untouched, other than merging
+    their arguments so later changes to them are not reflected in the log.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+class _LogQueueListener(QueueListener):
+    """
+    Queue listener that flushes the buffered handlers once the queue has been idle for their
+    flush interval, so records are written at most one interval after they were logged.
+    """
+
+    def dequeue(self, block: bool) -> logging.LogRecord:
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        _pending = [_handler for _handler in self.handlers if getattr(_handler, 'pending', False)]
+        if _pending:
+            try:
+                return self.queue.get(timeout=min(_handler.flushInterval for _handler in _pending))
+            except queue.Empty:
+                for _handler in _pending:
+                    _handler.flush()
+        return self.queue.get(block)
+
+
+# Every logger writes to the queue, and the listener thread writes to the files
+_queue = queue.SimpleQueue()
+_queueHandler = _LogQueueHandler(_queue)
+_listener = _LogQueueListener(_queue, respect_handler_level=True)
+_listenerRunning = False
+
 # Create a handler for the logger
 def mCreateHandler(log_file: str = None, log_level: int = logging.INFO):
     """
     Create a handler for the logger. Doesn't add it to the logger.
-    
+
     Args:
         log_file (str, optional): The file to log to. Defaults to None.
         log_level (int, optional): The level to log at. Defaults to logging.INFO.
 
     Returns:
-        _type_: _description_
+        logging.Handler: A buffered rotating file handler, or a stdout handler if no file is given.
     """
     if log_file:
-        handler = logging.FileHandler(log_file, encoding='utf-8', mode='w')
+        handler = BufferedRotatingFileHandler(log_file)
     else:
         handler = logging.StreamHandler(sys.stdout)
     handler.setLevel(log_level)
@@ -33,39 +147,170 @@ def mCreateHandler(log_file: str = None, log_level: int = logging.INFO):
     return handler
 
 # Configure specific loggers
-def mSetHandlerToLogger(name: str, log_file: str, log_level: int) -> None:
+def mSetHandlerToLogger(name: str, log_file: str, log_level: int, source: str = None) -> None:
     """
-    Configure a handler for a specific logger.
+    Configure a handler for a specific logger. The handler runs on the listener thread.
 
     Args:
         name (str): The name of the logger.
         log_file (str): The file to log to.
         log_level (int): The level of the logger.
+        source (str, optional): Only write records coming from this logger. Defaults to None.
     """
     # Create the handler
     _handler = mCreateHandler(log_file, log_level)
-    # Configure the logger
-    _handler.setLevel(log_level)
-    _handler.setFormatter(formatter)
-    # Add the handler to the logger
+    if source:
+        _handler.addFilter(logging.Filter(source))
+    # Add the handler to the listener, replacing the previous one with the same name
+    _previous = _handlers.get(name)
     _handlers[name] = _handler
-    _logger.addHandler(_handler)
+    _listener.handlers = tuple(_handlers.values())
+    if _previous:
+        _previous.close()
+
+def mAttachLogger(name: str, log_level: int = logging.INFO) -> None:
+    """
+    Send the records of another logger (e.g. discord.py's) through the logging queue.
+
+    Args:
+        name (str): The name of the logger.
+        log_level (int, optional): The level of the logger. Defaults to logging.INFO.
+    """
+    _other = logging.getLogger(name)
+    _other.setLevel(log_level)
+    if _queueHandler not in _other.handlers:
+        _other.addHandler(_queueHandler)
+
+def mConfigureLogging(log_dir: str = LOG_DIR) -> None:
+    """
+    Create the bot's log files in the given directory and start the listener thread.
+
+    Args:
+        log_dir (str, optional): The directory to write the logs to. Defaults to this module's directory.
+    """
+    mSetHandlerToLogger('info', os.path.join(log_dir, 'info.log'), logging.INFO, source='UltraBot')
+    mSetHandlerToLogger('error', os.path.join(log_dir, 'error.log'), logging.ERROR, source='UltraBot')
+    mSetHandlerToLogger('trace', os.path.join(log_dir, 'trace.log'), logging.DEBUG)
+    mSetHandlerToLogger('discord', os.path.join(log_dir, 'discord.log'), logging.DEBUG, source='discord')
+    mStartListener()
+
+def mStartListener() -> None:
+    global _listenerRunning
+    if _queueHandler not in _logger.handlers:
+        _logger.addHandler(_queueHandler)
+    if not _listenerRunning:
+        _listener.start()
+        _listenerRunning = True
+
+def mStopListener() -> None:
+    """
+    Stop the listener thread after it writes every queued record, then flush the files.
+    """
+    global _listenerRunning
+    if _listenerRunning:
+        _listener.stop()
+        _listenerRunning = False
+    for _handler in _handlers.values():
+        _handler.close()
 
 # Initialize hadlers
-mSetHandlerToLogger('info', 'log/info.log', logging.INFO)
-mSetHandlerToLogger('error', 'log/error.log', logging.ERROR)
-mSetHandlerToLogger('trace', 'log/trace.log', logging.DEBUG)
-mSetHandlerToLogger('discord', 'log/discord.log', logging.DEBUG)
+mConfigureLogging()
+atexit.register(mStopListener)
+
+# Per-module loggers, call site sampling state and modules switched to full verbosity
+_moduleLoggers: dict[str, logging.Logger] = {}
+_siteCounters: dict[tuple, int] = {}
+_siteBuckets: dict[tuple, list] = {}
+_siteSuppressed: dict[tuple, int] = {}
+_debugModules: set[str] = set()
+
+def _mGetModuleLogger(aModule: str) -> logging.Logger:
+    _moduleLogger = _moduleLoggers.get(aModule)
+    if _moduleLogger is None:
+        _moduleLogger = _logger.getChild(aModule)
+        _moduleLoggers[aModule] = _moduleLogger
+    return _moduleLogger
+
+def _mIsDebugModule(aModule: str) -> bool:
+    return any(aModule == _name or aModule.startswith(f'{_name}.') for _name in _debugModules)
+
+def _mShouldSample(aSite: tuple, aSample: float | None, aPerSecond: float | None) -> bool:
+    # Keep one out of every 1 / sample records of the call site
+    if aSample is not None:
+        _count = _siteCounters.get(aSite, 0)
+        _siteCounters[aSite] = _count + 1
+        if _count % max(1, round(1 / aSample)) != 0:
+            return False
+    # Token bucket holding up to one second worth of records of the call site
+    if aPerSecond is not None:
+        _now = time.monotonic()
+        _bucket = _siteBuckets.setdefault(aSite, [aPerSecond, _now])
+        _bucket[0] = min(aPerSecond, _bucket[0] + (_now - _bucket[1]) * aPerSecond)
+        _bucket[1] = _now
+        if _bucket[0] < 1:
+            return False
+        _bucket[0] -= 1
+    return True
+
+def _mLog(aLevel: int, aMessage, aArgs: tuple, aSample: float | None, aPerSecond: float | None) -> None:
+    # Frame of the code that called mLogInfo, mLogDebug or mLogError
+    _frame = sys._getframe(2)
+    _module = _frame.f_globals.get('__name__', 'unknown')
+    _moduleLogger = _mGetModuleLogger(_module)
+    # Check the level before doing anything else, so filtered records cost no formatting
+    if not _moduleLogger.isEnabledFor(aLevel):
+        return
+    # Modules at full verbosity log every sample, but rate limits still hold so a flood of
+    # debug records can't swamp the listener
+    if aSample is not None and _mIsDebugModule(_module):
+        aSample = None
+    if aSample is not None or aPerSecond is not None:
+        _site = (_frame.f_code.co_filename, _frame.f_lineno)
+        if not _mShouldSample(_site, aSample, aPerSecond):
+            _siteSuppressed[_site] = _siteSuppressed.get(_site, 0) + 1
+            return
+        _suppressed = _siteSuppressed.pop(_site, 0)
+        if _suppressed and aPerSecond is not None:
+            aMessage = f'{aMessage} [{_suppressed} similar records suppressed]'
+    _moduleLogger.log(aLevel, aMessage, *aArgs, stacklevel=3)
+
+def mSetModuleDebug(name: str, enabled: bool = True) -> None:
+    """
+    Switch a module (and its submodules) to full verbosity at runtime: debug records are
+    logged and call site sampling is ignored. Rate limits still apply.
+
+    Args:
+        name (str): The module name, e.g. 'entities.workers.dbd.perks' or 'entities.workers'.
+        enabled (bool, optional): Whether to enable or disable full verbosity. Defaults to True.
+    """
+    _moduleLogger = _mGetModuleLogger(name)
+    if enabled:
+        _debugModules.add(name)
+        _moduleLogger.setLevel(logging.DEBUG)
+    else:
+        _debugModules.discard(name)
+        _moduleLogger.setLevel(logging.NOTSET)
+
+def mGetDebugModules() -> list[str]:
+    return sorted(_debugModules)
 
 # Public access methods
-def mLogInfo(message):
-    _logger.info(message, stacklevel=2)
+def mLogInfo(message, *args, sample: float = None, per_second: float = None):
+    """
+    Log an info record. Arguments are only merged into the message if the record is logged.
+
+    Args:
+        message: The message, optionally with %-style placeholders for args.
+        sample (float, optional): Only log this fraction of the records of the call site.
+        per_second (float, optional): Only log up to this many records per second from the call site.
+    """
+    _mLog(logging.INFO, message, args, sample, per_second)
 
-def mLogDebug(message):
-    _logger.debug(message, stacklevel=2)
+def mLogDebug(message, *args, sample: float = None, per_second: float = None):
+    _mLog(logging.DEBUG, message, args, sample, per_second)
 
-def mLogError(message):
-    _logger.error(message, stacklevel=2)
+def mLogError(message, *args, sample: float = None, per_second: float = None):
+    _mLog(logging.ERROR, message, args, sample, per_second)
 
 def mGetHandler(name):
     return _handlers.get(name)
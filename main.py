@@ -1,13 +1,13 @@
 # Specific imports
 from dotenv import load_dotenv
-from os import getenv, path, mkdir
+from os import getenv
 from threading import Thread
 
 # Custom imports
 from entities.bot import mRun
-from entities.workers.utils.healthcheck import HealthWorker
-from entities.utils.files import mDownloadFromGDrive, mExtractZip, mGetFile, mGetDBDConfig
-from log.logger import mLogInfo
+from entities.utils.metrics import mStartMetricsServer
+from entities.utils.assets import mSyncPerkAssets
+from log.logger import mLogInfo, mLogError
 
 class Runner:
     """
@@ -25,22 +25,18 @@ class Runner:
         This method runs the bot.
         """
 
-        # Download additional assets
-        # DBD Perk Images
-        _perkImgUrl = mGetDBDConfig().get('PERKS_IMG_URL')
-        _perkDir = mGetFile('assets/dbd/imgs/perks')
-        _perkZipName = path.join(_perkDir, 'perkimgs.zip')
-        if not path.exists(_perkDir):
-            mLogInfo(f'Creating directory for perk images: {_perkDir}')
-            mkdir(_perkDir)
-            mDownloadFromGDrive(_perkImgUrl, _perkZipName)
-            mExtractZip(_perkZipName, _perkDir, aRemoveWhenDone=True)
-            mLogInfo('Perk images downloaded and extracted')
-
-        # Run healthcheck worker
-        _hcWorker = HealthWorker()
-        _hcThread = Thread(target=_hcWorker.mRun, daemon=True)
-        _hcThread.start()
+        # Sync perk images in the background, missing images show as notfound.png meanwhile
+        _assetThread = Thread(target=mSyncPerkAssets, name='asset-sync', daemon=True)
+        _assetThread.start()
+
+        # Health tasks are scheduled on the bot's event loop once it starts, see entities/bot.py
+
+        # Serve metrics locally
+        try:
+            _metricsServer = mStartMetricsServer()
+            mLogInfo(f'Serving metrics on port {_metricsServer.server_address[1]}')
+        except OSError as e:
+            mLogError(f'Could not start metrics server: {e}')
 
         # Run the bot
         try:
@@ -0,0 +1,47 @@
+import os
+import tempfile
+import time
+import unittest
+
+from entities.utils.artifacts import ArtifactStore
+
+
+class TestArtifactStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def mMakeFile(self, aName: str, aSize: int, aAgeMinutes: float = 0) -> str:
+        _path = os.path.join(self.tmpDir.name, aName)
+        with open(_path, 'wb') as _file:
+            _file.write(b'x' * aSize)
+        _mtime = time.time() - aAgeMinutes * 60
+        os.utime(_path, (_mtime, _mtime))
+        return _path
+
+    def test_reconcile_indexes_existing_files(self):
+        self.mMakeFile('.gitignore', 5)
+        self.mMakeFile('b.png', 10, aAgeMinutes=5)
+        self.mMakeFile('a.png', 10, aAgeMinutes=1)
+        _store = ArtifactStore(self.tmpDir.name, 3, 1000)
+        self.assertEqual(_store.mGetStats()['files'], 2)
+        self.assertEqual(_store.mCleanup(), 1)
+        self.assertEqual(sorted(os.listdir(self.tmpDir.name)), ['.gitignore', 'a.png'])
+
+    def test_quota_evicts_oldest_on_register(self):
+        _store = ArtifactStore(self.tmpDir.name, 60, 25)
+        for _index in range(4):
+            _store.mRegister(self.mMakeFile(f'collage_{_index}.png', 10))
+        self.assertEqual(sorted(os.listdir(self.tmpDir.name)), ['collage_2.png', 'collage_3.png'])
+        _stats = _store.mGetStats()
+        self.assertEqual((_stats['bytes'], _stats['overQuota']), (20, 2))
+
+    def test_cleanup_skips_untracked_files_until_reconcile(self):
+        _store = ArtifactStore(self.tmpDir.name, 3, 1000)
+        _path = self.mMakeFile('old.png', 10, aAgeMinutes=10)
+        self.assertEqual(_store.mCleanup(), 0)
+        self.assertTrue(os.path.exists(_path))
+        self.assertEqual(_store.mCleanup(aNow=time.time() + 3600), 1)
+        self.assertFalse(os.path.exists(_path))
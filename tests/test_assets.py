@@ -0,0 +1,108 @@
+import functools
+import json
+import os
+import tempfile
+import threading
+import unittest
+import zipfile
+
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from entities.utils.assets import AssetSource, HttpSource, LocalSource, MANIFEST_NAME, mBuildManifest, mSyncAssets
+
+
+class _CountingSource(LocalSource):
+    def __init__(self, *args) -> None:
+        super().__init__(*args)
+        self.archiveFetches = 0
+
+    def mGetArchive(self, aTmpDir: str) -> str:
+        self.archiveFetches += 1
+        return super().mGetArchive(aTmpDir)
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class TestAssetSync(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.sourceDir = os.path.join(self.tmpDir.name, 'source')
+        self.targetDir = os.path.join(self.tmpDir.name, 'perks')
+        os.makedirs(self.sourceDir)
+        self.zipPath = os.path.join(self.sourceDir, 'perks.zip')
+        self.manifestPath = os.path.join(self.sourceDir, 'manifest.json')
+        self.mMakeSource({'bond.png': b'bond' * 100, 'adrenaline.png': b'adrenaline' * 50, 'sub/kindred.png': b'kindred'})
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def mMakeSource(self, aFiles: dict[str, bytes]) -> None:
+        _filesDir = os.path.join(self.tmpDir.name, 'files')
+        with zipfile.ZipFile(self.zipPath, 'w') as _zip:
+            for _name, _data in aFiles.items():
+                _zip.writestr(_name, _data)
+                os.makedirs(os.path.dirname(os.path.join(_filesDir, _name)), exist_ok=True)
+                with open(os.path.join(_filesDir, _name), 'wb') as _file:
+                    _file.write(_data)
+        with open(self.manifestPath, 'w') as _file:
+            json.dump(mBuildManifest(_filesDir), _file)
+
+    def test_sync_fetches_only_changed_files(self):
+        _source = _CountingSource(self.zipPath, self.manifestPath)
+        self.assertEqual(mSyncAssets(self.targetDir, _source)['fetched'], 3)
+        # Nothing changed, so the archive is not fetched again
+        _stats = mSyncAssets(self.targetDir, _source)
+        self.assertEqual((_stats['verified'], _stats['fetched'], _source.archiveFetches), (3, 0, 1))
+        # A corrupted file is the only one fetched
+        with open(os.path.join(self.targetDir, 'bond.png'), 'wb') as _file:
+            _file.write(b'x' * 400)
+        _stats = mSyncAssets(self.targetDir, _source)
+        self.assertEqual((_stats['verified'], _stats['fetched']), (2, 1))
+        with open(os.path.join(self.targetDir, 'bond.png'), 'rb') as _file:
+            self.assertEqual(_file.read(), b'bond' * 100)
+
+    def test_sync_without_source_manifest_uses_last_sync(self):
+        _source = _CountingSource(self.zipPath)
+        mSyncAssets(self.targetDir, _source)
+        self.assertTrue(os.path.exists(os.path.join(self.targetDir, MANIFEST_NAME)))
+        os.remove(os.path.join(self.targetDir, 'sub', 'kindred.png'))
+        self.assertEqual(mSyncAssets(self.targetDir, _source)['fetched'], 1)
+        self.assertEqual(_source.archiveFetches, 2)
+
+    def test_unsafe_members_are_skipped_and_extra_files_pruned(self):
+        with zipfile.ZipFile(self.zipPath, 'a') as _zip:
+            _zip.writestr('../escape.png', b'nope')
+        os.makedirs(self.targetDir)
+        with open(os.path.join(self.targetDir, 'old.png'), 'wb') as _file:
+            _file.write(b'old')
+        _stats = mSyncAssets(self.targetDir, LocalSource(self.zipPath, self.manifestPath), aPrune=True)
+        self.assertEqual(_stats['pruned'], 1)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpDir.name, 'escape.png')))
+        self.assertEqual(sorted(os.listdir(self.targetDir)), [MANIFEST_NAME, 'adrenaline.png', 'bond.png', 'sub'])
+
+    def test_http_source(self):
+        _handler = functools.partial(_QuietHandler, directory=self.sourceDir)
+        _server = ThreadingHTTPServer(('127.0.0.1', 0), _handler)
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+        try:
+            _url = f'http://127.0.0.1:{_server.server_address[1]}'
+            _source = HttpSource(f'{_url}/perks.zip', f'{_url}/manifest.json')
+            self.assertEqual(mSyncAssets(self.targetDir, _source)['fetched'], 3)
+            # Without a manifest from the server nothing is downloaded when one is required
+            with self.assertRaises(ValueError):
+                mSyncAssets(os.path.join(self.tmpDir.name, 'unverified'), HttpSource(f'{_url}/perks.zip'), aRequireManifest=True)
+            self.assertFalse(os.path.exists(os.path.join(self.tmpDir.name, 'unverified', 'bond.png')))
+        finally:
+            _server.shutdown()
+            _server.server_close()
+
+
+class TestAssetSource(unittest.TestCase):
+    def test_sources_must_provide_an_archive(self):
+        class _NoArchive(AssetSource):
+            pass
+        with self.assertRaises(TypeError):
+            _NoArchive()
@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+
+from entities.utils.audiocache import AudioCache, mGetFileStem
+from entities.utils.musicutils import CachedExtractor, LocalExtractor
+from entities.utils.trackcache import TrackCache
+
+
+def mDownloader(aSize: int, aName: str = 'song.webm'):
+    def _mDownload(aDir: str) -> str:
+        _path = os.path.join(aDir, aName)
+        with open(_path, 'wb') as _file:
+            _file.write(bytes(aSize))
+        return _path
+    return _mDownload
+
+
+class DownloadingExtractor:
+    def __init__(self) -> None:
+        self.downloads = 0
+
+    def mExtract(self, aUrl: str, aDownload: bool = True, aDir: str = None):
+        _info = {"id": 'abc', "title": 'Song', "duration": 100, "url": 'https://media.example/abc'}
+        if not aDownload:
+            return _info, None
+        self.downloads += 1
+        return _info, mDownloader(100, 'abc.webm')(aDir)
+
+
+class TestAudioCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.dir = self.tmpDir.name
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def test_lru_eviction_skips_pinned(self):
+        _cache = AudioCache(self.dir, aMaxBytes=250)
+        _cache.mPin('youtube:a')
+        for _key in ('youtube:a', 'youtube:b'):
+            _cache.mFill(_key, mDownloader(100))
+        self.assertIsNotNone(_cache.mGetPath('youtube:b'))
+        _path = _cache.mFill('youtube:c', mDownloader(100))
+        self.assertEqual(os.path.basename(_path), 'youtube_c.webm')
+        # a is pinned, so b goes even though it was used after a
+        self.assertIsNone(_cache.mGetPath('youtube:b'))
+        self.assertEqual((_cache.bytes, len(_cache)), (200, 2))
+        _cache.mUnpin('youtube:a')
+        _cache.mFill('youtube:d', mDownloader(100))
+        self.assertIsNone(_cache.mGetPath('youtube:a'))
+        self.assertEqual(sorted(os.listdir(self.dir)), ['.incoming', 'youtube_c.webm', 'youtube_d.webm'])
+
+    def test_failed_downloads_leave_nothing_and_files_survive_restarts(self):
+        _cache = AudioCache(self.dir, aMaxBytes=1000)
+        _cache.mFill('https://example.com/a', mDownloader(100))
+
+        def _mFail(aDir: str) -> str:
+            mDownloader(50)(aDir)
+            raise ConnectionError('Lost connection')
+        with self.assertRaises(ConnectionError):
+            _cache.mFill('https://example.com/b', _mFail)
+        self.assertEqual(os.listdir(os.path.join(self.dir, '.incoming')), [])
+        _cache = AudioCache(self.dir, aMaxBytes=1000)
+        self.assertEqual((len(_cache), _cache.bytes), (1, 100))
+        self.assertTrue(_cache.mGetPath('https://example.com/a').endswith(mGetFileStem('https://example.com/a') + '.webm'))
+        # Not enough free disk space
+        _full = AudioCache(self.dir, aMaxBytes=1000, aMinFreeBytes=2 ** 62)
+        self.assertIsNone(_full.mFill('https://example.com/c', mDownloader(100)))
+        self.assertEqual(_full.mGetStats()["rejected"], 1)
+
+    def test_local_files_are_copied(self):
+        _song = os.path.join(self.dir, 'mine.webm')
+        mDownloader(100, 'mine.webm')(self.dir)
+        _cached = CachedExtractor(LocalExtractor(), TrackCache(':memory:'), AudioCache(os.path.join(self.dir, 'cache'), aMaxBytes=1000))
+        _, _path = _cached.mExtract(_song, True)
+        self.assertNotEqual(_path, _song)
+        self.assertEqual((os.path.getsize(_path), os.path.getsize(_song)), (100, 100))
+
+    def test_replays_come_from_disk(self):
+        _extractor = DownloadingExtractor()
+        _cached = CachedExtractor(_extractor, TrackCache(':memory:'), AudioCache(self.dir, aMaxBytes=1000))
+        _, _path = _cached.mExtract('https://youtu.be/abc', True)
+        self.assertEqual(_path, os.path.join(os.path.realpath(self.dir), 'youtube_abc.webm'))
+        # Streaming a cached song plays the file, a lost metadata entry doesn't download again
+        self.assertEqual(_cached.mExtract('https://www.youtube.com/watch?v=abc', False)[1], _path)
+        _cached.cache.mDelete('https://youtu.be/abc')
+        self.assertEqual(_cached.mExtract('https://youtu.be/abc', True)[1], _path)
+        self.assertEqual(_extractor.downloads, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import time
+import unittest
+
+from entities.utils.cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_hit_and_miss(self):
+        _cache = TTLCache(60)
+        self.assertIsNone(_cache.mGet((1, 'dbdhelp', 'bo')))
+        _cache.mSet((1, 'dbdhelp', 'bo'), ['Bond', 'Boil Over'])
+        self.assertEqual(_cache.mGet((1, 'dbdhelp', 'bo')), ['Bond', 'Boil Over'])
+        _stats = _cache.mGetStats()
+        self.assertEqual(_stats['hits'], 1)
+        self.assertEqual(_stats['misses'], 1)
+        self.assertEqual(_stats['hitRate'], 0.5)
+
+    def test_expiry(self):
+        _cache = TTLCache(0.01)
+        _cache.mSet((1, 'dbdimg', 'a'), ['Alert'])
+        time.sleep(0.02)
+        self.assertIsNone(_cache.mGet((1, 'dbdimg', 'a')))
+        self.assertEqual(len(_cache), 0)
+
+    def test_invalidate_owner(self):
+        _cache = TTLCache(60)
+        _cache.mSet((1, 'dbdadd', 'a'), ['Alert'])
+        _cache.mSet((1, 'dbdbye', 'a'), ['Aftercare'])
+        _cache.mSet((2, 'dbdadd', 'a'), ['Alert'])
+        self.assertEqual(_cache.mInvalidateOwner(1), 2)
+        self.assertNotIn((1, 'dbdadd', 'a'), _cache)
+        self.assertIn((2, 'dbdadd', 'a'), _cache)
+
+    def test_max_entries(self):
+        _cache = TTLCache(60, aMaxEntries=2)
+        for _i in range(3):
+            _cache.mSet((_i, 'dbdhelp', ''), [_i])
+        self.assertNotIn((0, 'dbdhelp', ''), _cache)
+        self.assertEqual(_cache.mGetStats()['evictions'], 1)
+
+    def test_get_or_compute(self):
+        _cache = TTLCache(60)
+        _calls = []
+        _factory = lambda: _calls.append(1) or ['Bond']
+        self.assertEqual(_cache.mGetOrCompute((1, 'dbdhelp', 'b'), _factory), ['Bond'])
+        self.assertEqual(_cache.mGetOrCompute((1, 'dbdhelp', 'b'), _factory), ['Bond'])
+        self.assertEqual(len(_calls), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import csv
+import json
+import os
+import tempfile
+import unittest
+
+from entities.utils import datasync
+from entities.utils.datasync import mAddImgPlaceholders, mIterRecords, mSyncRecords, mUpdateCSVBasedOnJSONFile
+
+
+class TestDataSync(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.jsonPath = os.path.join(self.tmpDir.name, 'perks.json')
+        self.csvPath = os.path.join(self.tmpDir.name, 'perkusage.csv')
+        self.perks = {
+            "p-1": {"title": "Adrenaline", "rarity": 3, "tags": ["exhaustion", "speed"]},
+            "p-2": {"title": "Bond \"aura\" é", "rarity": 12345678, "tags": []},
+            "p-3": {"title": "Kindred", "rarity": None, "tags": [{"nested": True}]}
+        }
+        with open(self.jsonPath, 'w') as _file:
+            json.dump(self.perks, _file, indent=4)
+        with open(self.csvPath, 'w', newline='') as _file:
+            _writer = csv.writer(_file)
+            _writer.writerow(['id', 'title', 'games'])
+            _writer.writerows([['p-1', 'Adrenaline', '4'], ['p-2', 'Bond', '7'], ['p-9', 'Old Perk', '1']])
+
+    def tearDown(self):
+        datasync.CHUNK_SIZE = 64 * 1024
+        self.tmpDir.cleanup()
+
+    def mReadCsv(self) -> list[dict]:
+        with open(self.csvPath, 'r', newline='') as _file:
+            return list(csv.DictReader(_file))
+
+    def test_json_stream_across_chunks(self):
+        datasync.CHUNK_SIZE = 3
+        self.assertEqual(dict(mIterRecords(self.jsonPath)), self.perks)
+        _arrayPath = os.path.join(self.tmpDir.name, 'perks_array.json')
+        with open(_arrayPath, 'w') as _file:
+            json.dump([{"id": _key, **_perk} for _key, _perk in self.perks.items()], _file)
+        self.assertEqual([_key for _key, _ in mIterRecords(_arrayPath)], ['p-1', 'p-2', 'p-3'])
+
+    def test_csv_update_keeps_other_columns(self):
+        _report = mUpdateCSVBasedOnJSONFile(self.jsonPath, self.csvPath)
+        self.assertEqual((_report["added"], _report["changed"], _report["removed"], _report["unchanged"]), (['p-3'], ['p-2'], ['p-9'], 1))
+        self.assertEqual(self.mReadCsv(), [
+            {"id": "p-1", "title": "Adrenaline", "games": "4"},
+            {"id": "p-2", "title": "Bond \"aura\" é", "games": "7"},
+            {"id": "p-3", "title": "Kindred", "games": ""}
+        ])
+        # Nothing changed, so the file is left alone
+        _inode = os.stat(self.csvPath).st_ino
+        self.assertFalse(mUpdateCSVBasedOnJSONFile(self.jsonPath, self.csvPath)["written"])
+        self.assertEqual(os.stat(self.csvPath).st_ino, _inode)
+
+    def test_dry_run_and_jsonl_target(self):
+        _jsonlPath = os.path.join(self.tmpDir.name, 'perks.jsonl')
+        self.assertFalse(mSyncRecords(self.jsonPath, _jsonlPath, aDryRun=True)["written"])
+        self.assertFalse(os.path.exists(_jsonlPath))
+        self.assertEqual(len(mSyncRecords(self.jsonPath, _jsonlPath)["added"]), 3)
+        self.assertEqual(dict(mIterRecords(_jsonlPath)), {_key: {"id": _key, **_perk} for _key, _perk in self.perks.items()})
+
+    def test_add_img_placeholders_in_place(self):
+        _report = mAddImgPlaceholders(self.jsonPath)
+        self.assertEqual(len(_report["changed"]), 3)
+        with open(self.jsonPath, 'r') as _file:
+            _content = _file.read()
+        _data = json.loads(_content)
+        self.assertEqual(_data["p-1"]["img"], 'assets/dbd/imgs/perks/adrenaline.png')
+        self.assertEqual(list(_data), list(self.perks))
+        # The output matches json.dump with indent=4
+        self.assertEqual(_content, json.dumps(_data, indent=4))
+        self.assertEqual(mAddImgPlaceholders(self.jsonPath)["unchanged"], 3)
+
+    def test_keyed_records_keep_key_field(self):
+        _source = os.path.join(self.tmpDir.name, 'source.json')
+        _target = os.path.join(self.tmpDir.name, 'target.json')
+        with open(_source, 'w') as _file:
+            json.dump({"1": {"id": "1", "title": "Bond"}, "2": {"id": "2", "title": "Kindred"}}, _file, indent=4)
+        with open(_target, 'w') as _file:
+            json.dump({"1": {"id": "1", "title": "Old Bond"}, "3": {"title": "No Id"}}, _file, indent=4)
+        self.assertTrue(mSyncRecords(_source, _target, aFields=['title'])["written"])
+        with open(_target, 'r') as _file:
+            _content = _file.read()
+        self.assertEqual(json.loads(_content), {"1": {"id": "1", "title": "Bond"}, "3": {"title": "No Id"}, "2": {"id": "2", "title": "Kindred"}})
+        self.assertEqual(_content, json.dumps(json.loads(_content), indent=4))
+        # Syncing a file with itself leaves it unchanged
+        self.assertFalse(mSyncRecords(_target, _target)["written"])
+        with open(_target, 'r') as _file:
+            self.assertEqual(_file.read(), _content)
+
+
+if __name__ == "__main__":
+    unittest.main()
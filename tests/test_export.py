@@ -0,0 +1,104 @@
+import csv
+import gzip
+import io
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from entities.utils.export import MATCH_COLUMNS, mCleanupUserExports, mExportMatches, mGetStatePath, mGetUserExportPath
+from entities.utils.sql import SQLRetriever
+
+
+class _FailingRetriever:
+    # Stops the export after a number of chunks, like a dropped connection
+    def __init__(self, aRetriever: SQLRetriever, aChunks: int) -> None:
+        self.retriever = aRetriever
+        self.chunks = aChunks
+
+    def mStream(self, aQuery: str, aChunkSize: int = 1000):
+        for _index, _rows in enumerate(self.retriever.mStream(aQuery, aChunkSize)):
+            if _index == self.chunks:
+                raise ConnectionError('Lost connection')
+            yield _rows
+
+
+class TestMatchExport(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.conn = sqlite3.connect(':memory:')
+        self.retriever = SQLRetriever(self.conn)
+        self.conn.execute('CREATE TABLE matches (id INTEGER PRIMARY KEY AUTOINCREMENT, user INTEGER, outcome TEXT, match_date TEXT, '
+                          'perk_1_name TEXT, perk_2_name TEXT, perk_3_name TEXT, perk_4_name TEXT)')
+        self.mAddMatches(12000)
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def mAddMatches(self, aCount: int) -> None:
+        self.conn.executemany('INSERT INTO matches (user, outcome, match_date, perk_1_name, perk_2_name, perk_3_name, perk_4_name) VALUES (?, ?, ?, ?, ?, ?, ?)', [
+            (_index % 3, 'ESCAPE' if _index % 2 else 'DEATH', '2024-09-01 20:00:00', 'Bond', 'Kindred', 'Windows of Opportunity', 'Perk, "quoted"') for _index in range(aCount)
+        ])
+        self.conn.commit()
+
+    def mReadRows(self, aPath: str) -> list[list[str]]:
+        with gzip.open(aPath, 'rt', newline='') if aPath.endswith('.gz') else open(aPath, 'r', newline='') as _file:
+            return list(csv.reader(_file))
+
+    def test_interrupted_export_resumes(self):
+        _path = os.path.join(self.tmpDir.name, 'matches.csv.gz')
+        with self.assertRaises(ConnectionError):
+            mExportMatches(_path, aRetriever=_FailingRetriever(self.retriever, 2))
+        self.assertEqual(len(self.mReadRows(_path)), 10001)
+        # Garbage after the last checkpoint is dropped
+        with open(_path, 'ab') as _file:
+            _file.write(b'partial')
+        _result = mExportMatches(_path, aRetriever=self.retriever)
+        self.assertEqual((_result["exported"], _result["rows"]), (2000, 12000))
+        _rows = self.mReadRows(_path)
+        self.assertEqual(_rows[0], MATCH_COLUMNS)
+        self.assertEqual([int(_row[0]) for _row in _rows[1:]], list(range(1, 12001)))
+        self.assertEqual(_rows[1][-1], 'Perk, "quoted"')
+
+    def test_finished_export_appends_new_matches(self):
+        _path = os.path.join(self.tmpDir.name, 'matches.csv')
+        mExportMatches(_path, aRetriever=self.retriever)
+        self.mAddMatches(10)
+        self.assertEqual(mExportMatches(_path, aRetriever=self.retriever)["exported"], 10)
+        self.assertEqual(len(self.mReadRows(_path)), 12011)
+        # Starting over rewrites the file
+        self.assertEqual(mExportMatches(_path, aFresh=True, aRetriever=self.retriever)["exported"], 12010)
+        self.assertEqual(len(self.mReadRows(_path)), 12011)
+        self.assertTrue(os.path.exists(mGetStatePath(_path)))
+
+    def test_user_export_and_empty_result(self):
+        _result = mExportMatches(os.path.join(self.tmpDir.name, 'user.csv.gz'), aUser=1, aRetriever=self.retriever)
+        self.assertEqual(_result["rows"], 4000)
+        self.assertTrue(all(_row[1] == '1' for _row in self.mReadRows(_result["path"])[1:]))
+        _empty = mExportMatches(os.path.join(self.tmpDir.name, 'nobody.csv.gz'), aUser=7, aRetriever=self.retriever)
+        self.assertEqual(self.mReadRows(_empty["path"]), [MATCH_COLUMNS])
+
+    def test_snapshot_for_upload(self):
+        _path = os.path.join(self.tmpDir.name, 'matches.csv')
+        _result = mExportMatches(_path, aRetriever=self.retriever, aSnapshotMaxBytes=10 ** 8)
+        # Later exports append to the file, not to the copy being uploaded
+        self.mAddMatches(10)
+        mExportMatches(_path, aRetriever=self.retriever)
+        self.assertEqual(len(self.mReadRows(_result["snapshot"])), 12001)
+        self.assertEqual(len(self.mReadRows(_path)), 12011)
+        self.assertNotIn("snapshot", mExportMatches(_path, aRetriever=self.retriever, aSnapshotMaxBytes=10))
+
+    def test_old_user_exports_are_deleted(self):
+        _path = os.path.join(self.tmpDir.name, 'matches.csv.gz')
+        _userPath = mGetUserExportPath(_path, 1)
+        mExportMatches(_path, aRetriever=self.retriever)
+        mExportMatches(_userPath, aUser=1, aRetriever=self.retriever, aSnapshotMaxBytes=10 ** 8)
+        self.assertEqual(mCleanupUserExports(_path, 60), 0)
+        # The shared export stays however old it is
+        self.assertEqual(mCleanupUserExports(_path, 60, aNow=time.time() + 7200), 3)
+        self.assertEqual(sorted(os.listdir(self.tmpDir.name)), ['matches.csv.gz', 'matches.csv.gz.state.json'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from entities.utils.files import FileNamer, JsonStateWriter, mGetBackupPath, mParseJsonFile, mWriteJsonFile
+
+
+class TestJsonState(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpDir.name, 'hctasks.json')
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def test_atomic_write_keeps_backup(self):
+        mWriteJsonFile(self.path, {"run": 1}, aBackup=True)
+        mWriteJsonFile(self.path, {"run": 2}, aBackup=True)
+        self.assertEqual(mGetBackupPath(self.path), os.path.join(self.tmpDir.name, 'hctasks_bkp.json'))
+        self.assertEqual(mParseJsonFile(self.path), {"run": 2})
+        self.assertEqual(mParseJsonFile(mGetBackupPath(self.path)), {"run": 1})
+        # No temporary files are left behind
+        self.assertEqual(sorted(os.listdir(self.tmpDir.name)), ['hctasks.json', 'hctasks_bkp.json'])
+
+    @unittest.skipIf(os.name == 'nt', 'POSIX file modes')
+    def test_atomic_write_keeps_mode(self):
+        mWriteJsonFile(self.path, {"run": 1})
+        # New files get the umask default, not mkstemp's 0600
+        _umask = os.umask(0)
+        os.umask(_umask)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o666 & ~_umask)
+        os.chmod(self.path, 0o640)
+        mWriteJsonFile(self.path, {"run": 2})
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o640)
+
+    def test_corrupt_file_falls_back_to_backup(self):
+        mWriteJsonFile(self.path, {"run": 1}, aBackup=True)
+        mWriteJsonFile(self.path, {"run": 2}, aBackup=True)
+        with open(self.path, 'w') as _file:
+            _file.write('{"run": ')
+        self.assertEqual(mParseJsonFile(self.path), {"run": 1})
+
+    def test_writer_coalesces_writes(self):
+        _writer = JsonStateWriter(aDelay=0.05)
+        _state = {"run": 0}
+        for _run in range(1, 21):
+            _state["run"] = _run
+            _writer.mWrite(self.path, _state)
+        _state["run"] = 99
+        time.sleep(0.2)
+        with open(self.path, 'r') as _file:
+            self.assertEqual(json.load(_file), {"run": 20})
+        self.assertEqual(_writer.mGetStats(), {"requested": 20, "written": 1, "pending": 0})
+
+    def test_flush_writes_pending_now(self):
+        _writer = JsonStateWriter(aDelay=60)
+        _writer.mWrite(self.path, {"run": 1})
+        self.assertFalse(os.path.exists(self.path))
+        _writer.mFlush()
+        self.assertEqual(mParseJsonFile(self.path), {"run": 1})
+
+
+class TestFileNamer(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def test_concurrent_reservations_are_unique(self):
+        _namer = FileNamer()
+        _path = os.path.join(self.tmpDir.name, 'user_randombuild.png')
+        with ThreadPoolExecutor(max_workers=8) as _executor:
+            _paths = list(_executor.map(lambda _: _namer.mReserve(_path, aWidth=3), range(200)))
+        self.assertEqual(len(set(_paths)), 200)
+        self.assertIn(os.path.join(self.tmpDir.name, 'user_randombuild_000.png'), _paths)
+        self.assertEqual(len(os.listdir(self.tmpDir.name)), 200)
+
+    def test_existing_files_are_skipped(self):
+        for _index in (0, 1, 7):
+            open(os.path.join(self.tmpDir.name, f'user_randombuild_{_index:03}.webp'), 'w').close()
+        open(os.path.join(self.tmpDir.name, 'user_randombuild_extra_900.png'), 'w').close()
+        _namer = FileNamer()
+        _path = _namer.mReserve(os.path.join(self.tmpDir.name, 'user_randombuild.png'), aWidth=3)
+        # The counter starts after the files of a previous run, without probing them
+        self.assertTrue(_path.endswith('user_randombuild_008.png'))
+        self.assertEqual(_namer.mGetStats(), {"stems": 2, "collisions": 0})
+        _path = _namer.mReserve(os.path.join(self.tmpDir.name, 'user_randombuild_extra.png'))
+        self.assertTrue(_path.endswith('user_randombuild_extra_901.png'))
+
+    def test_directory_is_scanned_once(self):
+        _namer = FileNamer(aMaxStems=2)
+        _namer.mReserve(os.path.join(self.tmpDir.name, 'user1_randombuild.png'))
+        # Files appearing later are found by the O_EXCL retry, not by scanning again
+        open(os.path.join(self.tmpDir.name, 'user2_randombuild_0.png'), 'w').close()
+        _path = _namer.mReserve(os.path.join(self.tmpDir.name, 'user2_randombuild.png'))
+        self.assertTrue(_path.endswith('user2_randombuild_1.png'))
+        self.assertEqual(_namer.mGetStats(), {"stems": 2, "collisions": 1})
+        # Only the most recently used stems keep a counter
+        _namer.mReserve(os.path.join(self.tmpDir.name, 'user3_randombuild.png'))
+        self.assertEqual(_namer.mGetStats()["stems"], 2)
+        _path = _namer.mReserve(os.path.join(self.tmpDir.name, 'user1_randombuild.png'))
+        self.assertTrue(_path.endswith('user1_randombuild_1.png'))
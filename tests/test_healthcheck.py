@@ -0,0 +1,78 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from datetime import datetime, timedelta
+
+from entities.workers.utils.healthcheck import CatchUp, HealthWorker
+
+
+class TestHealthWorker(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.tasksFile = os.path.join(self.tmpDir.name, 'hctasks.json')
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def mWriteTasks(self, aTasks: dict) -> None:
+        with open(self.tasksFile, 'w') as _file:
+            json.dump(aTasks, _file)
+
+    def mRunWorker(self, aWorker: HealthWorker, aSeconds: float) -> None:
+        async def _mMain():
+            aWorker.mStart()
+            await asyncio.sleep(aSeconds)
+            await aWorker.mStop()
+            # The bot may close more than once
+            await aWorker.mStop()
+        asyncio.run(_mMain())
+
+    def test_catch_up_policies(self):
+        _now = datetime(2024, 9, 7, 12, 0, 0)
+        _last = _now - timedelta(minutes=35)
+        _interval = timedelta(minutes=10)
+        self.assertEqual(HealthWorker.mCalculateNextRun(_last, _interval, CatchUp.SKIP, _now), (_now + timedelta(minutes=5), 0))
+        self.assertEqual(HealthWorker.mCalculateNextRun(_last, _interval, CatchUp.ONCE, _now), (_now, 1))
+        self.assertEqual(HealthWorker.mCalculateNextRun(_last, _interval, CatchUp.ALL, _now), (_now, 3))
+        self.assertEqual(HealthWorker.mCalculateNextRun(_now, _interval, CatchUp.ALL, _now), (_now + _interval, 0))
+
+    def test_disabled_tasks_are_not_scheduled(self):
+        self.mWriteTasks({
+            "on": {"interval": 5},
+            "off": {"enabled": False, "interval": 5}
+        })
+        _worker = HealthWorker(self.tasksFile, lambda aTask: None)
+        self.assertEqual([_task.name for _task in _worker.mGetTasks()], ['on'])
+
+    def test_runs_due_tasks_and_persists_last_run(self):
+        _lastRun = datetime.now() - timedelta(hours=1)
+        self.mWriteTasks({"job": {"interval": 0.002, "last_run": HealthWorker.mDateTimeToStr(_lastRun), "catch_up": "all"}})
+        _runs = []
+        _worker = HealthWorker(self.tasksFile, lambda aTask: _runs.append(threading.current_thread().name))
+        self.mRunWorker(_worker, 0.3)
+        # Missed runs are capped, then the task keeps running every 120 ms
+        self.assertGreaterEqual(len(_runs), 11)
+        self.assertTrue(all(_name.startswith('healthcheck') for _name in _runs))
+        with open(self.tasksFile, 'r') as _file:
+            self.assertGreater(HealthWorker.mStrToDateTime(json.load(_file)['job']['last_run']), _lastRun)
+
+    def test_timeout_does_not_block_other_tasks(self):
+        self.mWriteTasks({
+            "slow": {"interval": 0.001, "timeout": 0.05},
+            "fast": {"interval": 0.001}
+        })
+        _runs = []
+
+        def _mRun(aTask):
+            _runs.append(aTask.name)
+            if aTask.name == 'slow':
+                time.sleep(0.2)
+
+        _worker = HealthWorker(self.tasksFile, _mRun)
+        self.mRunWorker(_worker, 0.35)
+        self.assertGreaterEqual(_runs.count('fast'), 3)
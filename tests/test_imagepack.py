@@ -0,0 +1,83 @@
+import io
+import os
+import tempfile
+import unittest
+
+from discord import File
+from PIL import Image
+
+from entities.utils.images import mCreateCollage
+from entities.utils.imagepack import ImagePack, mBuildImagePack
+from entities.workers.dbd.perks import PerkTracker
+
+
+class TestImagePack(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.imgDir = os.path.join(self.tmpDir.name, 'perks')
+        self.packPath = os.path.join(self.tmpDir.name, 'perks.pack')
+        os.makedirs(self.imgDir)
+        self.images = {}
+        for _index, _name in enumerate(['bond', 'adrenaline', 'notfound']):
+            _buffer = io.BytesIO()
+            Image.new('RGBA', (16 + _index, 16), (_index * 50, 0, 0, 255)).save(_buffer, 'PNG')
+            self.images[f'{_name}.png'] = _buffer.getvalue()
+            with open(os.path.join(self.imgDir, f'{_name}.png'), 'wb') as _file:
+                _file.write(_buffer.getvalue())
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def test_pack_round_trip(self):
+        self.assertEqual(mBuildImagePack(self.imgDir, self.packPath)['images'], 3)
+        _pack = ImagePack(self.packPath)
+        try:
+            self.assertEqual(sorted(_pack.mGetNames()), sorted(self.images))
+            for _name, _data in self.images.items():
+                self.assertEqual(bytes(_pack.mGetBytes(_name)), _data)
+            self.assertIsNone(_pack.mGetBytes('missing.png'))
+            self.assertEqual(_pack.mVerify(), [])
+            self.assertEqual(_pack.mGetStats()['misses'], 1)
+        finally:
+            _pack.mClose()
+
+    def test_packed_image_is_a_file_object(self):
+        mBuildImagePack(self.imgDir, self.packPath)
+        _pack = ImagePack(self.packPath)
+        with Image.open(_pack.mOpen('adrenaline.png')) as _image:
+            self.assertEqual(_image.size, (17, 16))
+        _file = File(_pack.mOpen('bond.png'))
+        self.assertEqual(_file.filename, 'bond.png')
+        self.assertEqual(_file.fp.read(), self.images['bond.png'])
+        _file.close()
+        # Images still open keep the mapping alive after the pack is closed
+        _image = _pack.mOpen('notfound.png')
+        _pack.mClose()
+        self.assertEqual(_image.read(), self.images['notfound.png'])
+        _image.close()
+
+    def test_collage_images_are_closed(self):
+        mBuildImagePack(self.imgDir, self.packPath)
+        _pack = ImagePack(self.packPath)
+        _images = [PerkTracker.mGetImageFrom(_perk, _pack) for _perk in ('Bond', 'Adrenaline')]
+        try:
+            self.assertEqual(mCreateCollage(_images, 40, 20).size, (45, 20))
+        finally:
+            PerkTracker.mCloseImages(_images)
+        self.assertTrue(all(_image.closed for _image in _images))
+        _pack.mClose()
+
+    def test_rebuild_is_detected(self):
+        mBuildImagePack(self.imgDir, self.packPath)
+        _pack = ImagePack(self.packPath)
+        self.assertTrue(_pack.mIsCurrent())
+        os.remove(os.path.join(self.imgDir, 'bond.png'))
+        mBuildImagePack(self.imgDir, self.packPath)
+        self.assertFalse(_pack.mIsCurrent())
+        self.assertEqual(len(ImagePack(self.packPath)), 2)
+        _pack.mClose()
+        self.assertEqual(sorted(os.listdir(self.tmpDir.name)), ['perks', 'perks.pack'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import io
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+
+from entities.utils.images import ENCODING_PROFILES, mEncodeImage, mGetEncodingProfile, mSaveImage
+
+
+class TestEncodingProfiles(unittest.TestCase):
+    def setUp(self):
+        self.image = Image.new('RGBA', (80, 20), (0, 0, 0, 0))
+        self.image.paste((200, 40, 40, 255), (0, 0, 40, 20))
+
+    def test_every_profile_round_trips(self):
+        for _name in ENCODING_PROFILES:
+            _buffer = io.BytesIO()
+            mEncodeImage(self.image, _buffer, mGetEncodingProfile(_name))
+            _buffer.seek(0)
+            with Image.open(_buffer) as _decoded:
+                self.assertEqual(_decoded.size, (80, 20), _name)
+                # Transparency survives every profile
+                self.assertEqual(_decoded.convert('RGBA').getpixel((60, 10))[3], 0, _name)
+
+    def test_save_uses_profile_extension(self):
+        with tempfile.TemporaryDirectory() as _dir:
+            _path = mSaveImage(self.image, os.path.join(_dir, 'user_randombuild.png'), aProfile='webp')
+            self.assertEqual(os.path.basename(_path), 'user_randombuild_000.webp')
+            with Image.open(_path) as _decoded:
+                self.assertEqual(_decoded.format, 'WEBP')
+
+    def test_failed_save_frees_the_name(self):
+        with tempfile.TemporaryDirectory() as _dir:
+            class _FullDisk:
+                def save(self, *args, **kwargs):
+                    raise OSError('No space left on device')
+            with self.assertRaises(OSError):
+                mSaveImage(_FullDisk(), os.path.join(_dir, 'user_failed.png'), aProfile='webp')
+            self.assertEqual(os.listdir(_dir), [])
+
+    def test_unknown_profile_falls_back(self):
+        self.assertEqual(mGetEncodingProfile('gif')["name"], 'png')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import csv
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from entities.utils.files import mGetDBDDataDir
+from entities.utils.importer import MATCH_PERK_COLUMNS, mImportCsv
+from entities.utils.sql import SQLRetriever
+
+
+class TestImporter(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute('CREATE TABLE perks (name TEXT PRIMARY KEY)')
+        self.conn.execute('CREATE TABLE matches (id INTEGER PRIMARY KEY AUTOINCREMENT, user INTEGER, outcome TEXT, match_date TEXT, '
+                          'perk_1_name TEXT, perk_2_name TEXT, perk_3_name TEXT, perk_4_name TEXT)')
+        self.conn.executemany('INSERT INTO perks VALUES (?)', [('Bond',), ('Kindred',), ('Hope',), ("We'll Make It",)])
+        self.conn.commit()
+        self.retriever = SQLRetriever(self.conn)
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def mWriteCsv(self, aName: str, aRows: list[list]) -> str:
+        _path = os.path.join(self.tmpDir.name, aName)
+        with open(_path, 'w', newline='') as _file:
+            csv.writer(_file).writerows(aRows)
+        return _path
+
+    def test_matches_are_validated_and_batched(self):
+        _header = ['id', 'user', 'match_date', 'outcome', *MATCH_PERK_COLUMNS]
+        _valid = [1, 7, '2024-08-31 20:48:49', 'escape', 'bond', 'KINDRED', 'Hope', "we'll make it"]
+        _path = self.mWriteCsv('matches.csv', [_header] + [_valid] * 25 + [
+            [2, 7, '2024-08-31 20:48:49', 'ESCAPE', 'Bond', 'Kindred', 'Hope', 'Not A Perk'],
+            [3, 7, '2024-08-31', 'DEATH', 'Bond', 'Kindred', 'Hope', 'Bond'],
+            [4, 7, '2024-08-31 20:48:49', 'TIE', 'Bond', 'Kindred', 'Hope', 'Bond']
+        ])
+        _report = mImportCsv(_path, self.retriever, aBatchSize=4, aTransactionRows=8)
+        self.assertEqual((_report["table"], _report["rows"], _report["imported"], _report["invalid"]), ('matches', 28, 25, 3))
+        self.assertTrue(_report["errors"][0].startswith('line 27: unknown perk'))
+        _rows = self.conn.execute('SELECT outcome, perk_1_name, perk_2_name, perk_4_name FROM matches').fetchall()
+        self.assertEqual(len(_rows), 25)
+        self.assertEqual(_rows[0], ('ESCAPE', 'Bond', 'Kindred', "We'll Make It"))
+
+    def test_perk_usage_is_replaced(self):
+        _header = ['id', 'title', 'games', 'escapes', 'deaths', 'escape_rate']
+        mImportCsv(self.mWriteCsv('usage.csv', [_header, ['s-1', 'Bond', 3, 2, 1, 0.66], ['s-2', 'Hope', 1, 0, 1, 0.0]]), self.retriever)
+        _report = mImportCsv(self.mWriteCsv('usage.csv', [_header, ['s-1', 'Bond', 4, 3, 1, 0.75], ['s-3', 'Kindred', -1, 0, 0, 0.0]]), self.retriever)
+        self.assertEqual((_report["imported"], _report["invalid"]), (1, 1))
+        self.assertEqual(self.conn.execute('SELECT * FROM perk_usage ORDER BY perk_name').fetchall(), [('Bond', 4, 3, 1), ('Hope', 1, 0, 1)])
+
+    def test_exported_matches_round_trip(self):
+        # The real export imports as is, keeping its ids
+        _path = os.path.join(mGetDBDDataDir(), 'exported', 'matches.csv')
+        with open(_path, 'r', newline='') as _file:
+            _rows = list(csv.DictReader(_file))
+        _catalog = {_row[_column].lower(): _row[_column] for _row in _rows for _column in MATCH_PERK_COLUMNS}
+        _report = mImportCsv(_path, self.retriever, aCatalog=_catalog, aKeepIds=True)
+        self.assertEqual((_report["imported"], _report["invalid"]), (len(_rows), 0))
+        self.assertEqual(self.conn.execute('SELECT MAX(id) FROM matches').fetchone()[0], max(int(_row['id']) for _row in _rows))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import logging
+import os
+import queue
+import tempfile
+import time
+import unittest
+
+from log import logger
+
+
+class _RecordCollector(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestLogger(unittest.TestCase):
+    def setUp(self):
+        self.collector = _RecordCollector()
+        logging.getLogger('UltraBot').addHandler(self.collector)
+
+    def tearDown(self):
+        logging.getLogger('UltraBot').removeHandler(self.collector)
+        logger.mSetModuleDebug(__name__, False)
+
+    def test_lazy_args_and_caller(self):
+        logger.mLogInfo('Perk %s selected', 'Bond')
+        _record = self.collector.records[-1]
+        self.assertEqual(_record.getMessage(), 'Perk Bond selected')
+        self.assertEqual(_record.funcName, 'test_lazy_args_and_caller')
+        self.assertEqual(_record.name, f'UltraBot.{__name__}')
+
+    def test_filtered_level_skips_formatting(self):
+        class _Exploding:
+            def __str__(self):
+                raise AssertionError('formatted a filtered record')
+        logger.mLogDebug('Perks: %s', _Exploding())
+        self.assertEqual(self.collector.records, [])
+
+    def test_sample(self):
+        for _i in range(100):
+            logger.mLogInfo('Roll %s', _i, sample=0.1)
+        self.assertEqual(len(self.collector.records), 10)
+
+    def test_rate_limit(self):
+        for _i in range(100):
+            logger.mLogInfo('Rejected %s', _i, per_second=5)
+        self.assertEqual(len(self.collector.records), 5)
+
+    def test_module_debug_switch(self):
+        logger.mSetModuleDebug(__name__)
+        logger.mLogDebug('Debug record')
+        for _i in range(10):
+            logger.mLogInfo('Roll %s', _i, sample=0.5)
+        self.assertEqual(len(self.collector.records), 11)
+
+    def test_rate_limit_in_debug_module(self):
+        logger.mSetModuleDebug(__name__)
+        for _i in range(1000):
+            logger.mLogDebug('Perk %s is blacklisted', _i, per_second=20)
+        self.assertEqual(len(self.collector.records), 20)
+
+
+class TestBufferedHandler(unittest.TestCase):
+    def test_idle_queue_flushes_buffer(self):
+        with tempfile.TemporaryDirectory() as _dir:
+            _path = os.path.join(_dir, 'burst.log')
+            _handler = logger.BufferedRotatingFileHandler(_path, aFlushInterval=0.1)
+            _queue = queue.SimpleQueue()
+            _listener = logger._LogQueueListener(_queue, _handler)
+            _listener.start()
+            try:
+                for _i in range(3):
+                    _queue.put(logging.makeLogRecord({"msg": f'Burst {_i}', "levelno": logging.INFO}))
+                # Nothing else is logged, the end of the burst is still written
+                for _ in range(100):
+                    if os.path.getsize(_path) and not _handler.pending:
+                        break
+                    time.sleep(0.01)
+                with open(_path, 'r') as _file:
+                    self.assertEqual(_file.read().splitlines(), ['Burst 0', 'Burst 1', 'Burst 2'])
+            finally:
+                _listener.stop()
+                _handler.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import asyncio
+import unittest
+
+from entities.utils import metrics, tracing
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_quantile(self):
+        _histogram = metrics.Histogram()
+        for _value in [0.002] * 90 + [0.3] * 10:
+            _histogram.mObserve(_value)
+        self.assertEqual(_histogram.mGetQuantile(0.5), 0.0025)
+        self.assertEqual(_histogram.mGetQuantile(0.95), 0.5)
+
+    def test_timed_records_errors(self):
+        @metrics.mTimed('test', 'failing')
+        def _mFail():
+            raise ValueError('boom')
+        with self.assertRaises(ValueError):
+            _mFail()
+        _entry = next(_e for _e in metrics.registry.mGetSummary() if _e['name'] == 'failing')
+        self.assertEqual(_entry['count'], 1)
+        self.assertEqual(_entry['errors'], 1)
+        self.assertEqual(_entry['inFlight'], 0)
+
+    def test_timed_coroutine(self):
+        @metrics.mTimed('test', 'coroutine')
+        async def _mSleep():
+            await asyncio.sleep(0)
+            return 'done'
+        self.assertEqual(asyncio.run(_mSleep()), 'done')
+        _text = metrics.registry.mRenderPrometheus()
+        self.assertIn('ultrabot_latency_seconds_count{layer="test",name="coroutine"} 1', _text)
+
+    def test_only_commands_start_traces(self):
+        tracing.mClearTraces()
+
+        @metrics.mTimed('file', 'read')
+        def _mRead():
+            return tracing.mGetCurrentSpan()
+
+        @metrics.mTimed('command', 'dbdset')
+        def _mCommand():
+            return _mRead()
+        self.assertIsNone(_mRead())
+        self.assertEqual(tracing.mGetTraces(), [])
+        self.assertEqual(_mCommand().name, 'read')
+        self.assertEqual([[_span.name for _span in _trace] for _trace in tracing.mGetTraces()], [['dbdset', 'read']])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,375 @@
+import asyncio
+import functools
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import wave
+
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from discord import FFmpegPCMAudio
+
+from cogs.musicplayer import Music
+from entities.utils.audiocache import AudioCache
+from entities.utils.musicutils import CachedExtractor, LocalExtractor, mGetFFmpegOptions
+from entities.utils.trackcache import TrackCache
+from entities.workers.music.music import Player, PlayerRegistry, Playlist, PlayStatus, Song
+
+
+class FakeExtractor:
+    def __init__(self, aDelay: float = 0.0) -> None:
+        self.delay = aDelay
+        self.extracted: list[str] = []
+
+    def mExtract(self, aUrl: str, aDownload: bool = True):
+        time.sleep(self.delay)
+        self.extracted.append(aUrl)
+        if 'broken' in aUrl:
+            raise ValueError('Unavailable')
+        return {"title": aUrl.upper(), "duration": 1, "url": aUrl}, None
+
+
+class FakePlayer(Player):
+    def mGetAudioSource(self, aSong: Song):
+        return aSong.url
+
+
+class FakeVoiceClient:
+    def __init__(self, aChannel: 'FakeVoiceChannel') -> None:
+        self.channel = aChannel
+        self.played: list[str] = []
+        self.after = None
+        self.connected = True
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def is_playing(self) -> bool:
+        return self.after is not None
+
+    def is_paused(self) -> bool:
+        return False
+
+    def play(self, aSource, after=None) -> None:
+        self.played.append(aSource)
+        self.after = after
+
+    def mFinish(self) -> None:
+        # Like the voice thread reaching the end of a song
+        _after, self.after = self.after, None
+        threading.Thread(target=_after, args=(None,)).start()
+
+    def stop(self) -> None:
+        if self.after:
+            self.mFinish()
+
+    async def move_to(self, aChannel: 'FakeVoiceChannel') -> None:
+        self.channel = aChannel
+
+    async def disconnect(self) -> None:
+        self.connected = False
+
+
+class FakeVoiceChannel:
+    def __init__(self, aId: int) -> None:
+        self.id = aId
+
+    async def connect(self) -> FakeVoiceClient:
+        return FakeVoiceClient(self)
+
+
+def mMakeCtx(aChannel: FakeVoiceChannel):
+    return SimpleNamespace(user=SimpleNamespace(name='user', voice=SimpleNamespace(channel=aChannel, deaf=False)))
+
+
+class TestPlaylist(unittest.TestCase):
+    def mMakePlaylist(self, aCount: int) -> Playlist:
+        _playlist = Playlist()
+        _playlist.mQueueSongs([Song(f'song{_index}') for _index in range(aCount)])
+        return _playlist
+
+    def test_queue_and_force_next(self):
+        _playlist = self.mMakePlaylist(3)
+        _playlist.mForceNext(Song('urgent'))
+        _playlist.mQueueSong(Song('last'))
+        self.assertEqual(len(_playlist), 5)
+        self.assertEqual([_song.url for _song in _playlist], ['song0', 'urgent', 'song1', 'song2', 'last'])
+        self.assertEqual(_playlist.mNext().url, 'urgent')
+        self.assertEqual(_playlist.previous.url, 'song0')
+        # Nothing is lost after the forced song
+        self.assertEqual([_playlist.mNext().url for _ in range(3)], ['song1', 'song2', 'last'])
+        self.assertIsNone(_playlist.mNext())
+        self.assertEqual(len(_playlist), 0)
+
+    def test_loop_remove_and_move(self):
+        _playlist = self.mMakePlaylist(4)
+        _playlist.mSetLoop(True)
+        self.assertEqual(_playlist.mRemove(1).url, 'song2')
+        self.assertEqual(_playlist.mMove(1, 0).url, 'song3')
+        self.assertEqual(_playlist.mMove(0, 10).url, 'song3')
+        self.assertEqual([_song.url for _song in _playlist], ['song0', 'song1', 'song3'])
+        self.assertEqual([_playlist.mNext().url for _ in range(4)], ['song1', 'song3', 'song0', 'song1'])
+        with self.assertRaises(IndexError):
+            _playlist.mRemove(5)
+
+    def test_shuffle_keeps_current_and_songs(self):
+        _playlist = self.mMakePlaylist(100000)
+        _playlist.mShuffle(random.Random(7))
+        self.assertEqual(_playlist.current.url, 'song0')
+        self.assertEqual(len(_playlist), 100000)
+        self.assertNotEqual(_playlist.next.url, 'song1')
+        self.assertEqual(sorted(_song.url for _song in _playlist), sorted(f'song{_index}' for _index in range(100000)))
+
+
+class TestPlayer(unittest.IsolatedAsyncioTestCase):
+    async def mWaitFor(self, aCondition) -> None:
+        for _ in range(200):
+            if aCondition():
+                return
+            await asyncio.sleep(0.005)
+        self.fail('Condition not reached')
+
+    async def test_connection_is_reused_across_songs(self):
+        _player = FakePlayer(1, aIdleTimeout=60, aExtractor=FakeExtractor())
+        _channel = FakeVoiceChannel(10)
+        self.assertIs(await _player.mPlay(mMakeCtx(_channel), Song('broken')), PlayStatus.FAILED)
+        self.assertIs(await _player.mPlay(mMakeCtx(_channel), Song('song0')), PlayStatus.STARTED)
+        self.assertIs(await _player.mPlay(mMakeCtx(_channel), Song('broken')), PlayStatus.QUEUED)
+        self.assertIs(await _player.mPlay(mMakeCtx(FakeVoiceChannel(11)), Song('song2')), PlayStatus.QUEUED)
+        _voiceClient = _player.voiceClient
+        self.assertEqual((_player.connects, _voiceClient.channel.id), (1, 11))
+        # The after callback plays the next song that resolves
+        _voiceClient.mFinish()
+        await self.mWaitFor(lambda: len(_voiceClient.played) == 2)
+        self.assertEqual(_voiceClient.played, ['song0', 'song2'])
+        self.assertTrue(_player.mSkip())
+        await self.mWaitFor(lambda: _player.playlist.current is None)
+        await _player.mDisconnect()
+
+    async def test_idle_player_disconnects(self):
+        _registry = PlayerRegistry(aIdleTimeout=0.05, aExtractor=FakeExtractor())
+        _player = _registry.mGetPlayer(SimpleNamespace(id=1))
+        self.assertIs(_registry.mGetPlayer(SimpleNamespace(id=1)), _player)
+        _player.mGetAudioSource = lambda aSong: aSong.url
+        await _player.mPlay(mMakeCtx(FakeVoiceChannel(10)), Song('song0'))
+        _voiceClient = _player.voiceClient
+        await asyncio.sleep(0.1)
+        self.assertTrue(_voiceClient.is_connected())
+        _voiceClient.mFinish()
+        await self.mWaitFor(lambda: not _voiceClient.is_connected())
+        self.assertEqual(len(_registry), 0)
+
+    async def test_idle_timer_waits_for_resolving_song(self):
+        _registry = PlayerRegistry(aIdleTimeout=0.05, aExtractor=FakeExtractor(aDelay=0.2))
+        _player = _registry.mGetPlayer(SimpleNamespace(id=1))
+        _player.mGetAudioSource = lambda aSong: aSong.url
+        _channel = FakeVoiceChannel(10)
+        _player.mScheduleIdle()
+        self.assertIs(await _player.mPlay(mMakeCtx(_channel), Song('song0')), PlayStatus.STARTED)
+        self.assertTrue(_player.mIsPlaying())
+        self.assertEqual(len(_registry), 1)
+        # A stop while resolving doesn't play or schedule anything on the dropped player
+        _voiceClient = _player.voiceClient
+        self.assertIs(await _player.mPlay(mMakeCtx(_channel), Song('song1')), PlayStatus.QUEUED)
+        _voiceClient.mFinish()
+        await self.mWaitFor(lambda: _player.playlist.current.url == 'song1')
+        await _player.mDisconnect()
+        await asyncio.sleep(0.3)
+        self.assertEqual(len(_registry), 0)
+        self.assertIsNone(_player.voiceClient)
+        self.assertEqual(_voiceClient.played, ['song0'])
+
+    async def test_next_songs_are_prefetched(self):
+        _extractor = FakeExtractor(0.05)
+        _player = FakePlayer(1, aIdleTimeout=60, aExtractor=_extractor, aPrefetch=2)
+        _ctx = mMakeCtx(FakeVoiceChannel(10))
+        for _index in range(4):
+            await _player.mPlay(_ctx, Song(f'song{_index}'))
+        await self.mWaitFor(lambda: _player.playlist[1].resolved)
+        self.assertEqual(sorted(_extractor.extracted), ['song0', 'song1', 'song2'])
+        # The next song starts without waiting for the extractor
+        _voiceClient = _player.voiceClient
+        _voiceClient.mFinish()
+        await self.mWaitFor(lambda: len(_voiceClient.played) == 2)
+        self.assertEqual(_player.playlist.current.title, 'SONG1')
+        self.assertEqual(_extractor.extracted.count('song1'), 1)
+        await _player.mDisconnect()
+
+    async def test_local_files(self):
+        with tempfile.TemporaryDirectory() as _dir:
+            _path = os.path.join(_dir, 'Local Song.mp3')
+            open(_path, 'wb').close()
+            _player = FakePlayer(1, aIdleTimeout=60, aExtractor=LocalExtractor())
+            self.assertIs(await _player.mPlay(mMakeCtx(FakeVoiceChannel(10)), Song(f'file://{_path}')), PlayStatus.STARTED)
+            self.assertEqual((_player.playlist.current.title, _player.playlist.current.output), ('Local Song', _path))
+            self.assertIs(await _player.mPlay(mMakeCtx(FakeVoiceChannel(10)), Song(os.path.join(_dir, 'missing.mp3'))), PlayStatus.QUEUED)
+            await _player.mDisconnect()
+
+
+    async def test_queued_songs_are_pinned_and_streamed_songs_cached(self):
+        with tempfile.TemporaryDirectory() as _dir:
+            _cache = AudioCache(_dir, aMaxBytes=10 ** 6)
+            _extractor = CachedExtractor(DownloadingExtractor(), TrackCache(':memory:'), _cache)
+            _player = FakePlayer(1, aIdleTimeout=60, aExtractor=_extractor, aStream=True, aAudioCache=_cache)
+            _ctx = mMakeCtx(FakeVoiceChannel(10))
+            for _id in ('a', 'b', 'c'):
+                await _player.mPlay(_ctx, Song(f'https://youtu.be/{_id}'))
+            self.assertTrue(all(_cache.mIsPinned(f'youtube:{_id}') for _id in ('a', 'b', 'c')))
+            _player.mRemove(1)
+            self.assertFalse(_cache.mIsPinned('youtube:c'))
+            # The streamed song is downloaded in the background
+            self.assertIsNone(_player.playlist.current.output)
+            await self.mWaitFor(lambda: _player.playlist.current.output)
+            self.assertEqual(_player.playlist.current.output, _cache.mGetPath('youtube:a'))
+            _player.voiceClient.mFinish()
+            await self.mWaitFor(lambda: _player.playlist.current.url.endswith('b'))
+            self.assertFalse(_cache.mIsPinned('youtube:a'))
+            # Replays come from disk
+            await _player.mPlay(_ctx, Song('https://www.youtube.com/watch?v=a'))
+            await _player.playlist[0].mGetSource(_extractor, False)
+            self.assertEqual(_player.playlist[0].output, _cache.mGetPath('youtube:a'))
+            await _player.mDisconnect()
+            self.assertEqual(_cache.mGetStats()["pinned"], 0)
+
+
+class FakeInteraction:
+    def __init__(self, aGuild, aChannel: FakeVoiceChannel) -> None:
+        self.guild = aGuild
+        self.user = SimpleNamespace(name='user', guild=aGuild, voice=SimpleNamespace(channel=aChannel, deaf=False))
+        self.replies: list[tuple] = []
+        self.response = SimpleNamespace(defer=self.mDefer, send_message=self.mSend)
+        self.followup = SimpleNamespace(send=self.mSend)
+
+    async def mDefer(self, thinking: bool = False) -> None:
+        pass
+
+    async def mSend(self, content: str = None, embed=None, ephemeral: bool = False) -> None:
+        self.replies.append((content, ephemeral))
+
+
+class TestMusicCog(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.guild = SimpleNamespace(id=1)
+        self.players = PlayerRegistry(aIdleTimeout=60, aExtractor=FakeExtractor())
+        self.cog = Music(SimpleNamespace(guilds=[self.guild]), self.players)
+
+    async def asyncTearDown(self):
+        await self.players.mDisconnectAll()
+
+    async def test_unresolvable_song_is_reported(self):
+        _ctx = FakeInteraction(self.guild, FakeVoiceChannel(10))
+        await Music.mPlay.callback(self.cog, _ctx, 'broken')
+        self.assertEqual(_ctx.replies, [('Could not play that song.', True)])
+
+    async def test_loop_without_player(self):
+        _ctx = FakeInteraction(self.guild, FakeVoiceChannel(10))
+        await Music.mLoop.callback(self.cog, _ctx, True)
+        self.assertEqual(_ctx.replies, [('Nothing is playing.', True)])
+        self.assertEqual(len(self.players), 0)
+
+
+class ExpiringExtractor:
+    # Media URLs that expire after aLifetime seconds, like YouTube's
+    def __init__(self, aLifetime: float) -> None:
+        self.lifetime = aLifetime
+        self.extracted = 0
+
+    def mExtract(self, aUrl: str, aDownload: bool = True):
+        self.extracted += 1
+        return {"title": aUrl, "duration": 10, "url": f'https://media.example/{aUrl}?expire={int(time.time() + self.lifetime)}'}, None
+
+
+class TestStaleSongs(unittest.IsolatedAsyncioTestCase):
+    async def test_expired_streams_resolve_again(self):
+        for _lifetime, _extracted in ((3600, 1), (30, 2)):
+            _extractor = ExpiringExtractor(_lifetime)
+            _song = Song('song0')
+            await _song.mGetSource(_extractor, False)
+            # Replayed by a looping playlist
+            await _song.mGetSource(_extractor, False)
+            self.assertEqual(_extractor.extracted, _extracted)
+
+    async def test_evicted_files_resolve_again(self):
+        with tempfile.TemporaryDirectory() as _dir:
+            _path = os.path.join(_dir, 'song.mp3')
+            open(_path, 'wb').close()
+            _song = Song(_path)
+            await _song.mGetSource(LocalExtractor())
+            os.remove(_path)
+            with self.assertRaises(FileNotFoundError):
+                await _song.mGetSource(LocalExtractor())
+
+
+class DownloadingExtractor:
+    def mExtract(self, aUrl: str, aDownload: bool = True, aDir: str = None):
+        _id = aUrl.rsplit('/', 1)[-1]
+        _info = {"id": _id, "title": _id, "duration": 1, "url": f'https://media.example/{_id}'}
+        if not aDownload:
+            return _info, None
+        _path = os.path.join(aDir, f'{_id}.webm')
+        with open(_path, 'wb') as _file:
+            _file.write(bytes(100))
+        return _info, _path
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+class StreamExtractor:
+    # Resolves every song to a file served by a local HTTP server
+    def __init__(self, aUrl: str) -> None:
+        self.url = aUrl
+        self.downloads: list[bool] = []
+
+    def mExtract(self, aUrl: str, aDownload: bool = True):
+        self.downloads.append(aDownload)
+        return {"title": 'Tone', "duration": 1, "url": self.url}, None
+
+
+class TestStreaming(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        # One second of silence
+        with wave.open(os.path.join(self.tmpDir.name, 'tone.wav'), 'wb') as _file:
+            _file.setnchannels(2)
+            _file.setsampwidth(2)
+            _file.setframerate(48000)
+            _file.writeframes(bytes(48000 * 4))
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(QuietHandler, directory=self.tmpDir.name))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/tone.wav'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmpDir.cleanup()
+
+    async def test_stream_mode_skips_download(self):
+        _extractor = StreamExtractor(self.url)
+        _player = FakePlayer(1, aIdleTimeout=60, aExtractor=_extractor, aStream=True)
+        self.assertIs(await _player.mPlay(mMakeCtx(FakeVoiceChannel(10)), Song('https://youtu.be/tone')), PlayStatus.STARTED)
+        _song = _player.playlist.current
+        self.assertEqual((_song.output, _song.stream, _extractor.downloads), (None, self.url, [False]))
+        self.assertIn('-reconnect 1', mGetFFmpegOptions(_song.stream)["before_options"])
+        self.assertNotIn('before_options', mGetFFmpegOptions(os.path.join(self.tmpDir.name, 'tone.wav')))
+        await _player.mDisconnect()
+
+    @unittest.skipUnless(shutil.which('ffmpeg'), 'ffmpeg is not installed')
+    async def test_ffmpeg_reads_stream(self):
+        _source = FFmpegPCMAudio(self.url, **mGetFFmpegOptions(self.url))
+        try:
+            # One 20 ms frame of 48 kHz stereo PCM
+            self.assertEqual(len(await asyncio.to_thread(_source.read)), 3840)
+        finally:
+            _source.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import wave
+
+from entities.utils.audiocache import AudioCache
+from entities.utils.musicutils import LocalExtractor
+from entities.utils.opus import OggOpusAudio, mEncodeOpus, mGetPacketDuration, mIsPassthroughOpus
+from entities.utils.trackcache import mNormalizeInfo
+from entities.workers.music.music import Player, Song
+
+# TOC bytes of stereo CELT fullband packets with one 20 ms frame, and of a SILK 60 ms one
+PACKET_20MS = b'\xfc'
+PACKET_60MS = b'\x1c'
+OPUS_HEAD = b'OpusHead' + struct.pack('<BBHIhB', 1, 2, 312, 48000, 0, 0)
+
+
+def mWriteOgg(aPath: str, aPackets: list[bytes]) -> None:
+    # One packet per page, with the lacing values of RFC 3533
+    with open(aPath, 'wb') as _file:
+        for _index, _packet in enumerate(aPackets):
+            _lacing = bytes([255] * (len(_packet) // 255) + [len(_packet) % 255])
+            _file.write(b'OggS' + struct.pack('<BBQIIIB', 0, 2 if _index == 0 else 0, _index, 1, _index, 0, len(_lacing)) + _lacing + _packet)
+
+
+class TestOpus(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpDir.name, 'song.ogg')
+        self.packets = [PACKET_20MS + bytes([_index]) * (300 if _index == 1 else 40) for _index in range(5)]
+        mWriteOgg(self.path, [OPUS_HEAD, b'OpusTags' + bytes(8)] + self.packets)
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    async def test_packets_pass_through(self):
+        self.assertEqual((mGetPacketDuration(PACKET_20MS), mGetPacketDuration(PACKET_60MS), mGetPacketDuration(b'\xfd\x00')), (20, 60, 40))
+        self.assertTrue(mIsPassthroughOpus(self.path))
+        # A cached Ogg Opus song is played without FFmpeg
+        _player = Player(1, aIdleTimeout=60, aExtractor=LocalExtractor(), aStream=False)
+        _song = Song(self.path)
+        await _song.mGetSource(LocalExtractor())
+        _source = _player.mGetAudioSource(_song)
+        self.assertIsInstance(_source, OggOpusAudio)
+        self.assertTrue(_source.is_opus())
+        self.assertEqual([_source.read() for _ in range(6)], self.packets + [b''])
+        _source.cleanup()
+
+    async def test_unsupported_files(self):
+        _long = os.path.join(self.tmpDir.name, 'long.ogg')
+        mWriteOgg(_long, [OPUS_HEAD, PACKET_60MS + bytes(40)])
+        self.assertFalse(mIsPassthroughOpus(_long))
+        # Ogg Opus with other packet lengths goes through FFmpeg
+        _song = Song(_long)
+        await _song.mGetSource(LocalExtractor())
+        self.assertFalse(_song.passthrough)
+        self.assertEqual((mNormalizeInfo({}, _long)["opus_passthrough"], mNormalizeInfo({}, self.path)["opus_passthrough"]), (False, True))
+        _text = os.path.join(self.tmpDir.name, 'text.ogg')
+        with open(_text, 'wb') as _file:
+            _file.write(b'not an ogg file')
+        self.assertFalse(mIsPassthroughOpus(_text))
+        with self.assertRaises(ValueError):
+            OggOpusAudio(_text)
+        # Passthrough Ogg Opus is cached as it is, a failed conversion keeps the download
+        _cache = AudioCache(os.path.join(self.tmpDir.name, 'cache'), aMaxBytes=10 ** 6, aTransform=mEncodeOpus)
+        self.assertTrue(_cache.mFill('youtube:a', lambda aDir: shutil.copy(self.path, aDir)).endswith('youtube_a.ogg'))
+        _cache = AudioCache(os.path.join(self.tmpDir.name, 'cache'), aMaxBytes=10 ** 6, aTransform=lambda aSource, aDir: 1 / 0)
+        self.assertTrue(_cache.mFill('youtube:b', lambda aDir: shutil.copy(_text, os.path.join(aDir, 'b.webm'))).endswith('youtube_b.webm'))
+        self.assertEqual(_cache.mGetStats()["transformFailures"], 1)
+
+    @unittest.skipUnless(shutil.which('ffmpeg'), 'ffmpeg is not installed')
+    def test_encode_wav(self):
+        _wav = os.path.join(self.tmpDir.name, 'tone.wav')
+        with wave.open(_wav, 'wb') as _file:
+            _file.setnchannels(2)
+            _file.setsampwidth(2)
+            _file.setframerate(44100)
+            _file.writeframes(bytes(44100 * 4))
+        _ogg = mEncodeOpus(_wav, self.tmpDir.name)
+        self.assertTrue(mIsPassthroughOpus(_ogg))
+
+
+if __name__ == "__main__":
+    unittest.main()
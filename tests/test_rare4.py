@@ -0,0 +1,39 @@
+import unittest
+
+from entities.utils import rare
+
+
+class TestMResolveMostSimilarBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.perks = ['Bond', 'Borrowed Time', 'Dead Hard', 'Deja Vu', 'Wake Up!', 'Windows of Opportunity', 'Hope']
+
+    def test_resolves_all_tokens(self):
+        _matches = rare.mResolveMostSimilarBatch(['bond', 'borowed', 'dead hard', 'wake'], self.perks)
+        self.assertEqual([_m.match for _m in _matches], ['Bond', 'Borrowed Time', 'Dead Hard', 'Wake Up!'])
+        self.assertFalse(any(_m.ambiguous for _m in _matches))
+
+    def test_no_duplicates(self):
+        _matches = rare.mResolveMostSimilarBatch(['bond', 'bond'], self.perks)
+        self.assertEqual(_matches[0].match, 'Bond')
+        self.assertNotEqual(_matches[1].match, 'Bond')
+        self.assertTrue(_matches[1].ambiguous)
+
+    def test_low_confidence_is_flagged(self):
+        _matches = rare.mResolveMostSimilarBatch(['zzz'], self.perks)
+        self.assertTrue(_matches[0].ambiguous)
+        self.assertLess(_matches[0].confidence, 0.7)
+
+    def test_partial_ties_are_flagged(self):
+        _matches = rare.mResolveMostSimilarBatch(['dead', 'dead hard'], ['Dead Hard', 'Deadlock', 'Bond'])
+        self.assertEqual([_m.match for _m in _matches], ['Deadlock', 'Dead Hard'])
+        self.assertEqual([_m.ambiguous for _m in _matches], [True, False])
+
+    def test_more_tokens_than_items(self):
+        _matches = rare.mResolveMostSimilarBatch(['hope', 'bond'], ['Hope'])
+        self.assertEqual(_matches[0].match, 'Hope')
+        self.assertEqual(_matches[1].match, '')
+
+
+if __name__ == '__main__':
+    unittest.main()
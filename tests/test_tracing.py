@@ -0,0 +1,45 @@
+import asyncio
+import unittest
+
+from entities.utils import tracing
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        tracing.mClearTraces()
+
+    def test_nested_spans_share_trace(self):
+        with tracing.mSpan('dbdban', layer='command') as _root:
+            with tracing.mSpan('mReplacePerk', layer='handler') as _child:
+                self.assertEqual(_child.parentId, _root.spanId)
+        _trace = tracing.mGetSlowestTrace('dbdban')
+        self.assertEqual([_span.name for _span in _trace], ['dbdban', 'mReplacePerk'])
+        self.assertEqual({_span.traceId for _span in _trace}, {_root.traceId})
+
+    def test_concurrent_tasks_get_own_traces(self):
+        async def _mCommand():
+            with tracing.mSpan('dbdrandom'):
+                await asyncio.sleep(0)
+                with tracing.mSpan('fetch_message'):
+                    await asyncio.sleep(0)
+
+        async def _mMain():
+            await asyncio.gather(_mCommand(), _mCommand())
+
+        asyncio.run(_mMain())
+        _traces = tracing.mGetTraces('dbdrandom')
+        self.assertEqual(len(_traces), 2)
+        self.assertTrue(all(len(_trace) == 2 for _trace in _traces))
+
+    def test_error_and_chrome_export(self):
+        with self.assertRaises(ValueError):
+            with tracing.mSpan('dbdset'):
+                raise ValueError('bad perk')
+        _events = tracing.mToChromeTrace(tracing.mGetTraces())['traceEvents']
+        _complete = [_event for _event in _events if _event['ph'] == 'X']
+        self.assertEqual(_complete[0]['name'], 'dbdset')
+        self.assertIn('bad perk', _complete[0]['args']['error'])
+
+
+if __name__ == "__main__":
+    unittest.main()
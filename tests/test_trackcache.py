@@ -0,0 +1,76 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+from entities.utils.musicutils import CachedExtractor, mGetSource, mIsStreamValid
+from entities.utils.trackcache import STREAM_URL_TTL, TrackCache, mGetTrackKey, mNormalizeInfo
+
+
+class CountingExtractor:
+    def __init__(self, aPath: str) -> None:
+        self.path = aPath
+        self.calls = 0
+
+    def mExtract(self, aUrl: str, aDownload: bool = True):
+        self.calls += 1
+        return {"id": 'abc', "title": 'Song', "duration": 200, "webpage_url": 'https://www.youtube.com/watch?v=abc', "formats": [
+            {"format_id": '251', "url": 'https://media.example/abc?expire=1700000000&sig=x', "acodec": 'opus', "abr": 160, "http_headers": {}},
+            {"format_id": '137', "url": 'https://media.example/video', "acodec": 'none'}
+        ]}, self.path
+
+
+class TestTrackCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpDir.name, 'tracks.db')
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def test_keys_and_normalized_info(self):
+        self.assertEqual(mGetTrackKey('https://youtu.be/abc?t=30'), 'youtube:abc')
+        self.assertEqual(mGetTrackKey('https://music.youtube.com/watch?v=abc&list=RD'), 'youtube:abc')
+        self.assertEqual(mGetTrackKey('HTTPS://Example.com/a?b=2&a=1#top'), 'https://example.com/a?a=1&b=2')
+        _info = mNormalizeInfo(CountingExtractor('song.webm').mExtract('abc')[0], 'song.webm')
+        self.assertEqual([_format["format_id"] for _format in _info["formats"]], ['251'])
+        self.assertEqual((_info["stream_expires"], _info["path"]), (1700000000.0, 'song.webm'))
+
+    def test_entries_persist_and_expire(self):
+        _cache = TrackCache(self.path, aTTLSeconds=0.2)
+        _cache.mSet('https://youtu.be/abc', {"title": 'Song', "webpage_url": 'https://www.youtube.com/watch?v=abc'})
+        _cache.mClose()
+        _cache = TrackCache(self.path, aTTLSeconds=0.2)
+        self.assertEqual(_cache.mGet('https://www.youtube.com/watch?v=abc')["title"], 'Song')
+        time.sleep(0.25)
+        self.assertIsNone(_cache.mGet('https://youtu.be/abc'))
+        self.assertEqual(_cache.mGetStats()["expired"], 1)
+        self.assertEqual(_cache.mPurge(), 0)
+        self.assertEqual(len(_cache), 0)
+        _cache.mClose()
+
+    def test_cached_extractor_skips_extraction(self):
+        _audio = os.path.join(self.tmpDir.name, 'abc.webm')
+        open(_audio, 'wb').close()
+        _extractor = CountingExtractor(_audio)
+        _cached = CachedExtractor(_extractor, TrackCache(self.path))
+        self.assertEqual(asyncio.run(mGetSource('https://youtu.be/abc', _cached))[1], _audio)
+        _info, _path = asyncio.run(mGetSource('https://www.youtube.com/watch?v=abc&t=5', _cached))
+        self.assertEqual((_info["title"], _path, _extractor.calls), ('Song', _audio, 1))
+        # A deleted download is extracted again
+        os.remove(_audio)
+        _cached.mExtract('https://youtu.be/abc')
+        self.assertEqual(_extractor.calls, 2)
+        _cached.cache.mClose()
+
+    def test_streams_without_expiry_get_a_default(self):
+        _info = mNormalizeInfo({"title": 'Song', "duration": 200, "url": 'https://media.example/abc'})
+        self.assertAlmostEqual(_info["stream_expires"], time.time() + STREAM_URL_TTL, delta=5)
+        self.assertTrue(mIsStreamValid(_info))
+        # Stream URLs cached without an expiry aren't trusted
+        self.assertFalse(mIsStreamValid({"url": 'https://media.example/abc', "stream_expires": None}))
+
+
+if __name__ == "__main__":
+    unittest.main()